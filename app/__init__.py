@@ -1,18 +1,66 @@
 from flask import Flask
-from .limiter import limiter
+from flask_limiter import RateLimitExceeded
+from .limiter import limiter, rate_limit_exceeded
+from .json_provider import JSONProvider
+from .metrics import metrics
 from .database import db
 from config import DevelopmentConfig
+from .migrations import migrate_command
 from .blueprints.asset import asset_blueprint
 from .blueprints.oee import oee_blueprint
+from .blueprints.status import status_blueprint
+from .blueprints.metrics import metrics_blueprint
+from .services.ingest_buffer import ingest_buffer
+from .models.oee_cache import latest_oee_cache
+from .models.asset_index import asset_index
+from .services.hierarchy_rollup import hierarchy_rollup
+from .services.rolling_oee import rolling_oee
+from .services.shift_calendar import shift_calendars
 
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(DevelopmentConfig)
+    app.json = JSONProvider(app)
+    JSONProvider.log_encoder()
 
     limiter.init_app(app)
+    app.register_error_handler(RateLimitExceeded, rate_limit_exceeded)
+    metrics.init_app(app)
+
+    ingest_buffer.configure(
+        enabled=app.config['WRITE_BEHIND_ENABLED'],
+        max_size=app.config['WRITE_BEHIND_QUEUE_SIZE'],
+        batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+        flush_interval=app.config['WRITE_BEHIND_FLUSH_INTERVAL'],
+        block_timeout=app.config['WRITE_BEHIND_BLOCK_TIMEOUT'],
+        drain_timeout=app.config['WRITE_BEHIND_DRAIN_TIMEOUT'],
+        max_attempts=app.config['WRITE_BEHIND_MAX_ATTEMPTS'],
+        retry_backoff=app.config['WRITE_BEHIND_RETRY_BACKOFF']
+    )
+    latest_oee_cache.configure(
+        max_size=app.config['LATEST_CACHE_SIZE'],
+        ttl=app.config['LATEST_CACHE_TTL'],
+        check_interval=app.config['LATEST_CACHE_CHECK_INTERVAL']
+    )
+    asset_index.configure(ttl=app.config['ASSET_INDEX_TTL'])
+    shift_calendars.configure(ttl=app.config['SHIFT_CALENDAR_TTL'], backfill=app.config['SHIFT_CALENDAR_BACKFILL'])
+    hierarchy_rollup.configure(
+        enabled=app.config['HIERARCHY_ROLLUP_ENABLED'],
+        reseed_interval=app.config['HIERARCHY_ROLLUP_RESEED_INTERVAL']
+    )
+    rolling_oee.configure(
+        enabled=app.config['ROLLING_OEE_ENABLED'],
+        windows=app.config['ROLLING_OEE_WINDOWS'],
+        resolution=app.config['ROLLING_OEE_RESOLUTION'],
+        reseed_interval=app.config['ROLLING_OEE_RESEED_INTERVAL']
+    )
+
+    app.cli.add_command(migrate_command)
 
     app.register_blueprint(asset_blueprint, url_prefix='/asset')
     app.register_blueprint(oee_blueprint, url_prefix='/oee')
+    app.register_blueprint(status_blueprint, url_prefix='/status')
+    app.register_blueprint(metrics_blueprint)
 
     return app
@@ -1,7 +1,11 @@
-from flask import Blueprint, request
+from flask import Blueprint, request, jsonify
 from app.services.asset import *
-from app.limiter import limiter
+from app.limiter import read_limit, write_limit
 from app.models.asset import EnterpriseModel, SiteModel, AreaModel, LineModel, CellModel
+from app.models.asset_index import asset_index
+from app.models.oee import OeeModel
+from app.models.oee_cache import latest_oee_cache
+from app.conditional import not_modified, version_etag, with_validators
 
 
 asset_blueprint = Blueprint('asset', __name__, url_prefix='/asset')
@@ -9,11 +13,56 @@ asset_blueprint = Blueprint('asset', __name__, url_prefix='/asset')
 
 @asset_blueprint.route('/all', methods=['GET'])
 def get_tree_route():
-    return get_tree()
+    # The tree changes with the hierarchy and with the latest readings. The readings change
+    # with the write version shared by all workers, which is checked first so cached readings
+    # older than another worker's write are expired before the tree is built.
+    try:
+        index_version, index_modified_at = asset_index.validators()
+        write_version, written_at = latest_oee_cache.validate(OeeModel.get_write_version)
+    except Exception as e:
+        logger.error(f"Failed to load the asset index: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching all assets.'}), 500
+
+    # Without a write version the readings cannot be validated
+    if write_version is None:
+        return get_tree()
+
+    etag = version_etag(index_version, write_version)
+    last_modified = index_modified_at if written_at is None else max(index_modified_at, written_at)
+
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    return with_validators(get_tree(), etag, last_modified)
+
+
+@asset_blueprint.route('/site/<int:asset_id>/shifts', methods=['GET'])
+@read_limit()
+def get_shift_calendar_route(asset_id):
+    return get_shift_calendar(asset_id)
+
+
+@asset_blueprint.route('/site/<int:asset_id>/shifts', methods=['PUT'])
+@write_limit()
+def save_shift_calendar_route(asset_id):
+    data = request.get_json(silent=True)
+    return save_shift_calendar(asset_id, data)
+
+
+@asset_blueprint.route('/site/<int:asset_id>/shifts', methods=['DELETE'])
+@write_limit()
+def delete_shift_calendar_route(asset_id):
+    return delete_shift_calendar(asset_id)
+
+
+def limited(limit, view_func, endpoint_name):
+    # flask-limiter tells views apart by their name, which the views made for each asset class
+    # share, so one request would be charged once per class. Each is named after its endpoint.
+    view_func.__name__ = view_func.__qualname__ = endpoint_name
+    return limit(view_func)
 
 
 def create_asset_route(asset_class, create_func):
-    @limiter.limit("60/minute")
     def route_create_asset():
         data = request.get_json()
         result = create_func(asset_class, data)
@@ -24,31 +73,40 @@ def create_asset_route(asset_class, create_func):
     asset_blueprint.add_url_rule(
         route_path,
         endpoint=endpoint_name,
-        view_func=route_create_asset,
+        view_func=limited(write_limit(), route_create_asset, endpoint_name),
         methods=['POST']
     )
     # print(f"Created route: POST {route_path} => {endpoint_name}")
 
 
 def get_all_assets_route(asset_class, get_all_func):
-    @limiter.limit("60/minute")
     def route_get_all_assets():
+        try:
+            index_version, last_modified = asset_index.validators()
+        except Exception as e:
+            logger.error(f"Failed to load the asset index: {str(e)}", exc_info=True)
+            return jsonify({'error': 'An error occurred while fetching all assets.'}), 500
+
+        etag = version_etag(index_version)
+
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
         result = get_all_func(asset_class)
-        return result
+        return with_validators(result, etag, last_modified)
 
     endpoint_name = f'route_get_all_{asset_class.__name__.lower()}'
     route_path = f'/{asset_class.object_name.lower()}/all'
     asset_blueprint.add_url_rule(
         route_path,
         endpoint=endpoint_name,
-        view_func=route_get_all_assets,
+        view_func=limited(read_limit(), route_get_all_assets, endpoint_name),
         methods=['GET']
     )
     # print(f"Created route: GET {route_path} => {endpoint_name}")
 
 
 def get_parent_asset_route(asset_class, get_func):
-    @limiter.limit("60/minute")
     def route_get_parent_asset(asset_id):
         result = get_func(asset_class, asset_id)
         return result
@@ -58,14 +116,13 @@ def get_parent_asset_route(asset_class, get_func):
     asset_blueprint.add_url_rule(
         route_path,
         endpoint=endpoint_name,
-        view_func=route_get_parent_asset,
+        view_func=limited(read_limit(), route_get_parent_asset, endpoint_name),
         methods=['GET']
     )
     print(f"Created route: GET {route_path} => {endpoint_name}")
 
 
 def get_child_assets_route(asset_class, get_func):
-    @limiter.limit("60/minute")
     def route_get_child_assets(asset_id):
         result = get_func(asset_class, asset_id)
         return result
@@ -75,14 +132,53 @@ def get_child_assets_route(asset_class, get_func):
     asset_blueprint.add_url_rule(
         route_path,
         endpoint=endpoint_name,
-        view_func=route_get_child_assets,
+        view_func=limited(read_limit(), route_get_child_assets, endpoint_name),
         methods=['GET']
     )
     # print(f"Created route: GET {route_path} => {endpoint_name}")
 
 
+def get_descendant_assets_route(asset_class, get_func):
+    def route_get_descendant_assets(asset_id):
+        depth = request.args.get('depth')
+        if depth is not None:
+            try:
+                depth = int(depth)
+            except ValueError:
+                return jsonify({'error': 'depth must be a positive integer.'}), 400
+            if depth < 1:
+                return jsonify({'error': 'depth must be a positive integer.'}), 400
+        nested = request.args.get('nested', 'false').lower() in ('1', 'true', 'yes')
+        result = get_func(asset_class, asset_id, depth=depth, nested=nested)
+        return result
+
+    endpoint_name = f'route_get_descendant_assets_{asset_class.__name__.lower()}'
+    route_path = f'/{asset_class.object_name.lower()}/<int:asset_id>/descendants'
+    asset_blueprint.add_url_rule(
+        route_path,
+        endpoint=endpoint_name,
+        view_func=limited(read_limit(), route_get_descendant_assets, endpoint_name),
+        methods=['GET']
+    )
+
+
+def get_ancestor_assets_route(asset_class, get_func):
+    def route_get_ancestor_assets(asset_id):
+        nested = request.args.get('nested', 'false').lower() in ('1', 'true', 'yes')
+        result = get_func(asset_class, asset_id, nested=nested)
+        return result
+
+    endpoint_name = f'route_get_ancestor_assets_{asset_class.__name__.lower()}'
+    route_path = f'/{asset_class.object_name.lower()}/<int:asset_id>/ancestors'
+    asset_blueprint.add_url_rule(
+        route_path,
+        endpoint=endpoint_name,
+        view_func=limited(read_limit(), route_get_ancestor_assets, endpoint_name),
+        methods=['GET']
+    )
+
+
 def get_asset_route(asset_class, get_func):
-    @limiter.limit("60/minute")
     def route_get_asset(asset_id):
         result = get_func(asset_class, asset_id)
         return result
@@ -92,14 +188,13 @@ def get_asset_route(asset_class, get_func):
     asset_blueprint.add_url_rule(
         route_path,
         endpoint=endpoint_name,
-        view_func=route_get_asset,
+        view_func=limited(read_limit(), route_get_asset, endpoint_name),
         methods=['GET']
     )
     # print(f"Created route: GET {route_path} => {endpoint_name}")
 
 
 def update_asset_route(asset_class, update_func):
-    @limiter.limit("60/minute")
     def route_update_asset(asset_id):
         data = request.get_json()
         result = update_func(asset_class, data, asset_id)
@@ -110,14 +205,13 @@ def update_asset_route(asset_class, update_func):
     asset_blueprint.add_url_rule(
         route_path,
         endpoint=endpoint_name,
-        view_func=route_update_asset,
+        view_func=limited(write_limit(), route_update_asset, endpoint_name),
         methods=['PUT']
     )
     # print(f"Created route: PUT {route_path} => {endpoint_name}")
 
 
 def delete_asset_route(asset_class, delete_func):
-    @limiter.limit("60/minute")
     def route_delete_asset(asset_id):
         result = delete_func(asset_class, asset_id)
         return result
@@ -127,7 +221,7 @@ def delete_asset_route(asset_class, delete_func):
     asset_blueprint.add_url_rule(
         route_path,
         endpoint=endpoint_name,
-        view_func=route_delete_asset,
+        view_func=limited(write_limit(), route_delete_asset, endpoint_name),
         methods=['DELETE']
     )
     # print(f"Created route: DELETE {route_path} => {endpoint_name}")
@@ -181,3 +275,17 @@ get_child_assets_route(SiteModel, get_child_assets)
 get_child_assets_route(AreaModel, get_child_assets)
 get_child_assets_route(LineModel, get_child_assets)
 get_child_assets_route(CellModel, get_child_assets)
+
+# descendant assets routes
+get_descendant_assets_route(EnterpriseModel, get_descendant_assets)
+get_descendant_assets_route(SiteModel, get_descendant_assets)
+get_descendant_assets_route(AreaModel, get_descendant_assets)
+get_descendant_assets_route(LineModel, get_descendant_assets)
+get_descendant_assets_route(CellModel, get_descendant_assets)
+
+# ancestor assets routes
+get_ancestor_assets_route(EnterpriseModel, get_ancestor_assets)
+get_ancestor_assets_route(SiteModel, get_ancestor_assets)
+get_ancestor_assets_route(AreaModel, get_ancestor_assets)
+get_ancestor_assets_route(LineModel, get_ancestor_assets)
+get_ancestor_assets_route(CellModel, get_ancestor_assets)
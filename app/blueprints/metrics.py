@@ -0,0 +1,14 @@
+from flask import Blueprint, jsonify
+from app.metrics import metrics, metrics_response
+from app.limiter import read_limit
+
+# Create a Flask blueprint for the Prometheus metrics endpoint
+metrics_blueprint = Blueprint('metrics', __name__)
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+@read_limit()
+def get_metrics_route():
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled.'}), 404
+    return metrics_response()
@@ -1,8 +1,21 @@
 # Import necessary modules
-from flask import Blueprint, request, jsonify
-from app.services.oee import calculate_oee, get_latest_oee, get_oee_by_date_range
-from app.services.historian import insert_oee_data
-from app.limiter import limiter
+import numpy as np
+from flask import Blueprint, Response, current_app, g, request, jsonify, stream_with_context
+from app.services.oee import (calculate_oee, calculate_oee_batch, get_child_level_keys, get_latest_oee,
+                              get_latest_oee_batch, get_oee_by_date_range, get_oee_history_batch,
+                              get_oee_ranking, get_rolling_oee_batch, parse_object_keys,
+                              store_oee_batch, stream_oee_by_date_range)
+from app.services.historian import insert_oee_data, find_missing_field
+from app.services.ingest_buffer import ingest_buffer
+from app.services.ingest_format import decode_msgpack, encode_msgpack, msgpack_mimetypes
+from app.services.downsample import downsample_methods
+from app.services.rolling_oee import rolling_oee
+from app.models.oee import OeeModel
+from app.models.asset_factory import asset_factory
+from app.models.asset_index import asset_index
+from app.limiter import ingest_limit, read_limit
+from app.metrics import track_serialization
+from app.conditional import IMMUTABLE, content_etag, not_modified, range_closed_at, with_validators
 import logging
 
 # Create a Flask blueprint for OEE calculations
@@ -13,22 +26,161 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Upper bound of max_points, and the metrics a history range can be downsampled by
+max_history_points = 10000
+downsample_metrics = ('oee', 'availability', 'performance', 'quality')
+
+# Most assets one history batch request can read
+max_history_assets = 500
+
+# Most assets one ranking returns, and the orders it can rank in
+max_rank_size = 1000
+rank_orders = ('worst', 'best')
+
+# Content types of the history export formats
+export_mimetypes = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def read_payload(silent=False):
+    # JSON by default; msgpack bodies are decoded with their binary columns as numpy arrays.
+    # Both are parsed once per request, as the rate limit cost reads them before the route.
+    if request.mimetype in msgpack_mimetypes:
+        if 'payload' not in g:
+            g.payload = decode_msgpack(request.get_data())
+        return g.payload
+    return request.get_json(silent=silent)
+
+
+def batch_cost():
+    # Batch routes are charged one unit per record: the length of the longest column
+    try:
+        data = read_payload(silent=True)
+    except ValueError:
+        return 1
+    if not isinstance(data, dict):
+        return 1
+    lengths = [len(value) for value in data.values() if isinstance(value, (list, np.ndarray))]
+    return max(lengths, default=1) or 1
+
+
+def history_batch_cost():
+    # One unit per listed asset, or per asset of the level under the parent. Requests the route
+    # rejects are charged one unit.
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return 1
+    if isinstance(data.get('assets'), list):
+        return len(data['assets']) or 1
+    if data.get('parent') is not None and data.get('level') is not None:
+        try:
+            parent_type, parent_id = parse_object_keys([data['parent']])[0]
+            return len(get_child_level_keys(parent_type, parent_id, data['level'])) or 1
+        except Exception:
+            return 1
+    return 1
+
+
+def is_object_type(value):
+    # A JSON integer between 0 and 4; true, false and 1.0 compare equal to integers but are not
+    return isinstance(value, int) and not isinstance(value, bool) and value in range(5)
+
+
+def latest_batch_cost():
+    # One unit per asset looked up, or per asset of the requested level
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return 1
+    if isinstance(data.get('assets'), list):
+        return len(data['assets']) or 1
+    if is_object_type(data.get('object_type')):
+        try:
+            return len(asset_index.of_type(data['object_type'])) or 1
+        except Exception:
+            return 1
+    return 1
+
+
+def parse_downsampling(max_points, metric, method):
+    # Validate the downsampling parameters of a history request; returns max_points as an int,
+    # or None when the range is not downsampled
+    if max_points is None:
+        return None
+    try:
+        max_points = int(max_points)
+    except (TypeError, ValueError):
+        max_points = 0
+    if not 3 <= max_points <= max_history_points:
+        raise ValueError(f'max_points must be an integer between 3 and {max_history_points}.')
+    if metric not in downsample_metrics:
+        raise ValueError(f"metric must be one of: {', '.join(downsample_metrics)}.")
+    if method not in downsample_methods:
+        raise ValueError(f"downsample must be one of: {', '.join(downsample_methods)}.")
+    return max_points
+
+
+def wants_msgpack():
+    accepted = request.accept_mimetypes.best_match(('application/json',) + msgpack_mimetypes)
+    return accepted in msgpack_mimetypes
+
+
 # Define the routes for OEE
 
 
 @oee_blueprint.route('/calculate', methods=['POST'])
-@limiter.limit("60/minute")
+@ingest_limit()
 def calculate_route():
-    data = request.get_json()
-    result = calculate_oee(data)
+    try:
+        data = read_payload()
+        result = calculate_oee(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     return result
 
 
+@oee_blueprint.route('/calculate/batch', methods=['POST'])
+@ingest_limit(cost=batch_cost)
+def calculate_batch_route():
+    try:
+        data = read_payload(silent=True)
+
+        if not isinstance(data, dict):
+            return jsonify({'error': 'A JSON object of columns is required.'}), 400
+
+        if wants_msgpack():
+            result = calculate_oee_batch(data, as_arrays=True)
+            with track_serialization('msgpack'):
+                body = encode_msgpack(result)
+            return Response(body, mimetype=msgpack_mimetypes[0]), 200
+
+        result = calculate_oee_batch(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return result, 200
+
+
 @oee_blueprint.route('/calculate/store', methods=['POST'])
-@limiter.limit("60/minute")
+@ingest_limit()
 def calculate_and_store_route():
-    data = request.get_json()
-    result = calculate_oee(data)
+    try:
+        data = read_payload()
+        result = calculate_oee(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # In write-behind mode, queue the record and let the background flusher store it
+    if ingest_buffer.enabled:
+        missing_field = find_missing_field(result)
+        if missing_field is not None:
+            return jsonify({'error': f'Missing required field: {missing_field}'}), 400
+
+        if not ingest_buffer.put(result):
+            return jsonify({'error': 'The ingest queue is full. Please retry later.'}), 429
+
+        return result, 202
 
     # Insert the calculated OEE data into the database
     insert_response, insert_status = insert_oee_data(result)
@@ -42,8 +194,27 @@ def calculate_and_store_route():
     return result, 200
 
 
+@oee_blueprint.route('/calculate/store/batch', methods=['POST'])
+@ingest_limit(cost=batch_cost)
+def calculate_and_store_batch_route():
+    try:
+        data = read_payload(silent=True)
+
+        if not isinstance(data, dict):
+            return jsonify({'error': 'A JSON object of columns is required.'}), 400
+
+        result = store_oee_batch(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"An error occurred while storing the OEE batch: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while storing the OEE batch.'}), 500
+
+    return result, 200
+
+
 @oee_blueprint.route('/<int:object_type>/<int:object_id>', methods=['GET'])
-@limiter.limit("60/minute")
+@read_limit()
 def get_latest_oee_route(object_type, object_id):
     # Retrieve OEE data from the historian based on the object_type and object_id
     oee_data = get_latest_oee(object_type, object_id)
@@ -55,21 +226,274 @@ def get_latest_oee_route(object_type, object_id):
     return jsonify(oee_data), 200
 
 
+@oee_blueprint.route('/latest/batch', methods=['POST'])
+@read_limit(cost=latest_batch_cost)
+def get_latest_oee_batch_route():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'A JSON object is required.'}), 400
+    assets = data.get('assets')
+    object_type = data.get('object_type')
+
+    if assets is None and object_type is None:
+        return jsonify({'error': 'Either assets or object_type is required.'}), 400
+
+    try:
+        if object_type is not None:
+            if not is_object_type(object_type):
+                raise ValueError("object_type must be an integer between 0 and 4.")
+            oee_data = get_latest_oee_batch(object_type=object_type)
+        else:
+            oee_data = get_latest_oee_batch(object_keys=parse_object_keys(assets))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"An error occurred while fetching latest OEE data in batch: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching latest OEE data.'}), 500
+
+    return jsonify(oee_data), 200
+
+
 @oee_blueprint.route('/history/<int:object_type>/<int:object_id>', methods=['GET'])
-@limiter.limit("60/minute")
+@read_limit()
 def get_oee_by_date_range_route(object_type, object_id):
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
+    bucket = request.args.get('bucket')
+
     if not start_date or not end_date:
         return jsonify({'error': 'start_date and end_date parameters are required.'}), 400
 
+    if bucket is not None and bucket not in OeeModel.history_buckets:
+        return jsonify({'error': f"bucket must be one of: {', '.join(OeeModel.history_buckets)}."}), 400
+
+    export_format = request.args.get('format')
+    if export_format is not None and export_format not in export_mimetypes:
+        return jsonify({'error': f"format must be one of: {', '.join(export_mimetypes)}."}), 400
+
+    # Downsampling to at most max_points, chosen by the shape of one metric
+    metric = request.args.get('metric', 'oee')
+    method = request.args.get('downsample', 'lttb')
+    try:
+        max_points = parse_downsampling(request.args.get('max_points'), metric, method)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if max_points is not None and export_format is not None:
+        return jsonify({'error': 'max_points cannot be combined with format.'}), 400
+
+    # Stored rows are exported, or returned as JSON when downsampling bounds their number
+    raw = (export_format is not None or max_points is not None) \
+        and request.args.get('raw', 'false').lower() in ('1', 'true', 'yes')
+
+    # A range that ended long enough ago can no longer change, so it gets immutable validators
+    # and a matching request is answered without running the query. Shift rows are rebuilt when
+    # a site's calendar changes, so they never are.
+    try:
+        closed_at = range_closed_at(OeeModel._parse_timestamp(end_date), current_app.config['HISTORY_CLOSED_AFTER'],
+                                    OeeModel.rollup_lengths.get(bucket)) if bucket != 'shift' else None
+    except ValueError:
+        closed_at = None
+    if closed_at is not None:
+        etag = content_etag(object_type, object_id, start_date, end_date, bucket, export_format, raw,
+                            max_points, metric, method)
+        response = not_modified(etag, closed_at, IMMUTABLE)
+        if response is not None:
+            return response
+
+    # Stream the range as NDJSON or CSV when an export format is requested
+    if export_format is not None:
+        try:
+            chunks = stream_oee_by_date_range(object_type, object_id, start_date, end_date, export_format,
+                                              bucket=bucket, raw=raw)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        result = Response(stream_with_context(chunks), mimetype=export_mimetypes[export_format])
+        return with_validators(result, etag, closed_at, IMMUTABLE) if closed_at is not None else result
+
     try:
         # Call the service to get OEE data by date range
-        oee_data = get_oee_by_date_range(object_type, object_id, start_date, end_date)
-        return jsonify(oee_data), 200
+        oee_data = get_oee_by_date_range(object_type, object_id, start_date, end_date, bucket, raw=raw,
+                                         max_points=max_points, metric=metric, method=method)
+        result = jsonify(oee_data), 200
+        return with_validators(result, etag, closed_at, IMMUTABLE) if closed_at is not None else result
 
     except Exception as e:
         logger.error(f"An error occurred while fetching OEE data by date range: {str(e)}", exc_info=True)
         return jsonify({'error': 'An error occurred while fetching OEE data by date range.'}), 500
 
+
+@oee_blueprint.route('/history/batch', methods=['POST'])
+@read_limit(cost=history_batch_cost)
+def get_oee_history_batch_route():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'A JSON object is required.'}), 400
+
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    bucket = data.get('bucket')
+    metric = data.get('metric', 'oee')
+    method = data.get('downsample', 'lttb')
+
+    if not isinstance(start_date, str) or not isinstance(end_date, str):
+        return jsonify({'error': 'start_date and end_date are required.'}), 400
+
+    if bucket is not None and (not isinstance(bucket, str) or bucket not in OeeModel.history_buckets):
+        return jsonify({'error': f"bucket must be one of: {', '.join(OeeModel.history_buckets)}."}), 400
+
+    try:
+        max_points = parse_downsampling(data.get('max_points'), metric, method)
+
+        # Either a list of assets, or every asset of one level under a parent
+        if data.get('assets') is not None:
+            object_keys = list(dict.fromkeys(parse_object_keys(data['assets'])))
+        elif data.get('parent') is not None and data.get('level') is not None:
+            parent_type, parent_id = parse_object_keys([data['parent']])[0]
+            object_keys = get_child_level_keys(parent_type, parent_id, data['level'])
+        else:
+            return jsonify({'error': 'Either assets, or parent and level, are required.'}), 400
+
+        if len(object_keys) > max_history_assets:
+            return jsonify({'error': f'At most {max_history_assets} assets can be read at once.'}), 400
+
+        # Dates are checked here, before a query is run for any asset
+        OeeModel._parse_timestamp(start_date)
+        OeeModel._parse_timestamp(end_date)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not object_keys:
+        return jsonify([]), 200
+
+    try:
+        series = get_oee_history_batch(object_keys, start_date, end_date, bucket, max_points=max_points,
+                                       metric=metric, method=method)
+    except Exception as e:
+        logger.error(f"An error occurred while fetching OEE data of several assets: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching OEE data by date range.'}), 500
+
+    return jsonify(series), 200
+
+
+def read_rolling_window(window):
+    # Validate the window of a rolling OEE request; None selects every configured window
+    if window is not None and (not isinstance(window, str) or window not in rolling_oee.windows):
+        raise ValueError(f"window must be one of: {', '.join(rolling_oee.windows)}.")
+    return window
+
+
+@oee_blueprint.route('/rolling/<int:object_type>/<int:object_id>', methods=['GET'])
+@read_limit()
+def get_rolling_oee_route(object_type, object_id):
+    if not rolling_oee.enabled:
+        return jsonify({'error': 'Rolling-window OEE is disabled.'}), 404
+
+    try:
+        window = read_rolling_window(request.args.get('window'))
+        if asset_index.get(object_type, object_id) is None:
+            return jsonify({'error': 'Asset not found'}), 404
+        result = get_rolling_oee_batch([(object_type, object_id)], window)[0]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"An error occurred while fetching rolling OEE data: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching rolling OEE data.'}), 500
+
+    return jsonify(result), 200
+
+
+@oee_blueprint.route('/rolling/batch', methods=['POST'])
+@read_limit(cost=latest_batch_cost)
+def get_rolling_oee_batch_route():
+    if not rolling_oee.enabled:
+        return jsonify({'error': 'Rolling-window OEE is disabled.'}), 404
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'A JSON object is required.'}), 400
+
+    assets = data.get('assets')
+    object_type = data.get('object_type')
+
+    if assets is None and object_type is None:
+        return jsonify({'error': 'Either assets or object_type is required.'}), 400
+
+    try:
+        window = read_rolling_window(data.get('window'))
+        if object_type is not None:
+            if not is_object_type(object_type):
+                raise ValueError("object_type must be an integer between 0 and 4.")
+            object_keys = [(object_type, item.id) for item in asset_index.of_type(object_type)]
+        else:
+            object_keys = parse_object_keys(assets)
+        result = get_rolling_oee_batch(object_keys, window)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"An error occurred while fetching rolling OEE data in batch: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching rolling OEE data.'}), 500
+
+    return jsonify(result), 200
+
+
+def parse_level(level):
+    # A hierarchy level given by name, such as cell, or by object_type
+    names = {asset_factory.get_asset(object_type).object_name: object_type for object_type in range(5)}
+    if level in names:
+        return names[level]
+    try:
+        object_type = int(level)
+    except (TypeError, ValueError):
+        object_type = None
+    if object_type not in range(5):
+        raise ValueError(f"level must be one of: {', '.join(names)}, or an object_type between 0 and 4.")
+    return object_type
+
+
+@oee_blueprint.route('/rank', methods=['GET'])
+@read_limit()
+def get_oee_ranking_route():
+    metric = request.args.get('metric', 'oee')
+    order = request.args.get('order', 'worst')
+    window = request.args.get('window')
+
+    try:
+        level = parse_level(request.args.get('level', 'cell'))
+        if metric not in downsample_metrics:
+            raise ValueError(f"metric must be one of: {', '.join(downsample_metrics)}.")
+        if order not in rank_orders:
+            raise ValueError(f"order must be one of: {', '.join(rank_orders)}.")
+        try:
+            n = int(request.args.get('n', 20))
+        except ValueError:
+            n = 0
+        if not 1 <= n <= max_rank_size:
+            raise ValueError(f'n must be an integer between 1 and {max_rank_size}.')
+
+        if window is not None:
+            if not rolling_oee.enabled:
+                return jsonify({'error': 'Rolling-window OEE is disabled.'}), 404
+            read_rolling_window(window)
+
+        # Only the subtree of a parent asset is ranked when one is given
+        parent = None
+        if request.args.get('parent_type') is not None or request.args.get('parent_id') is not None:
+            try:
+                parent = (int(request.args['parent_type']), int(request.args['parent_id']))
+            except (KeyError, ValueError):
+                raise ValueError('parent_type and parent_id must both be integers.')
+
+        result = get_oee_ranking(level, metric=metric, n=n, order=order, window=window, parent=parent)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"An error occurred while ranking OEE data: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while ranking OEE data.'}), 500
+
+    return jsonify(result), 200
@@ -0,0 +1,26 @@
+from flask import Blueprint, jsonify
+from app.database import connection_pool
+from app.models.oee_cache import latest_oee_cache
+from app.services.ingest_buffer import ingest_buffer
+from app.limiter import read_limit
+
+# Create a Flask blueprint for server status and statistics
+status_blueprint = Blueprint('status', __name__)
+
+
+@status_blueprint.route('/pool', methods=['GET'])
+@read_limit()
+def get_pool_stats_route():
+    return jsonify(connection_pool.stats()), 200
+
+
+@status_blueprint.route('/ingest', methods=['GET'])
+@read_limit()
+def get_ingest_stats_route():
+    return jsonify(ingest_buffer.stats()), 200
+
+
+@status_blueprint.route('/cache', methods=['GET'])
+@read_limit()
+def get_cache_stats_route():
+    return jsonify(latest_oee_cache.stats()), 200
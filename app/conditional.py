@@ -0,0 +1,50 @@
+import os
+import hashlib
+from datetime import datetime, timedelta, timezone
+from flask import Response, make_response, request
+from werkzeug.http import is_resource_modified
+
+# Version counters are per process. Tagging their ETags with a token of this process keeps a
+# worker from answering 304 to a validator issued by another worker at the same version.
+process_token = os.urandom(4).hex()
+
+# Cache-Control of responses that can never change
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def version_etag(*versions):
+    return '-'.join([process_token, *map(str, versions)])
+
+
+def content_etag(*parts):
+    # ETag derived from the request alone, the same in every worker
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(etag, last_modified=None, cache_control=None):
+    # A 304 response when the request's validators still match, otherwise None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(Response(status=304), etag, last_modified, cache_control)
+
+
+def with_validators(result, etag, last_modified=None, cache_control=None):
+    # Attach the validators to a successful view result; errors are sent as they are
+    response = make_response(result)
+    if response.status_code not in (200, 304):
+        return response
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if cache_control is not None:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def range_closed_at(end, closed_after, bucket_length=None):
+    # When a history range ending at end stopped changing, or None while it can still change.
+    # Timestamps are set by the server as records are calculated, so a range is closed
+    # closed_after seconds after its end, or after the end of its last bucket.
+    closed_at = end + timedelta(seconds=closed_after) + (bucket_length or timedelta(0))
+    return closed_at if closed_at <= datetime.now(timezone.utc) else None
@@ -1,4 +1,279 @@
 # database.py
+import os
+import time
+import threading
+import logging
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
 
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 db = SQLAlchemy()
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool shared by the asset, OEE and historian paths.
+
+    Sizes and timeouts come from DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT and
+    DB_POOL_PRE_PING. Nothing is opened until the first checkout, which warms the pool up
+    to its minimum size. Idle connections are kept up to the maximum size instead of being
+    closed on return, and broken connections are discarded and replaced.
+    """
+
+    # Upper bounds (in seconds) of the checkout latency histogram buckets
+    latency_buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._settings = None
+        self._idle = []
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        # Counters reported by stats()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._replaced = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._latency_counts = [0] * (len(self.latency_buckets) + 1)
+        self._latency_sum = 0.0
+
+    @staticmethod
+    def _read_settings():
+        return {
+            'min_size': int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+            'max_size': int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+            'timeout': float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            'pre_ping': os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes"),
+        }
+
+    @staticmethod
+    def _connect():
+        return psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+
+    def _warm_up(self):
+        # Open the minimum number of connections; called once, on the first checkout
+        settings = self._settings
+        for _ in range(settings['min_size'] - 1):
+            try:
+                connection = self._connect()
+            except psycopg2.Error as e:
+                logger.error(f"Failed to warm up the connection pool: {e}")
+                return
+            with self._condition:
+                if self._opened >= settings['max_size']:
+                    connection.close()
+                    return
+                self._opened += 1
+                self._idle.append(connection)
+                self._condition.notify()
+
+    def _is_usable(self, connection):
+        if connection.closed:
+            return False
+        if not self._settings['pre_ping']:
+            return True
+        try:
+            with connection.cursor() as cur:
+                cur.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release_slot(self):
+        with self._condition:
+            self._opened -= 1
+            self._in_use -= 1
+            self._condition.notify()
+
+    def getconn(self):
+        started = time.perf_counter()
+        warm_up = False
+
+        with self._condition:
+            if self._settings is None:
+                self._settings = self._read_settings()
+                warm_up = True
+            settings = self._settings
+
+            # Wait for an idle connection or a free slot, up to the checkout timeout
+            deadline = started + settings['timeout']
+            while not self._idle and self._opened >= settings['max_size']:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"Timed out after {settings['timeout']}s waiting for a database connection."
+                    )
+                self._waiting += 1
+                self._condition.wait(remaining)
+                self._waiting -= 1
+
+            waited = time.perf_counter() - started
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+            # Take an idle connection, or reserve a slot for a new one
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                self._opened += 1
+            self._in_use += 1
+
+        if connection is not None and not self._is_usable(connection):
+            logger.warning("Discarding a broken database connection.")
+            connection.close()
+            connection = None
+            with self._condition:
+                self._replaced += 1
+
+        if connection is None:
+            try:
+                connection = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+
+        if warm_up:
+            self._warm_up()
+
+        self._record_checkout(time.perf_counter() - started)
+        return connection
+
+    def putconn(self, connection):
+        # Return the connection in a clean state, or drop it if it is broken
+        discard = bool(connection.closed)
+        if not discard:
+            status = connection.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if discard:
+            if not connection.closed:
+                connection.close()
+            self._release_slot()
+            return
+
+        with self._condition:
+            self._in_use -= 1
+            self._idle.append(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def _record_checkout(self, latency):
+        with self._condition:
+            self._checkouts += 1
+            self._latency_sum += latency
+            for index, bucket in enumerate(self.latency_buckets):
+                if latency <= bucket:
+                    self._latency_counts[index] += 1
+                    break
+            else:
+                self._latency_counts[-1] += 1
+
+    def stats(self):
+        with self._condition:
+            settings = self._settings or self._read_settings()
+
+            # Cumulative bucket counts, the last bucket being +Inf
+            buckets = {}
+            cumulative = 0
+            for bucket, count in zip(self.latency_buckets + ('+Inf',), self._latency_counts):
+                cumulative += count
+                buckets[str(bucket)] = cumulative
+
+            return {
+                'min_size': settings['min_size'],
+                'max_size': settings['max_size'],
+                'timeout': settings['timeout'],
+                'open': self._opened,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'replaced': self._replaced,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+                'checkout_latency': {
+                    'buckets': buckets,
+                    'count': self._checkouts,
+                    'sum': self._latency_sum,
+                },
+            }
+
+    def close_all(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for connection in idle:
+            connection.close()
+
+
+connection_pool = ConnectionPool()
+
+
+class FanOut:
+    """Runs independent database calls concurrently, each on its own pooled connection.
+
+    The width comes from DB_FANOUT_WORKERS and should stay below DB_POOL_MAX_SIZE. The worker
+    threads are started on first use. Under gevent they are greenlets, so a fan-out costs no
+    OS threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.width = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self.width is None:
+                self.width = max(int(os.getenv("DB_FANOUT_WORKERS", 4)), 1)
+                if self.width > 1:
+                    self._executor = ThreadPoolExecutor(max_workers=self.width, thread_name_prefix='db-fan-out')
+
+    def run(self, calls):
+        # Call every callable and return their results in order; the first failure is raised
+        calls = list(calls)
+        self._ensure_started()
+        if self._executor is None or len(calls) < 2:
+            return [call() for call in calls]
+
+        futures = [self._executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+
+fan_out = FanOut()
@@ -0,0 +1,30 @@
+import psycopg2
+from psycopg2 import extensions
+
+
+def gevent_wait_callback(connection, timeout=None):
+    # Wait for the connection's socket through the gevent hub instead of blocking the worker,
+    # so other greenlets keep running while a query is in flight
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+
+def make_psycopg2_green():
+    # Make every psycopg2 connection of this process cooperative. Must run in each worker
+    # process once gevent has patched it, before the first connection is opened.
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        raise RuntimeError("The gevent serving mode requires gevent: pip install gevent")
+
+    extensions.set_wait_callback(gevent_wait_callback)
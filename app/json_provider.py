@@ -0,0 +1,108 @@
+import math
+import decimal
+import logging
+import dataclasses
+from datetime import date, datetime, timezone
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Create a logger
+logger = logging.getLogger(__name__)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """JSON provider of the application, encoding with orjson when it is installed.
+
+    orjson encodes dicts, datetimes, dataclasses (the slotted asset and history rows included)
+    and numpy values in compiled code. Without it, the standard library encoder produces the
+    same documents: NaN and infinity are written as null, and float32 values in their shortest
+    form. Datetimes are written in ISO 8601, or as HTTP dates with JSON_HTTP_DATES, and naive
+    datetimes are taken as UTC. Keys are not sorted. Request bodies are still parsed by the
+    standard library.
+    """
+    sort_keys = False
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.http_dates = app.config.get('JSON_HTTP_DATES', False)
+        self.default = self._default
+
+        self._options = 0
+        if orjson is not None:
+            self._options = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            if self.http_dates:
+                self._options |= orjson.OPT_PASSTHROUGH_DATETIME
+
+    @staticmethod
+    def log_encoder():
+        # Called once at startup, so a deployment missing orjson shows in its logs
+        if orjson is not None:
+            logger.info("JSON responses are encoded with orjson.")
+        else:
+            logger.warning("orjson is not installed; JSON responses are encoded with the standard library encoder.")
+
+    def _default(self, o):
+        # Types neither encoder handles itself. Datetimes only get here from the standard library
+        # encoder, or from orjson when they are written as HTTP dates.
+        if isinstance(o, date):
+            if self.http_dates:
+                return http_date(o)
+            if isinstance(o, datetime) and o.tzinfo is None:
+                o = o.replace(tzinfo=timezone.utc)
+            return o.isoformat()
+        if isinstance(o, np.generic):
+            # float64 is a float; narrower floats are written in their shortest form, as by orjson
+            return float(str(o)) if isinstance(o, np.floating) else o.item()
+        if isinstance(o, np.ndarray):
+            if o.dtype.kind == 'f' and o.dtype.itemsize < 8:
+                return o.astype(str).astype(float).tolist()
+            return o.tolist()
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        if dataclasses.is_dataclass(o) and hasattr(o, '__slots__'):
+            # Slotted rows hold no nested dataclasses, so they skip the deep copy of asdict
+            return {name: getattr(o, name) for name in o.__slots__}
+        return DefaultJSONProvider.default(o)
+
+    def _finite(self, o):
+        # A copy of o with NaN and infinity replaced by None, converting what the encoders
+        # leave to default first
+        if isinstance(o, float):
+            return o if math.isfinite(o) else None
+        if isinstance(o, (str, int)) or o is None:
+            return o
+        if isinstance(o, dict):
+            return {key: self._finite(value) for key, value in o.items()}
+        if isinstance(o, (list, tuple)):
+            return [self._finite(value) for value in o]
+        return self._finite(self._default(o))
+
+    def encode(self, obj, indent=False):
+        # The document as bytes; every body the application serializes goes through here
+        if orjson is None:
+            options = {'indent': 2} if indent else {'separators': (',', ':')}
+            try:
+                return super().dumps(obj, allow_nan=False, **options).encode()
+            except ValueError:
+                # Only documents holding NaN or infinity pay for the copy that writes them as null
+                return super().dumps(self._finite(obj), **options).encode()
+        return orjson.dumps(obj, default=self._default,
+                            option=self._options | (orjson.OPT_INDENT_2 if indent else 0))
+
+    def dumps(self, obj, **kwargs):
+        # Options such as indent or sort_keys are only understood by the standard library encoder
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+
+    def response(self, *args, **kwargs):
+        # As the default provider: pretty-printed in debug mode unless compact is set
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.encode(obj, indent=indent) + b'\n', mimetype=self.mimetype)
@@ -1,3 +1,79 @@
+import hashlib
+from functools import wraps
+from flask import current_app, request, jsonify
 from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits import parse_many
 
-limiter = Limiter(key_func=lambda: 'global')
+
+def client_key():
+    # Budgets are kept per client: the API key when the request carries one, otherwise the
+    # remote address. Keys are hashed so they are not written to the rate limit storage.
+    api_key = request.headers.get(current_app.config['RATELIMIT_KEY_HEADER'])
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    return 'addr:' + (get_remote_address() or 'unknown')
+
+
+limiter = Limiter(key_func=client_key)
+
+
+def budget(config_key):
+    # Most units one request can be charged: the limit of the tightest window. A request
+    # charged more would be over that window however long the client waited.
+    return min(item.amount for item in parse_many(current_app.config[config_key]))
+
+
+def capped(cost, config_key):
+    # Charge a callable cost at most the budget, so a large batch empties the tightest window
+    # instead of being rejected forever
+    if not callable(cost):
+        return cost
+    return lambda: min(cost(), budget(config_key))
+
+
+def ingest_limit(cost=1):
+    # Shared budget of the calculate and store routes; cost may be a callable, charged per request.
+    # Records are the unit of the ingest rate, so a batch over the budget is not capped but
+    # rejected with 400, charged one unit; the cost callable itself must not raise, as the
+    # limiter takes any error there for unreachable storage.
+    config_key = 'RATELIMIT_INGEST'
+    if not callable(cost):
+        return limiter.shared_limit(lambda: current_app.config[config_key], scope='ingest', cost=cost)
+
+    def charged():
+        units = cost()
+        return units if units <= budget(config_key) else 1
+
+    limit = limiter.shared_limit(lambda: current_app.config[config_key], scope='ingest', cost=charged)
+
+    def decorator(view_func):
+        limited_view = limit(view_func)
+
+        @wraps(view_func)
+        def within_budget(*args, **kwargs):
+            most = budget(config_key)
+            if cost() > most:
+                return jsonify({'error': f'A batch can hold at most {most} records under the ingest rate limit. '
+                                         'Please split it.'}), 400
+            return limited_view(*args, **kwargs)
+
+        return within_budget
+
+    return decorator
+
+
+def write_limit(cost=1):
+    # Shared budget of the routes that change assets and shift calendars
+    return limiter.shared_limit(lambda: current_app.config['RATELIMIT_WRITE'], scope='write',
+                                cost=capped(cost, 'RATELIMIT_WRITE'))
+
+
+def read_limit(cost=1):
+    # Shared budget of every other route
+    return limiter.shared_limit(lambda: current_app.config['RATELIMIT_READ'], scope='read',
+                                cost=capped(cost, 'RATELIMIT_READ'))
+
+
+def rate_limit_exceeded(e):
+    return jsonify({'error': f'Rate limit exceeded: {e.description}. Please retry later.'}), 429
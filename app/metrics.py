@@ -0,0 +1,264 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Response, g, request, has_request_context
+from app.database import connection_pool
+from app.json_provider import JSONProvider
+
+# Upper bounds (in seconds) of the latency histogram buckets
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+text_content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    """Monotonic counter with optional labels, rendered in the Prometheus text format."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, self.label_names, labels, value
+
+
+class Histogram:
+    """Histogram with fixed buckets and optional labels, rendered in the Prometheus text format.
+
+    An observation costs a binary search and one locked update, so it is cheap enough for
+    every request and every query.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=latency_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # Per label values: the count of each bucket (not cumulative, the last one being +Inf) and the sum
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+
+        names = self.label_names + ('le',)
+        for labels, counts in values:
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', names, labels + (bucket,), cumulative
+            yield f'{self.name}_count', self.label_names, labels, cumulative
+            yield f'{self.name}_sum', self.label_names, labels, counts[-1]
+
+
+class Registry:
+    """The metrics of this process.
+
+    Counters and histograms are updated as the application runs. Collectors are called on
+    every scrape for values that other components already keep, such as the pool statistics,
+    and return (kind, name, documentation, samples) tuples.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, label_names=(), buckets=latency_buckets):
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def init_app(self, app):
+        # Time requests and JSON serialization; with METRICS_ENABLED off nothing is recorded.
+        # Replaces the JSON provider create_app installed with its timed subclass.
+        self.enabled = app.config['METRICS_ENABLED']
+        if not self.enabled:
+            return
+
+        app.json = TimedJSONProvider(app)
+        app.before_request(start_request_timer)
+        app.after_request(record_request)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        families = [(metric.kind, metric.name, metric.documentation, metric.samples()) for metric in self._metrics]
+        for collector in self._collectors:
+            families.extend(collector())
+
+        lines = []
+        for kind, name, documentation, samples in families:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, label_names, labels, value in samples:
+                lines.append(f'{sample_name}{format_labels(label_names, labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Registry()
+
+request_duration = metrics.histogram(
+    'oee_http_request_duration_seconds', 'Time to handle a request, by route, method and status.',
+    ('route', 'method', 'status')
+)
+query_duration = metrics.histogram(
+    'oee_db_query_duration_seconds', 'Time to run a named database query and fetch its rows.', ('query',)
+)
+query_rows = metrics.counter(
+    'oee_db_query_rows_total', 'Rows returned or written by a named database query.', ('query',)
+)
+query_errors = metrics.counter(
+    'oee_db_query_errors_total', 'Named database queries that raised an error.', ('query',)
+)
+serialization_duration = metrics.histogram(
+    'oee_serialization_duration_seconds', 'Time to serialize a response body, by route and format.',
+    ('route', 'format')
+)
+
+
+def collect_pool():
+    # Gauges and the checkout histogram the connection pool keeps for /status/pool
+    stats = connection_pool.stats()
+    latency = stats['checkout_latency']
+    checkout = [('oee_db_pool_checkout_seconds_bucket', ('le',), (bucket,), count)
+                for bucket, count in latency['buckets'].items()]
+    checkout.append(('oee_db_pool_checkout_seconds_count', (), (), latency['count']))
+    checkout.append(('oee_db_pool_checkout_seconds_sum', (), (), latency['sum']))
+
+    families = [
+        ('histogram', 'oee_db_pool_checkout_seconds',
+         'Time to check a connection out of the pool, including waiting for one.', checkout),
+        ('counter', 'oee_db_pool_wait_seconds_total', 'Time spent waiting for a free pooled connection.',
+         [('oee_db_pool_wait_seconds_total', (), (), stats['wait_time_total'])]),
+        ('counter', 'oee_db_pool_timeouts_total', 'Checkouts that timed out waiting for a connection.',
+         [('oee_db_pool_timeouts_total', (), (), stats['timeouts'])]),
+    ]
+    gauges = {
+        'open': 'Connections currently open.',
+        'in_use': 'Connections currently checked out.',
+        'idle': 'Open connections currently idle in the pool.',
+        'waiting': 'Checkouts currently waiting for a free connection.',
+    }
+    for state, documentation in gauges.items():
+        name = f'oee_db_pool_{state}'
+        families.append(('gauge', name, documentation, [(name, (), (), stats[state])]))
+    return families
+
+
+metrics.add_collector(collect_pool)
+
+
+class QueryRecord:
+    __slots__ = ('rows',)
+
+    def __init__(self):
+        self.rows = 0
+
+
+def observe_query(name, elapsed, rows):
+    query_duration.observe(elapsed, name)
+    if rows:
+        query_rows.inc(rows, name)
+
+
+@contextmanager
+def track_query(name):
+    """Time the block as the database query name. Set .rows on the yielded record to the
+    number of rows returned or written."""
+    record = QueryRecord()
+    if not metrics.enabled:
+        yield record
+        return
+
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        query_errors.inc(1, name)
+        raise
+    finally:
+        observe_query(name, time.perf_counter() - started, record.rows)
+
+
+def current_route():
+    # The URL rule rather than the path, so the label takes one value per route
+    if not has_request_context():
+        return 'none'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@contextmanager
+def track_serialization(body_format):
+    if not metrics.enabled:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        serialization_duration.observe(time.perf_counter() - started, current_route(), body_format)
+
+
+class TimedJSONProvider(JSONProvider):
+    # The application's JSON provider, recording how long each body takes to serialize
+
+    def encode(self, obj, indent=False):
+        with track_serialization('json'):
+            return super().encode(obj, indent)
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        request_duration.observe(time.perf_counter() - started, current_route(), request.method,
+                                 response.status_code)
+    return response
+
+
+def metrics_response():
+    return Response(metrics.render(), content_type=text_content_type)
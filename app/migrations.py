@@ -0,0 +1,343 @@
+# migrations.py
+import logging
+import click
+from app.database import connection_pool
+from app.models.asset import CellModel
+from app.models.asset_tree import AssetTreeModel
+from app.models.oee import OeeModel
+
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock that keeps two migration runs from interleaving
+MIGRATION_LOCK_KEY = 7294015
+
+
+def create_asset_tables(cur):
+    for asset_class in AssetTreeModel.asset_classes:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {asset_class.table_name} (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL,
+                description TEXT,
+                parent_id INTEGER,
+                object_type INTEGER,
+                deprecated BOOLEAN NOT NULL DEFAULT FALSE
+            )
+            """
+        )
+
+
+def create_oee_data_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS oee_data (
+            time TIMESTAMPTZ NOT NULL,
+            run_time DOUBLE PRECISION,
+            total_time DOUBLE PRECISION,
+            total_count DOUBLE PRECISION,
+            target_count DOUBLE PRECISION,
+            good_count DOUBLE PRECISION,
+            availability DOUBLE PRECISION,
+            performance DOUBLE PRECISION,
+            quality DOUBLE PRECISION,
+            oee DOUBLE PRECISION,
+            object_type INTEGER,
+            object_id INTEGER
+        )
+        """
+    )
+
+
+def create_oee_data_hypertable(cur):
+    # Tables created before migrations existed may already be hypertables, or hold rows
+    cur.execute(
+        """
+        SELECT create_hypertable('oee_data', 'time', chunk_time_interval => INTERVAL '1 day',
+                                 if_not_exists => TRUE, migrate_data => TRUE)
+        """
+    )
+
+
+def create_oee_data_index(cur):
+    # Index used to look up the latest reading of each object
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ix_oee_data_object_time
+        ON oee_data (object_type, object_id, time DESC)
+        """
+    )
+
+
+def create_asset_view(cur):
+    # One row per active asset, with the names of the assets on its path from the enterprise.
+    # A view left by an earlier release may have other columns, which CREATE OR REPLACE
+    # cannot change, so it is dropped first.
+    enterprise, site, area, line, cell = AssetTreeModel.asset_classes
+    cur.execute("DROP VIEW IF EXISTS vw_obj_all")
+    cur.execute(
+        f"""
+        CREATE VIEW vw_obj_all AS
+        SELECT e.name AS enterprise, NULL::text AS site, NULL::text AS area, NULL::text AS line,
+               NULL::text AS cell, {enterprise.object_type} AS object_type, e.id AS object_id
+        FROM {enterprise.table_name} e
+        WHERE NOT e.deprecated
+        UNION ALL
+        SELECT e.name, s.name, NULL, NULL, NULL, {site.object_type}, s.id
+        FROM {site.table_name} s
+        JOIN {enterprise.table_name} e ON e.id = s.parent_id AND NOT e.deprecated
+        WHERE NOT s.deprecated
+        UNION ALL
+        SELECT e.name, s.name, a.name, NULL, NULL, {area.object_type}, a.id
+        FROM {area.table_name} a
+        JOIN {site.table_name} s ON s.id = a.parent_id AND NOT s.deprecated
+        JOIN {enterprise.table_name} e ON e.id = s.parent_id AND NOT e.deprecated
+        WHERE NOT a.deprecated
+        UNION ALL
+        SELECT e.name, s.name, a.name, l.name, NULL, {line.object_type}, l.id
+        FROM {line.table_name} l
+        JOIN {area.table_name} a ON a.id = l.parent_id AND NOT a.deprecated
+        JOIN {site.table_name} s ON s.id = a.parent_id AND NOT s.deprecated
+        JOIN {enterprise.table_name} e ON e.id = s.parent_id AND NOT e.deprecated
+        WHERE NOT l.deprecated
+        UNION ALL
+        SELECT e.name, s.name, a.name, l.name, c.name, {cell.object_type}, c.id
+        FROM {cell.table_name} c
+        JOIN {line.table_name} l ON l.id = c.parent_id AND NOT l.deprecated
+        JOIN {area.table_name} a ON a.id = l.parent_id AND NOT a.deprecated
+        JOIN {site.table_name} s ON s.id = a.parent_id AND NOT s.deprecated
+        JOIN {enterprise.table_name} e ON e.id = s.parent_id AND NOT e.deprecated
+        WHERE NOT c.deprecated
+        """
+    )
+
+
+def create_rollup_tables(cur):
+    # Hourly, daily and weekly rollups, backfilled from the raw data when they are first created.
+    # Tables left by releases that created them on startup are already up to date.
+    for table_name, interval in OeeModel.rollup_tables.values():
+        cur.execute("SELECT to_regclass(%s)", (table_name,))
+        exists = cur.fetchone()[0] is not None
+
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                object_type INTEGER NOT NULL,
+                object_id INTEGER NOT NULL,
+                bucket TIMESTAMPTZ NOT NULL,
+                sample_count INTEGER NOT NULL,
+                good_count DOUBLE PRECISION,
+                total_count DOUBLE PRECISION,
+                target_count DOUBLE PRECISION,
+                run_time DOUBLE PRECISION,
+                total_time DOUBLE PRECISION,
+                start_time TIMESTAMPTZ,
+                end_time TIMESTAMPTZ,
+                PRIMARY KEY (object_type, object_id, bucket)
+            )
+            """
+        )
+
+        if not exists:
+            cur.execute(
+                f"""
+                INSERT INTO {table_name}
+                SELECT object_type, object_id, time_bucket(%s::interval, time), count(*),
+                       sum(good_count), sum(total_count), sum(target_count), sum(run_time),
+                       sum(total_time), min(time), max(time)
+                FROM oee_data
+                GROUP BY 1, 2, 3
+                """,
+                (interval,)
+            )
+
+
+def create_shift_tables(cur):
+    # Shift calendars of the sites, and the OEE of every asset per shift. Shift rows are only
+    # written once a site has a calendar, so there is nothing to backfill.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shift_calendars (
+            site_id INTEGER PRIMARY KEY,
+            timezone TEXT NOT NULL,
+            shifts JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {OeeModel.shift_table} (
+            object_type INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            shift_start TIMESTAMPTZ NOT NULL,
+            shift_end TIMESTAMPTZ NOT NULL,
+            shift_name TEXT NOT NULL,
+            sample_count INTEGER NOT NULL,
+            good_count DOUBLE PRECISION,
+            total_count DOUBLE PRECISION,
+            target_count DOUBLE PRECISION,
+            run_time DOUBLE PRECISION,
+            total_time DOUBLE PRECISION,
+            start_time TIMESTAMPTZ,
+            end_time TIMESTAMPTZ,
+            PRIMARY KEY (object_type, object_id, shift_start)
+        )
+        """
+    )
+
+
+def create_hierarchy_tables(cur):
+    # Latest counts of every cell and their sums per parent, from which parent-level OEE is
+    # derived. The cells are backfilled from their latest stored reading; the parent sums are
+    # rebuilt from them by the first ingest.
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {OeeModel.cell_latest_table} (
+            object_type INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            good_count DOUBLE PRECISION NOT NULL DEFAULT 0,
+            total_count DOUBLE PRECISION NOT NULL DEFAULT 0,
+            run_time DOUBLE PRECISION NOT NULL DEFAULT 0,
+            total_time DOUBLE PRECISION NOT NULL DEFAULT 0,
+            target_count DOUBLE PRECISION NOT NULL DEFAULT 0,
+            time TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
+            PRIMARY KEY (object_type, object_id)
+        )
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {OeeModel.parent_totals_table} (
+            object_type INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            good_count DOUBLE PRECISION NOT NULL,
+            total_count DOUBLE PRECISION NOT NULL,
+            run_time DOUBLE PRECISION NOT NULL,
+            total_time DOUBLE PRECISION NOT NULL,
+            target_count DOUBLE PRECISION NOT NULL,
+            time TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (object_type, object_id)
+        )
+        """
+    )
+    cur.execute(
+        f"""
+        INSERT INTO {OeeModel.cell_latest_table}
+        SELECT DISTINCT ON (object_type, object_id)
+               object_type, object_id, coalesce(good_count, 0), coalesce(total_count, 0),
+               coalesce(run_time, 0), coalesce(total_time, 0), coalesce(target_count, 0), time
+        FROM oee_data
+        WHERE object_type = %s
+        ORDER BY object_type, object_id, time DESC
+        ON CONFLICT DO NOTHING
+        """,
+        (CellModel.object_type,)
+    )
+
+
+def create_write_version_table(cur):
+    # Version bumped by every ingest, which tells worker processes their cached readings are stale
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {OeeModel.write_version_table} (
+            id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+            version BIGINT NOT NULL DEFAULT 0,
+            written_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    cur.execute(f"INSERT INTO {OeeModel.write_version_table} DEFAULT VALUES ON CONFLICT DO NOTHING")
+
+
+# Schema versions in the order they are applied. Append new migrations; never edit or
+# renumber one that has been released.
+migrations = [
+    (1, "Create the asset tables", create_asset_tables),
+    (2, "Create the oee_data table", create_oee_data_table),
+    (3, "Turn oee_data into a hypertable", create_oee_data_hypertable),
+    (4, "Index oee_data by object and time", create_oee_data_index),
+    (5, "Create the vw_obj_all view", create_asset_view),
+    (6, "Create the hourly, daily and weekly rollup tables", create_rollup_tables),
+    (7, "Create the shift calendar and shift rollup tables", create_shift_tables),
+    (8, "Create the cell latest and parent sum tables", create_hierarchy_tables),
+    (9, "Create the shared write version table", create_write_version_table),
+]
+
+
+def applied_versions(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(target=None):
+    # Apply every pending migration up to target (all when None), each in its own transaction.
+    # Returns the versions applied.
+    applied = []
+
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            try:
+                done = applied_versions(cur)
+                conn.commit()
+
+                for version, description, apply in migrations:
+                    if version in done or (target is not None and version > target):
+                        continue
+
+                    logger.info(f"Applying migration {version}: {description}")
+                    try:
+                        apply(cur)
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (version, description)
+                        )
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    applied.append(version)
+
+            finally:
+                conn.rollback()
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
+
+    return applied
+
+
+def migration_status():
+    # (version, description, applied) for every known migration
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cur:
+            done = applied_versions(cur)
+        conn.commit()
+
+    return [(version, description, version in done) for version, description, _ in migrations]
+
+
+@click.command('migrate')
+@click.option('--target', type=int, default=None, help='Stop after this schema version.')
+@click.option('--status', is_flag=True, help='List the migrations and whether they are applied.')
+def migrate_command(target, status):
+    """Create or upgrade the database schema."""
+    if status:
+        for version, description, applied in migration_status():
+            click.echo(f"{version:>4}  {'applied' if applied else 'pending':<8} {description}")
+        return
+
+    applied = migrate(target)
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(str(version) for version in applied)}")
+    else:
+        click.echo("The schema is up to date.")
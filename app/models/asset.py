@@ -1,8 +1,10 @@
 import os
 import psycopg2
-from psycopg2 import pool
+from app.database import connection_pool
+from app.metrics import track_query
 from dotenv import load_dotenv
 from contextlib import contextmanager
+from dataclasses import dataclass
 import logging
 
 # Load environment variables
@@ -13,8 +15,18 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@dataclass(slots=True)
+class AssetRow:
+    # One asset as listed and held by the asset index. Slots keep large listings free of a
+    # dict per asset, and the JSON provider serializes them as objects.
+    id: int
+    name: str
+    description: str
+    parent_id: int
+    object_type: int
+
+
 class AssetModel:
-    connection_pool = None
     table_name = None
     parent_table_name = None
     child_table_name = None
@@ -28,6 +40,9 @@ class AssetModel:
         self.parent_id = kwargs.get('parent_id')
         self.object_type = kwargs.get('asset_type')
 
+    def to_row(self):
+        return AssetRow(self.id, self.name, self.description, self.parent_id, self.object_type)
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -39,22 +54,11 @@ class AssetModel:
 
     @staticmethod
     def get_connection():
-        if AssetModel.connection_pool is None:
-            AssetModel.connection_pool = psycopg2.pool.SimpleConnectionPool(
-                minconn=1,
-                maxconn=10,
-                dbname=os.getenv("DB_NAME"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT")
-            )
-        return AssetModel.connection_pool.getconn()
+        return connection_pool.getconn()
 
     @staticmethod
     def release_connection(connection):
-        if AssetModel.connection_pool is not None:
-            AssetModel.connection_pool.putconn(connection)
+        connection_pool.putconn(connection)
 
     @staticmethod
     def handle_db_error(e):
@@ -75,12 +79,13 @@ class AssetModel:
                 AssetModel.release_connection(conn)
 
     @staticmethod
-    def execute_query(query, params):
+    def execute_query(query, params, name='asset.execute'):
         try:
-            with AssetModel.get_db_connection() as conn:
+            with AssetModel.get_db_connection() as conn, track_query(name) as record:
                 with conn.cursor() as cur:
                     cur.execute(query, params)
                     conn.commit()
+                    record.rows = cur.rowcount
 
                     if 'RETURNING' in query:
                         result = cur.fetchone()
@@ -94,14 +99,15 @@ class AssetModel:
             raise Exception("An error occurred while executing the database query.")
 
     @staticmethod
-    def fetch_one(query, params):
+    def fetch_one(query, params, name='asset.fetch_one'):
         try:
-            with AssetModel.get_db_connection() as conn:
+            with AssetModel.get_db_connection() as conn, track_query(name) as record:
                 with conn.cursor() as cur:
                     cur.execute(query, params)
                     result = cur.fetchone()
                     if result is None:
                         result = []
+                    record.rows = 1 if result else 0
                     columns = [col[0] for col in cur.description]
                     data = dict(zip(columns, result))
                     return data
@@ -113,9 +119,10 @@ class AssetModel:
             raise Exception("An error occurred while fetching data from the database.")
 
     @staticmethod
-    def fetch_all(query, params=None):
+    def fetch_all(query, params=None, name='asset.fetch_all', row_class=None):
+        # Rows as dicts, or built by row_class from the columns in order
         try:
-            with AssetModel.get_db_connection() as conn:
+            with AssetModel.get_db_connection() as conn, track_query(name) as record:
                 with conn.cursor() as cur:
                     if params is None:
                         cur.execute(query)
@@ -123,8 +130,11 @@ class AssetModel:
                         cur.execute(query, params)
 
                     result = cur.fetchall()
+                    record.rows = len(result)
                     if len(result) == 0:
                         result = []
+                    if row_class is not None:
+                        return [row_class(*res) for res in result]
                     columns = [col[0] for col in cur.description]
                     data = [dict(zip(columns, res)) for res in result]
                     return data
@@ -143,7 +153,8 @@ class AssetModel:
                 VALUES (%s, %s, %s, %s) 
                 RETURNING id
             """
-            result = self.execute_query(query, (self.name, self.description, self.parent_id, self.object_type))
+            result = self.execute_query(query, (self.name, self.description, self.parent_id, self.object_type),
+                                        name=f'{self.object_name}.create')
 
             if result:
                 logger.info(result[0])
@@ -162,7 +173,7 @@ class AssetModel:
                 SELECT id, name, description, parent_id, object_type 
                 FROM {self.table_name} 
                 WHERE id = %s AND NOT deprecated
-                """, (asset_id,)
+                """, (asset_id,), name=f'{self.object_name}.get'
             )
             if data:
                 self.__dict__.update(data)
@@ -175,7 +186,7 @@ class AssetModel:
         try:
             self.execute_query(
                 f"UPDATE {self.table_name} SET name = %s, description = %s WHERE id = %s AND NOT deprecated",
-                (self.name, self.description, asset_id)
+                (self.name, self.description, asset_id), name=f'{self.object_name}.update'
             )
             asset = self.get(asset_id)
             return asset
@@ -188,7 +199,7 @@ class AssetModel:
         try:
             self.execute_query(
                 f"UPDATE {self.table_name} SET deprecated = true WHERE id = %s AND NOT deprecated",
-                (self.id,)
+                (self.id,), name=f'{self.object_name}.delete'
             )
         except Exception as e:
             logger.error(f"Failed to delete {self.object_name}. {e}")
@@ -201,9 +212,7 @@ class AssetModel:
                 FROM {self.table_name}
                 WHERE NOT deprecated
             """
-            data = self.fetch_all(query)
-            assets = [AssetModel(**item) for item in data]
-            return assets
+            return self.fetch_all(query, name=f'{self.object_name}.all', row_class=AssetRow)
         except Exception as e:
             logger.error(f"Failed to get all {self.object_name}. {e}")
             raise Exception(f"An error occurred while fetching all {self.object_name}.")
@@ -217,9 +226,7 @@ class AssetModel:
                 FROM {self.child_table_name}
                 WHERE parent_id = {asset_id} AND NOT deprecated
             """
-            data = self.fetch_all(query)
-            assets = [AssetModel(**item) for item in data]
-            return assets
+            return self.fetch_all(query, name=f'{self.object_name}.children', row_class=AssetRow)
         except Exception as e:
             logger.error(f"Failed to get children of the {self.object_name}. {e}")
             raise Exception(f"An error occurred while fetching children of the {self.object_name}.")
@@ -236,9 +243,7 @@ class AssetModel:
                 FROM {self.parent_table_name}
                 WHERE id = {parent_id} AND NOT deprecated
             """
-            data = self.fetch_all(query)
-            assets = [AssetModel(**item) for item in data]
-            return assets
+            return self.fetch_all(query, name=f'{self.object_name}.parent', row_class=AssetRow)
         except Exception as e:
             logger.error(f"Failed to get the parent of the {self.object_name}. {e}")
             raise Exception(f"An error occurred while fetching the parent of the {self.object_name}.")
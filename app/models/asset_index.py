@@ -0,0 +1,159 @@
+import time
+import threading
+from datetime import datetime, timezone
+from app.models.asset_tree import AssetTreeModel
+
+
+class AssetIndex:
+    """Process-wide in-memory index of the asset hierarchy.
+
+    Holds every active asset, as an AssetRow, by (object_type, id), the children of every asset and the assets
+    of every type. It is loaded with one query on first use, patched by the asset services as
+    they create, update and delete assets, and reloaded after ttl seconds so changes made
+    through other worker processes are picked up.
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._nodes = {}
+        self._children = {}
+        self._by_type = {}
+
+        # Bumped on every change, so responses built from the index can be validated
+        self.version = 0
+        self.modified_at = datetime.now(timezone.utc)
+
+    def configure(self, ttl):
+        with self._lock:
+            self.ttl = ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def reload(self):
+        assets = AssetTreeModel.get_all_assets()
+        with self._lock:
+            previous = self._nodes
+            self._nodes = {}
+            self._children = {}
+            self._by_type = {}
+            for item in assets:
+                self._insert(item)
+            self._loaded_at = time.monotonic()
+            if self._nodes != previous:
+                self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self.modified_at = datetime.now(timezone.utc)
+
+    def age(self):
+        with self._lock:
+            return None if self._loaded_at is None else time.monotonic() - self._loaded_at
+
+    def _ensure_loaded(self):
+        age = self.age()
+        if age is None or age > self.ttl:
+            self.reload()
+
+    def _insert(self, item):
+        key = (item.object_type, item.id)
+        self._nodes[key] = item
+        self._by_type.setdefault(item.object_type, {})[item.id] = item
+        if item.parent_id is not None:
+            self._children.setdefault((item.object_type + 1, item.parent_id), {})[item.id] = item
+
+    def _discard(self, key):
+        item = self._nodes.pop(key, None)
+        if item is None:
+            return
+        self._by_type.get(key[0], {}).pop(key[1], None)
+        if item.parent_id is not None:
+            self._children.get((key[0] + 1, item.parent_id), {}).pop(key[1], None)
+
+    def validators(self):
+        # Version and modification time of the index, reloaded first if it is due
+        self._ensure_loaded()
+        with self._lock:
+            return self.version, self.modified_at
+
+    def get(self, object_type, asset_id):
+        self._ensure_loaded()
+        with self._lock:
+            return self._nodes.get((object_type, asset_id))
+
+    def children(self, object_type, asset_id):
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._children.get((object_type, asset_id), {}).values())
+
+    def parent(self, object_type, asset_id):
+        self._ensure_loaded()
+        with self._lock:
+            item = self._nodes.get((object_type, asset_id))
+            if item is None or item.parent_id is None:
+                return None
+            return self._nodes.get((object_type + 1, item.parent_id))
+
+    def ancestors(self, object_type, asset_id):
+        # Keys of the parent, grandparent, ... of an asset, up to its enterprise
+        self._ensure_loaded()
+        with self._lock:
+            chain = []
+            item = self._nodes.get((object_type, asset_id))
+            while item is not None and item.parent_id is not None:
+                key = (item.object_type + 1, item.parent_id)
+                item = self._nodes.get(key)
+                if item is None:
+                    break
+                chain.append(key)
+            return chain
+
+    def descendants(self, object_type, asset_id, depth=None):
+        # Every asset under an asset, level by level, down to depth levels (all when None)
+        self._ensure_loaded()
+        with self._lock:
+            result = []
+            level = [(object_type, asset_id)]
+            while level and (depth is None or depth > 0):
+                children = []
+                for key in level:
+                    children.extend(self._children.get(key, {}).values())
+                result.extend(children)
+                level = [(item.object_type, item.id) for item in children]
+                if depth is not None:
+                    depth -= 1
+            return result
+
+    def of_type(self, object_type):
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._by_type.get(object_type, {}).values())
+
+    def nodes(self):
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._nodes.values())
+
+    def put(self, item):
+        # Add or replace an asset, an AssetRow, after it was created or updated
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._discard((item.object_type, item.id))
+            self._insert(item)
+            self._changed()
+
+    def remove(self, object_type, asset_id):
+        # Drop an asset after it was deleted
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._discard((object_type, asset_id))
+            self._changed()
+
+
+asset_index = AssetIndex()
@@ -1,89 +1,57 @@
 from app.models.asset import *
 from app.models.oee import OeeModel
-from .asset_factory import asset_factory
 
 load_dotenv()
 
 
 class AssetTreeModel:
+    # Asset classes from the top of the hierarchy down
+    asset_classes = [EnterpriseModel, SiteModel, AreaModel, LineModel, CellModel]
+
     @staticmethod
-    def get_tree():
+    def get_all_assets():
+        # Pull every active asset of every level in one round trip
+        query = " UNION ALL ".join(
+            f"""
+            SELECT id, name, description, parent_id, {asset_class.object_type} AS object_type
+            FROM {asset_class.table_name}
+            WHERE NOT deprecated
+            """
+            for asset_class in AssetTreeModel.asset_classes
+        )
+        return AssetModel.fetch_all(query, name='asset_tree.all_assets', row_class=AssetRow)
 
-        try:
+    @staticmethod
+    def get_tree(assets=None):
 
-            query = "SELECT * FROM public.vw_obj_all"
-            assets = AssetModel.fetch_all(query)
+        try:
 
-            hierarchy = {}
+            if assets is None:
+                assets = AssetTreeModel.get_all_assets()
+            latest = OeeModel.get_latest_oee_many((item.object_type, item.id) for item in assets)
 
+            # Build one node per asset, keyed by (object_type, id) so duplicate names cannot collide
+            nodes = {}
             for item in assets:
-                enterprise = item['enterprise']
-                site = item['site']
-                area = item['area']
-                line = item['line']
-                cell = item['cell']
-
-                asset_id = item['object_id']
-
-                if enterprise not in hierarchy:
-
-                    data = asset_factory.get_asset(4)().get(asset_id).to_dict()
-                    oee = OeeModel.get_latest_oee(4, asset_id)
-
-                    hierarchy[enterprise] = {}
-
-                    if data:
-                        hierarchy[enterprise]['data'] = data
-                    if oee and data:
-                        hierarchy[enterprise]['oee'] = oee
-
-                if site is not None and site not in hierarchy[enterprise]:
-
-                    data = asset_factory.get_asset(3)().get(asset_id).to_dict()
-                    oee = OeeModel.get_latest_oee(3, asset_id)
+                key = (item.object_type, item.id)
+                node = {'data': item}
+                if key in latest:
+                    node['oee'] = latest[key]
+                nodes[key] = node
 
-                    hierarchy[enterprise][site] = {}
-
-                    if data:
-                        hierarchy[enterprise][site]['data'] = data
-                    if oee and data:
-                        hierarchy[enterprise][site]['oee'] = oee
-
-                if area is not None and area not in hierarchy[enterprise][site]:
-
-                    data = asset_factory.get_asset(2)().get(asset_id).to_dict()
-                    oee = OeeModel.get_latest_oee(2, asset_id)
-
-                    hierarchy[enterprise][site][area] = {}
-
-                    if data:
-                        hierarchy[enterprise][site][area]['data'] = data
-                    if oee and data:
-                        hierarchy[enterprise][site][area]['oee'] = oee
-
-                if line is not None and line not in hierarchy[enterprise][site][area]:
-
-                    data = asset_factory.get_asset(1)().get(asset_id).to_dict()
-                    oee = OeeModel.get_latest_oee(1, asset_id)
-
-                    hierarchy[enterprise][site][area][line] = {}
-
-                    if data:
-                        hierarchy[enterprise][site][area][line]['data'] = data
-                    if oee and data:
-                        hierarchy[enterprise][site][area][line]['oee'] = oee
-
-                if cell is not None and line not in hierarchy[enterprise][site][area][line]:
+            hierarchy = {}
 
-                    data = asset_factory.get_asset(0)().get(asset_id).to_dict()
-                    oee = OeeModel.get_latest_oee(0, asset_id)
+            # Attach each node to its parent; assets whose parent is missing or deprecated are left out
+            for item in assets:
+                node = nodes[(item.object_type, item.id)]
 
-                    hierarchy[enterprise][site][area][line][cell] = {}
+                if item.object_type == EnterpriseModel.object_type:
+                    hierarchy[str(item.id)] = node
+                    continue
 
-                    if data:
-                        hierarchy[enterprise][site][area][line][cell]['data'] = data
-                    if oee and data:
-                        hierarchy[enterprise][site][area][line][cell]['oee'] = oee
+                parent = nodes.get((item.object_type + 1, item.parent_id))
+                if parent is not None:
+                    parent[str(item.id)] = node
 
             return hierarchy
 
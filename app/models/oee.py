@@ -1,10 +1,15 @@
 import os
+import time
 import logging
+import numpy as np
 import psycopg2
-from psycopg2 import pool
+from app.database import connection_pool, fan_out
+from app.metrics import metrics, track_query, observe_query
+from app.models.oee_cache import latest_oee_cache
 from dotenv import load_dotenv
 from contextlib import contextmanager
-from datetime import datetime, timezone
+from dataclasses import make_dataclass
+from datetime import datetime, timedelta, timezone
 
 # Load environment variables
 load_dotenv()
@@ -15,8 +20,6 @@ logger = logging.getLogger(__name__)
 
 
 class OeeModel:
-    connection_pool = None
-
     def __init__(self, **kwargs):
 
         # Define the required arguments for OeeModel initialization
@@ -99,24 +102,83 @@ class OeeModel:
         except Exception as e:
             raise Exception("Unexpected error calculating OEE: " + str(e))
 
+    @staticmethod
+    def _to_float_array(values):
+        # Convert a column to float64; values that are not numbers become NaN
+        try:
+            return np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            array = np.empty(len(values), dtype=np.float64)
+            for index, value in enumerate(values):
+                try:
+                    array[index] = float(value)
+                except (TypeError, ValueError):
+                    array[index] = np.nan
+            return array
+
+    @staticmethod
+    def calculate_oee_batch(columns):
+        # Vectorized counterpart of the calculate_* methods. Takes equally sized columns of
+        # good_count, total_count, run_time, total_time and target_count and returns the
+        # availability, performance, quality and oee arrays (NaN for invalid rows) together
+        # with a per-row error message (None for valid rows).
+        required_arguments = ['good_count', 'total_count', 'run_time', 'total_time', 'target_count']
+
+        missing_arguments = [argument for argument in required_arguments if argument not in columns]
+        if missing_arguments:
+            raise ValueError("Missing required columns: {}".format(", ".join(missing_arguments)))
+
+        if any(not isinstance(columns[argument], (list, tuple, np.ndarray)) for argument in required_arguments):
+            raise ValueError("Every column must be a list of values.")
+
+        lengths = {len(columns[argument]) for argument in required_arguments}
+        if len(lengths) != 1:
+            raise ValueError("All columns must have the same length.")
+
+        row_count = lengths.pop()
+        errors = np.full(row_count, None, dtype=object)
+        invalid = np.zeros(row_count, dtype=bool)
+
+        # Values that are not finite numbers
+        arrays = {}
+        for argument in required_arguments:
+            array = OeeModel._to_float_array(columns[argument])
+            if array.ndim != 1:
+                raise ValueError("Every column must be a flat list of values.")
+            rejected = ~np.isfinite(array) & ~invalid
+            errors[rejected] = f"{argument} must be a number."
+            invalid |= rejected
+            arrays[argument] = array
+
+        # Zero denominators, reported in the same order calculate_oee checks them
+        for argument in ['total_count', 'total_time', 'target_count']:
+            rejected = (arrays[argument] == 0) & ~invalid
+            errors[rejected] = f"{argument} cannot be zero."
+            invalid |= rejected
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            quality = arrays['good_count'] / arrays['total_count']
+            availability = arrays['run_time'] / arrays['total_time']
+            performance = arrays['total_count'] / arrays['target_count']
+            oee = quality * availability * performance
+
+        for result in (availability, performance, quality, oee):
+            result[invalid] = np.nan
+
+        return {
+            'availability': availability,
+            'performance': performance,
+            'quality': quality,
+            'oee': oee,
+        }, errors
+
     @staticmethod
     def get_connection():
-        if OeeModel.connection_pool is None:
-            OeeModel.connection_pool = psycopg2.pool.SimpleConnectionPool(
-                minconn=1,
-                maxconn=10,
-                dbname=os.getenv("DB_NAME"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT")
-            )
-        return OeeModel.connection_pool.getconn()
+        return connection_pool.getconn()
 
     @staticmethod
     def release_connection(connection):
-        if OeeModel.connection_pool is not None:
-            OeeModel.connection_pool.putconn(connection)
+        connection_pool.putconn(connection)
 
     @staticmethod
     def handle_db_error(e):
@@ -152,26 +214,103 @@ class OeeModel:
 
     # def insert_oee_data(self):
 
+    # Rollup tables maintained on ingest, by history bucket
+    rollup_tables = {
+        'hour': ('oee_data_hourly', '1 hour'),
+        'day': ('oee_data_daily', '1 day'),
+        'week': ('oee_data_weekly', '1 week'),
+    }
+
+    # Keys per latest-OEE query; larger lookups are fanned out over several connections
+    latest_chunk_size = 1000
+
+    # Length of each rollup bucket; a range read from a rollup extends to the end of its last bucket
+    rollup_lengths = {
+        'hour': timedelta(hours=1),
+        'day': timedelta(days=1),
+        'week': timedelta(weeks=1),
+    }
+
+    # Per-shift rollup, written for the assets of sites with a shift calendar. Shifts vary in
+    # length, so it is read by bucket=shift rather than listed with the fixed-length rollups.
+    shift_table = 'oee_data_shift'
+    history_buckets = (*rollup_tables, 'shift')
+
+    history_columns = ['availability', 'performance', 'quality', 'oee', 'total_good_count', 'total_total_count',
+                       'total_run_time', 'total_total_time', 'total_target_count', 'timestamp', 'start_time',
+                       'end_time']
+
+    # Shift rows also carry the name and end of their shift
+    shift_columns = history_columns + ['shift', 'shift_end']
+
+    latest_columns = ['availability', 'performance', 'quality', 'oee', 'good_count', 'total_count', 'run_time',
+                      'total_time', 'target_count', 'timestamp']
+
+    # Parent-level OEE derived from cell readings: the latest counts of every cell, and their sums
+    # per line, area, site and enterprise. Kept out of oee_data, so history sums stored rows only.
+    cell_latest_table = 'oee_cell_latest'
+    parent_totals_table = 'oee_parent_totals'
+
+    # One row holding a version every ingest bumps once it has committed, and the time of that
+    # commit, shared by every worker process to tell when their cached readings are stale
+    write_version_table = 'oee_write_version'
+
+    # A row of summed counts and times as a reading with the latest_columns
+    derived_reading_columns = """
+        run_time / NULLIF(total_time, 0), total_count / NULLIF(target_count, 0),
+        good_count / NULLIF(total_count, 0),
+        (good_count / NULLIF(total_count, 0)) * (run_time / NULLIF(total_time, 0))
+            * (total_count / NULLIF(target_count, 0)),
+        good_count, total_count, run_time, total_time, target_count, time
+    """
+
+    # Latest reading of the asset given by the object_type and object_id expressions: its newest
+    # stored row, or its derived sums when those are newer
+    latest_reading_query = f"""
+        SELECT * FROM (
+            (SELECT availability, performance, quality, oee, good_count, total_count, run_time,
+                    total_time, target_count, time
+             FROM oee_data
+             WHERE object_type = {{object_type}} AND object_id = {{object_id}}
+             ORDER BY time DESC
+             LIMIT 1)
+            UNION ALL
+            (SELECT {derived_reading_columns}
+             FROM {parent_totals_table}
+             WHERE object_type = {{object_type}} AND object_id = {{object_id}})
+        ) AS readings
+        ORDER BY time DESC
+        LIMIT 1
+    """
+
+    @staticmethod
+    def get_write_version():
+        # (version, written_at) of the last ingest, as bumped by the historian
+        with OeeModel.get_db_connection() as conn, track_query('oee.write_version'):
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT version, written_at FROM {OeeModel.write_version_table}")
+                return cur.fetchone() or (0, None)
+
     @staticmethod
     def get_latest_oee(object_type, object_id):
         try:
-            query = """
-            SELECT availability, performance, quality, oee, good_count, total_count, run_time, total_time, target_count, time
-            FROM oee_data
-            WHERE object_type = %s AND object_id = %s
-            ORDER BY time DESC
-            LIMIT 1
-            """
+            # Serve the reading from the cache when it holds one
+            latest_oee_cache.validate(OeeModel.get_write_version)
+            reading = latest_oee_cache.get((object_type, object_id))
+            if reading is not None:
+                return reading
 
-            with OeeModel.get_db_connection() as conn:
+            query = OeeModel.latest_reading_query.format(object_type='%(object_type)s', object_id='%(object_id)s')
+
+            with OeeModel.get_db_connection() as conn, track_query('oee.latest') as record:
                 with conn.cursor() as cur:
-                    cur.execute(query, (object_type, object_id))
+                    cur.execute(query, {'object_type': object_type, 'object_id': object_id})
                     result = cur.fetchone()
+                    record.rows = 1 if result else 0
                     if result:
-                        columns = ['availability', 'performance', 'quality', 'oee', 'good_count', 'total_count',
-                                   'run_time',
-                                   'total_time', 'target_count', 'timestamp']
-                        return dict(zip(columns, result))
+                        reading = dict(zip(OeeModel.latest_columns, result))
+                        latest_oee_cache.put((object_type, object_id), reading)
+                        return reading
                     else:
                         return {}
 
@@ -181,6 +320,198 @@ class OeeModel:
             logger.error(f"Failed to fetch latest OEE data: {e}")
             raise Exception("An error occurred while fetching latest OEE data.")
 
+    @staticmethod
+    def _fetch_latest(keys_query, params, name):
+        # Fetch the latest reading for every (object_type, object_id) row produced by keys_query.
+        # The lateral join does one index probe per key instead of one round trip per key.
+        latest_reading = OeeModel.latest_reading_query.format(object_type='k.object_type', object_id='k.object_id')
+        query = f"""
+        SELECT k.object_type, k.object_id,
+               o.availability, o.performance, o.quality, o.oee, o.good_count, o.total_count,
+               o.run_time, o.total_time, o.target_count, o.time
+        FROM ({keys_query}) AS k
+        CROSS JOIN LATERAL ({latest_reading}) o
+        """
+
+        with OeeModel.get_db_connection() as conn, track_query(name) as record:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                results = cur.fetchall()
+                record.rows = len(results)
+
+                # Key the readings by (object_type, object_id); keys without data are left out
+                latest = {(row[0], row[1]): dict(zip(OeeModel.latest_columns, row[2:])) for row in results}
+
+                for key, reading in latest.items():
+                    latest_oee_cache.put(key, reading)
+                return latest
+
+    @staticmethod
+    def _fetch_latest_keys(object_keys):
+        object_types = [object_type for object_type, _ in object_keys]
+        object_ids = [object_id for _, object_id in object_keys]
+
+        return OeeModel._fetch_latest(
+            "SELECT * FROM unnest(%s::int[], %s::int[]) AS keys(object_type, object_id)",
+            (object_types, object_ids),
+            'oee.latest_many'
+        )
+
+    @staticmethod
+    def get_latest_oee_many(object_keys):
+        try:
+            # Only the keys the cache cannot answer are read from the database
+            latest_oee_cache.validate(OeeModel.get_write_version)
+            latest, object_keys = latest_oee_cache.get_many(object_keys)
+            if not object_keys:
+                return latest
+
+            # Large lookups are split into chunks that run concurrently on separate connections
+            chunk_size = OeeModel.latest_chunk_size
+            chunks = [object_keys[start:start + chunk_size] for start in range(0, len(object_keys), chunk_size)]
+            for readings in fan_out.run(lambda chunk=chunk: OeeModel._fetch_latest_keys(chunk) for chunk in chunks):
+                latest.update(readings)
+            return latest
+
+        except psycopg2.DatabaseError as e:
+            OeeModel.handle_db_error(e)
+        except Exception as e:
+            logger.error(f"Failed to fetch latest OEE data: {e}")
+            raise Exception("An error occurred while fetching latest OEE data.")
+
+    @staticmethod
+    def get_latest_oee_for_level(object_type, table_name):
+        # Latest reading for every active asset stored in table_name
+        try:
+            return OeeModel._fetch_latest(
+                f"SELECT %s AS object_type, id AS object_id FROM {table_name} WHERE NOT deprecated",
+                (object_type,),
+                'oee.latest_level'
+            )
+
+        except psycopg2.DatabaseError as e:
+            OeeModel.handle_db_error(e)
+        except Exception as e:
+            logger.error(f"Failed to fetch latest OEE data for level {object_type}: {e}")
+            raise Exception("An error occurred while fetching latest OEE data.")
+
+    raw_columns = ['timestamp', 'availability', 'performance', 'quality', 'oee', 'good_count', 'total_count',
+                   'run_time', 'total_time', 'target_count']
+
+    @staticmethod
+    def _asset_filter(object_keys):
+        # Condition matching any of the (object_type, object_id) keys: one object_id = ANY(...)
+        # per object type, so each branch is an index scan over the ids of that level
+        ids_by_type = {}
+        for object_type, object_id in object_keys:
+            ids_by_type.setdefault(object_type, []).append(object_id)
+
+        condition = " OR ".join("(object_type = %s AND object_id = ANY(%s))" for _ in ids_by_type)
+        params = tuple(param for object_type, object_ids in ids_by_type.items() for param in (object_type, object_ids))
+        return f"({condition})", params
+
+    @staticmethod
+    def _history_query(object_type, object_id, start_timestamp, end_timestamp, bucket=None, raw=False,
+                       object_keys=None):
+        # Build the history query of a range: raw rows, a rollup table, or the daily raw aggregate.
+        # With object_keys, the range of every one of those assets is read at once, and each row
+        # starts with its object_type and object_id. Returns the query, its parameters and the
+        # names of its columns.
+        if object_keys is None:
+            asset_filter, asset_params = "object_type = %s AND object_id = %s", (object_type, object_id)
+            key_columns, key_names = "", []
+        else:
+            asset_filter, asset_params = OeeModel._asset_filter(object_keys)
+            key_columns, key_names = "object_type, object_id, ", ['object_type', 'object_id']
+
+        if raw:
+            query = f"""
+                SELECT {key_columns}time AS timestamp, availability, performance, quality, oee,
+                       good_count, total_count, run_time, total_time, target_count
+                FROM oee_data
+                WHERE {asset_filter}
+                  AND time >= %s AND time <= %s
+                ORDER BY {key_columns}time
+            """
+            return query, asset_params + (start_timestamp, end_timestamp), key_names + OeeModel.raw_columns
+
+        if bucket == 'shift':
+            # Every shift overlapping the range, recomputed from its summed counts and times
+            query = f"""
+                SELECT {key_columns}
+                       run_time / NULLIF(total_time, 0) AS availability,
+                       total_count / NULLIF(target_count, 0) AS performance,
+                       good_count / NULLIF(total_count, 0) AS quality,
+                       (good_count / NULLIF(total_count, 0))
+                           * (run_time / NULLIF(total_time, 0))
+                           * (total_count / NULLIF(target_count, 0)) AS oee,
+                       good_count AS total_good_count,
+                       total_count AS total_total_count,
+                       run_time AS total_run_time,
+                       total_time AS total_total_time,
+                       target_count AS total_target_count,
+                       shift_start AS timestamp,
+                       start_time,
+                       end_time,
+                       shift_name AS shift,
+                       shift_end
+                FROM {OeeModel.shift_table}
+                WHERE {asset_filter}
+                  AND shift_end > %s AND shift_start <= %s
+                ORDER BY {key_columns}shift_start
+            """
+            params = asset_params + (start_timestamp, end_timestamp)
+            return query, params, key_names + OeeModel.shift_columns
+
+        if bucket is not None:
+            # OEE is recomputed from the summed counts and times, and the range is widened to whole buckets
+            table_name, interval = OeeModel.rollup_tables[bucket]
+            query = f"""
+                SELECT {key_columns}
+                       run_time / NULLIF(total_time, 0) AS availability,
+                       total_count / NULLIF(target_count, 0) AS performance,
+                       good_count / NULLIF(total_count, 0) AS quality,
+                       (good_count / NULLIF(total_count, 0))
+                           * (run_time / NULLIF(total_time, 0))
+                           * (total_count / NULLIF(target_count, 0)) AS oee,
+                       good_count AS total_good_count,
+                       total_count AS total_total_count,
+                       run_time AS total_run_time,
+                       total_time AS total_total_time,
+                       target_count AS total_target_count,
+                       bucket AS timestamp,
+                       start_time,
+                       end_time
+                FROM {table_name}
+                WHERE {asset_filter}
+                  AND bucket >= time_bucket(%s::interval, %s::timestamptz) AND bucket <= %s
+                ORDER BY {key_columns}bucket
+            """
+            params = asset_params + (interval, start_timestamp, end_timestamp)
+            return query, params, key_names + OeeModel.history_columns
+
+        query = f"""
+            SELECT {key_columns}
+                   avg(availability) AS availability,
+                   avg(performance) AS performance,
+                   avg(quality) AS quality,
+                   avg(oee) AS oee,
+                   sum(good_count) AS total_good_count,
+                   sum(total_count) AS total_total_count,
+                   sum(run_time) AS total_run_time,
+                   sum(total_time) AS total_total_time,
+                   sum(target_count) AS total_target_count,
+                   time_bucket('1 day', time) AS timestamp,
+                   min(time) AS start_time,
+                   max(time) AS end_time
+            FROM oee_data
+            WHERE {asset_filter}
+              AND time >= %s AND time <= %s
+            GROUP BY {key_columns}timestamp
+            ORDER BY {key_columns}timestamp
+        """
+        return query, asset_params + (start_timestamp, end_timestamp), key_names + OeeModel.history_columns
+
     @staticmethod
     def get_oee_by_date_range(object_type, object_id, start_date, end_date):
         try:
@@ -188,35 +519,16 @@ class OeeModel:
             start_timestamp = OeeModel._parse_timestamp(start_date)
             end_timestamp = OeeModel._parse_timestamp(end_date)
 
-            query = """
-                SELECT avg(availability) AS availability,
-                       avg(performance) AS performance,
-                       avg(quality) AS quality,
-                       avg(oee) AS oee,
-                       sum(good_count) AS total_good_count,
-                       sum(total_count) AS total_total_count,
-                       sum(run_time) AS total_run_time,
-                       sum(total_time) AS total_total_time,
-                       sum(target_count) AS total_target_count,
-                       time_bucket('1 day', time) AS timestamp,
-                       min(time) AS start_time,
-                       max(time) AS end_time
-                FROM oee_data
-                WHERE object_type = %s AND object_id = %s
-                  AND time >= %s AND time <= %s
-                GROUP BY timestamp
-                ORDER BY timestamp
-            """
+            query, params, columns = OeeModel._history_query(object_type, object_id, start_timestamp, end_timestamp)
 
-            with OeeModel.get_db_connection() as conn:
+            with OeeModel.get_db_connection() as conn, track_query('oee.history_daily') as record:
                 with conn.cursor() as cur:
-                    cur.execute(query, (object_type, object_id, start_timestamp, end_timestamp))
+                    cur.execute(query, params)
                     results = cur.fetchall()
+                    record.rows = len(results)
 
-                    columns = ['availability', 'performance', 'quality', 'oee', 'total_good_count', 'total_total_count',
-                               'total_run_time', 'total_total_time', 'total_target_count', 'timestamp', 'start_time',
-                               'end_time']
-                    oee_list = [dict(zip(columns, row)) for row in results]
+                    row_class = history_row_class(columns)
+                    oee_list = [row_class(*row) for row in results]
 
                     return oee_list
 
@@ -225,3 +537,239 @@ class OeeModel:
         except Exception as e:
             logger.error(f"Failed to fetch OEE data by date range: {e}")
             raise Exception("An error occurred while fetching OEE data by date range.")
+
+    @staticmethod
+    def get_oee_by_rollup(object_type, object_id, start_date, end_date, bucket):
+        # Read a history range from the rollup table of the given bucket
+        try:
+            start_timestamp = OeeModel._parse_timestamp(start_date)
+            end_timestamp = OeeModel._parse_timestamp(end_date)
+
+            query, params, columns = OeeModel._history_query(
+                object_type, object_id, start_timestamp, end_timestamp, bucket=bucket
+            )
+
+            with OeeModel.get_db_connection() as conn, track_query(f'oee.history_{bucket}') as record:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    results = cur.fetchall()
+                    record.rows = len(results)
+
+                    row_class = history_row_class(columns)
+                    return [row_class(*row) for row in results]
+
+        except psycopg2.DatabaseError as e:
+            OeeModel.handle_db_error(e)
+        except Exception as e:
+            logger.error(f"Failed to fetch OEE rollup data by date range: {e}")
+            raise Exception("An error occurred while fetching OEE data by date range.")
+
+    @staticmethod
+    def get_oee_history_many(object_keys, start_date, end_date, bucket=None):
+        # Read the same range for every asset in object_keys with one query. Returns the rows
+        # keyed by (object_type, object_id); assets without data in the range are left out.
+        try:
+            start_timestamp = OeeModel._parse_timestamp(start_date)
+            end_timestamp = OeeModel._parse_timestamp(end_date)
+
+            query, params, columns = OeeModel._history_query(
+                None, None, start_timestamp, end_timestamp, bucket=bucket, object_keys=object_keys
+            )
+            columns = columns[2:]
+
+            with OeeModel.get_db_connection() as conn, track_query(f"oee.history_many_{bucket or 'daily'}") as record:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    results = cur.fetchall()
+                    record.rows = len(results)
+
+                    row_class = history_row_class(columns)
+                    history = {}
+                    for row in results:
+                        history.setdefault((row[0], row[1]), []).append(row_class(*row[2:]))
+                    return history
+
+        except psycopg2.DatabaseError as e:
+            OeeModel.handle_db_error(e)
+        except Exception as e:
+            logger.error(f"Failed to fetch OEE data of several assets by date range: {e}")
+            raise Exception("An error occurred while fetching OEE data by date range.")
+
+    @staticmethod
+    def get_binned_sums(since, resolution, object_type=None):
+        # Summed counts and times of every asset since a time, per bin of resolution seconds,
+        # ordered by bin. Rows: (object_type, object_id, bin, good_count, total_count, run_time,
+        # total_time, target_count), the bin being the epoch time divided by resolution.
+        try:
+            type_filter = "AND object_type = %s" if object_type is not None else ""
+            query = f"""
+                SELECT object_type, object_id, floor(extract(epoch FROM time) / %s)::bigint AS bin,
+                       sum(good_count), sum(total_count), sum(run_time), sum(total_time), sum(target_count)
+                FROM oee_data
+                WHERE time > %s {type_filter}
+                GROUP BY 1, 2, 3
+                ORDER BY 3
+            """
+            params = (resolution, since) + ((object_type,) if object_type is not None else ())
+
+            with OeeModel.get_db_connection() as conn, track_query('oee.binned_sums') as record:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    results = cur.fetchall()
+                    record.rows = len(results)
+                    return results
+
+        except psycopg2.DatabaseError as e:
+            OeeModel.handle_db_error(e)
+        except Exception as e:
+            logger.error(f"Failed to fetch binned OEE sums: {e}")
+            raise Exception("An error occurred while fetching OEE data.")
+
+    @staticmethod
+    def get_rollup_sums(bucket, since, until, object_type=None):
+        # Summed counts and times of every asset per bucket of a rollup table, for the buckets
+        # starting at or after since and before until. Rows as get_binned_sums, with the bucket
+        # start in epoch seconds in place of the bin.
+        try:
+            table_name, _ = OeeModel.rollup_tables[bucket]
+            type_filter = "AND object_type = %s" if object_type is not None else ""
+            query = f"""
+                SELECT object_type, object_id, extract(epoch FROM bucket)::bigint,
+                       good_count, total_count, run_time, total_time, target_count
+                FROM {table_name}
+                WHERE bucket >= %s AND bucket < %s {type_filter}
+            """
+            params = (since, until) + ((object_type,) if object_type is not None else ())
+
+            with OeeModel.get_db_connection() as conn, track_query('oee.rollup_sums') as record:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    results = cur.fetchall()
+                    record.rows = len(results)
+                    return results
+
+        except psycopg2.DatabaseError as e:
+            OeeModel.handle_db_error(e)
+        except Exception as e:
+            logger.error(f"Failed to fetch OEE rollup sums: {e}")
+            raise Exception("An error occurred while fetching OEE data.")
+
+    @staticmethod
+    def get_raw_oee_by_date_range(object_type, object_id, start_date, end_date, select=None, metric='oee',
+                                  chunk_size=5000):
+        # Read the stored rows of a range, unaggregated. With select, a function of the rows'
+        # times in epoch seconds and metric values (NaN where missing) returning the positions of
+        # the rows to keep, the range is read through a named cursor in chunks into one float
+        # array, and only the kept rows are built.
+        try:
+            start_timestamp = OeeModel._parse_timestamp(start_date)
+            end_timestamp = OeeModel._parse_timestamp(end_date)
+
+            query, params, columns = OeeModel._history_query(
+                object_type, object_id, start_timestamp, end_timestamp, raw=True
+            )
+
+            if select is not None:
+                return OeeModel._select_raw_rows(query, params, columns, select, metric, chunk_size)
+
+            with OeeModel.get_db_connection() as conn, track_query('oee.history_raw') as record:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    results = cur.fetchall()
+                    record.rows = len(results)
+
+                    row_class = history_row_class(columns)
+                    return [row_class(*row) for row in results]
+
+        except psycopg2.DatabaseError as e:
+            OeeModel.handle_db_error(e)
+        except Exception as e:
+            logger.error(f"Failed to fetch raw OEE data by date range: {e}")
+            raise Exception("An error occurred while fetching OEE data by date range.")
+
+    @staticmethod
+    def _select_raw_rows(query, params, columns, select, metric, chunk_size):
+        # Every column of oee_data is a double, and a time in epoch microseconds is an integer
+        # a double holds exactly, so each chunk becomes a float array without losing precision
+        value_columns = columns[1:]
+        array_query = f"""
+            SELECT (extract(epoch FROM timestamp) * 1000000)::float8, {', '.join(value_columns)}
+            FROM ({query}) history
+            ORDER BY timestamp
+        """
+
+        with OeeModel.get_db_connection() as conn, track_query('oee.history_raw') as record:
+            with conn.cursor(name='oee_history_downsample') as cur:
+                cur.itersize = chunk_size
+                cur.execute(array_query, params)
+                chunks = []
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    chunks.append(np.array(rows, dtype=float))
+            values = np.concatenate(chunks) if chunks else np.empty((0, len(columns)))
+            record.rows = len(values)
+
+        keep = select(values[:, 0] / 1e6, values[:, columns.index(metric)])
+
+        row_class = history_row_class(columns)
+        epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return [
+            row_class(epoch + timedelta(microseconds=int(row[0])),
+                      *(None if np.isnan(value) else float(value) for value in row[1:]))
+            for row in values[keep]
+        ]
+
+    @staticmethod
+    def stream_oee_by_date_range(object_type, object_id, start_date, end_date, bucket=None, raw=False,
+                                 chunk_size=5000):
+        # Returns the column names and a generator of row chunks read through a named, server-side
+        # cursor, so only one chunk is held in memory. The pooled connection is held until the
+        # generator is exhausted or closed.
+        start_timestamp = OeeModel._parse_timestamp(start_date)
+        end_timestamp = OeeModel._parse_timestamp(end_date)
+
+        query, params, columns = OeeModel._history_query(
+            object_type, object_id, start_timestamp, end_timestamp, bucket=bucket, raw=raw
+        )
+
+        def generate():
+            # Only the time spent in the database counts towards the query, not the time the
+            # response takes to consume each chunk
+            elapsed, row_count = 0.0, 0
+            try:
+                with OeeModel.get_db_connection() as conn:
+                    with conn.cursor(name='oee_history_export') as cur:
+                        cur.itersize = chunk_size
+                        started = time.perf_counter()
+                        cur.execute(query, params)
+                        while True:
+                            rows = cur.fetchmany(chunk_size)
+                            elapsed += time.perf_counter() - started
+                            if not rows:
+                                break
+                            row_count += len(rows)
+                            yield rows
+                            started = time.perf_counter()
+
+            except psycopg2.DatabaseError as e:
+                OeeModel.handle_db_error(e)
+            finally:
+                if metrics.enabled:
+                    observe_query('oee.history_export', elapsed, row_count)
+
+        return columns, generate()
+
+
+# History rows of each column layout, as slotted dataclasses: a long range holds no dict per
+# row, and the JSON provider serializes them as objects with the columns in order
+history_row_classes = {
+    tuple(columns): make_dataclass(name, columns, slots=True)
+    for name, columns in (('RawOeeRow', OeeModel.raw_columns), ('OeeHistoryRow', OeeModel.history_columns),
+                          ('OeeShiftRow', OeeModel.shift_columns))
+}
+
+
+def history_row_class(columns):
+    return history_row_classes[tuple(columns)]
@@ -0,0 +1,173 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Create a logger
+logger = logging.getLogger(__name__)
+
+
+class LatestOeeCache:
+    """In-memory cache of the latest OEE reading per (object_type, object_id).
+
+    Store paths write through it as they insert, reads fall back to the database on a miss.
+    Every ingest bumps a write version shared by all worker processes once it has committed.
+    Reads check that version at most every check_interval seconds, and when another worker
+    has written since, every entry is expired. Entries also expire after ttl seconds, which
+    bounds the staleness when the version cannot be read, and the least recently used entries
+    are evicted beyond max_size.
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0, check_interval=1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # The shared write version and time of the last write, as of the last check, and the
+        # versions of this worker's own writes not checked yet
+        self.write_version = None
+        self.written_at = None
+        self._checked_at = None
+        self._own_writes = set()
+        # Entries stored before this monotonic time are expired
+        self._stale_before = 0.0
+
+        # Bumped whenever a reading changes, so responses built from the cache can be validated
+        self.version = 0
+        self.modified_at = datetime.now(timezone.utc)
+
+        # Counters reported by stats()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def configure(self, max_size, ttl, check_interval):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self.check_interval = check_interval
+            self._evict()
+
+    def wrote(self, version, written_at):
+        # An ingest of this worker bumped the shared version; its rows went through put
+        with self._lock:
+            self._own_writes.add(version)
+
+    def validate(self, fetch_version):
+        # Check the shared write version, fetched by fetch_version as (version, written_at), when
+        # the last check is check_interval seconds old. Returns the version and write time as of
+        # the last check, (None, None) until one succeeds.
+        checked_at = self._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.check_interval:
+            # Read without the lock: the common case of every cached read
+            return self.write_version, self.written_at
+
+        with self._lock:
+            due = self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval
+            if not due:
+                return self.write_version, self.written_at
+            # Other threads keep the previous version while this one checks
+            self._checked_at = started_at = time.monotonic()
+
+        try:
+            version, written_at = fetch_version()
+        except Exception as e:
+            logger.warning(f"Failed to read the shared write version, relying on the cache ttl: {e}")
+            with self._lock:
+                return self.write_version, self.written_at
+
+        with self._lock:
+            previous = self.write_version
+            if previous is not None and version != previous:
+                # Writes of other workers are the versions since the last check that are not
+                # this worker's own. Entries filled after the check started already see them.
+                own = sum(1 for own_version in self._own_writes if previous < own_version <= version)
+                if version < previous or version - previous > own:
+                    self._stale_before = started_at
+                    self._invalidations += 1
+            self._own_writes = {own_version for own_version in self._own_writes if own_version > version}
+            self.write_version, self.written_at = version, written_at
+            return version, written_at
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            # Expired entries are kept until they are refilled, so that refilling an unchanged
+            # reading does not bump the version
+            reading, stored_at = entry
+            if stored_at < self._stale_before or time.monotonic() - stored_at > self.ttl:
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return reading
+
+    def get_many(self, keys):
+        # Split keys into cached readings and keys that have to be read from the database
+        found = {}
+        missing = []
+        for key in keys:
+            reading = self.get(key)
+            if reading is None:
+                missing.append(key)
+            else:
+                found[key] = reading
+        return found, missing
+
+    def put(self, key, reading):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            # Never replace a reading with an older one
+            if entry is not None and entry[0]['timestamp'] > reading['timestamp']:
+                return
+
+            self._entries[key] = (reading, time.monotonic())
+            self._entries.move_to_end(key)
+            if entry is None or entry[0] != reading:
+                self._changed()
+            self._evict()
+
+    def _changed(self):
+        self.version += 1
+        self.modified_at = datetime.now(timezone.utc)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._changed()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else None,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+                'write_version': self.write_version,
+            }
+
+
+latest_oee_cache = LatestOeeCache()
@@ -0,0 +1,15 @@
+from app.models.asset import AssetModel
+
+
+class ShiftCalendarModel:
+    # Shift calendars of the sites; the rows of oee_data_shift are written by the shift service
+    table_name = 'shift_calendars'
+    # Class of the per-site advisory locks that order calendar saves and ingests of a site
+    lock_class = 7294016
+
+    @staticmethod
+    def get_all():
+        return AssetModel.fetch_all(
+            f"SELECT site_id, timezone, shifts FROM {ShiftCalendarModel.table_name}",
+            name='shift_calendar.all'
+        )
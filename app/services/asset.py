@@ -1,6 +1,10 @@
 from flask import jsonify
 from app.models.asset import *
 from app.models.asset_tree import AssetTreeModel
+from app.models.asset_index import asset_index
+from app.services.hierarchy_rollup import hierarchy_rollup
+from app.services.rolling_oee import rolling_oee
+from app.services.shift_calendar import shift_calendars, parse_calendar
 
 
 logger = logging.getLogger(__name__)
@@ -16,8 +20,10 @@ def create_asset(asset_class, data):
         asset = asset_class(**data)
         asset.create()
         if asset:
+            row = asset.to_row()
+            asset_index.put(row)
             return jsonify({
-                'data': asset.__dict__,
+                'data': row,
                 'message': f'{asset_class.object_name} created successfully'
             }), 200
         else:
@@ -29,9 +35,7 @@ def create_asset(asset_class, data):
 
 def get_all_assets(asset_class):
     try:
-        asset_instance = asset_class()
-        assets = asset_instance.get_all()
-        serialized = [asset.__dict__ for asset in assets]
+        serialized = asset_index.of_type(asset_class.object_type)
         return jsonify({
             'data': serialized,
             'message': f'All {asset_class.object_name}s retrieved successfully'
@@ -48,8 +52,11 @@ def get_parent_asset(asset_class, asset_id):
         if asset.parent_table_name is None:
             return jsonify({'error': f'{asset.object_name}s have no parent.'}), 500
 
-        assets = asset.get_parent(asset_id)
-        serialized = [asset.__dict__ for asset in assets]
+        if asset_index.get(asset_class.object_type, asset_id) is None:
+            return jsonify({'error': 'Asset not found'}), 404
+
+        parent = asset_index.parent(asset_class.object_type, asset_id)
+        serialized = [parent] if parent is not None else []
         return jsonify({
             'data': serialized,
             'message': f'the parent of the {asset_class.object_name} retrieved successfully'
@@ -66,8 +73,7 @@ def get_child_assets(asset_class, asset_id):
         if asset.child_table_name is None:
             return jsonify({'error': f'{asset.object_name}s have no children.'}), 500
 
-        assets = asset.get_children(asset_id)
-        serialized = [asset.__dict__ for asset in assets]
+        serialized = asset_index.children(asset_class.object_type, asset_id)
         return jsonify({
             'data': serialized,
             'message': f'Children of {asset_class.object_name}s retrieved successfully'
@@ -77,12 +83,68 @@ def get_child_assets(asset_class, asset_id):
         return jsonify({'error': 'An error occurred while fetching child assets.'}), 500
 
 
+def nest_assets(assets):
+    # Shape a flat list of assets like the asset tree: each node holds its data and its
+    # children keyed by ID; assets whose parent is not in the list become the roots
+    nodes = {(item.object_type, item.id): {'data': item} for item in assets}
+
+    nested = {}
+    for item in assets:
+        parent = nodes.get((item.object_type + 1, item.parent_id))
+        target = parent if parent is not None else nested
+        target[str(item.id)] = nodes[(item.object_type, item.id)]
+
+    return nested
+
+
+def get_descendant_assets(asset_class, asset_id, depth=None, nested=False):
+    try:
+        asset = asset_class()
+
+        if asset.child_table_name is None:
+            return jsonify({'error': f'{asset.object_name}s have no children.'}), 500
+
+        if asset_index.get(asset_class.object_type, asset_id) is None:
+            return jsonify({'error': 'Asset not found'}), 404
+
+        assets = asset_index.descendants(asset_class.object_type, asset_id, depth)
+        return jsonify({
+            'data': nest_assets(assets) if nested else assets,
+            'message': f'Descendants of the {asset_class.object_name} retrieved successfully'
+        }), 200
+    except Exception as e:
+        logger.error(f"Error occurred while fetching descendant assets: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching descendant assets.'}), 500
+
+
+def get_ancestor_assets(asset_class, asset_id, nested=False):
+    try:
+        asset = asset_class()
+
+        if asset.parent_table_name is None:
+            return jsonify({'error': f'{asset.object_name}s have no parent.'}), 500
+
+        if asset_index.get(asset_class.object_type, asset_id) is None:
+            return jsonify({'error': 'Asset not found'}), 404
+
+        # Nearest first: the parent, then its parent, up to the enterprise
+        assets = [asset_index.get(*key) for key in asset_index.ancestors(asset_class.object_type, asset_id)]
+        assets = [item for item in assets if item is not None]
+        return jsonify({
+            'data': nest_assets(assets) if nested else assets,
+            'message': f'Ancestors of the {asset_class.object_name} retrieved successfully'
+        }), 200
+    except Exception as e:
+        logger.error(f"Error occurred while fetching ancestor assets: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching ancestor assets.'}), 500
+
+
 def get_asset(asset_class, asset_id):
     try:
-        asset = asset_class().get(asset_id)
+        asset = asset_index.get(asset_class.object_type, asset_id)
         if asset:
             return jsonify({
-                'data': asset.__dict__,
+                'data': asset,
                 'message': f'{asset_class.object_name} retrieved successfully'
             }), 200
         else:
@@ -94,10 +156,16 @@ def get_asset(asset_class, asset_id):
 
 def update_asset(asset_class, data, asset_id):
     try:
-        asset = asset_class(**data)
-        asset.update(asset_id)
+        # The asset is the one in the URL, whatever id or object_type the body carries
+        fields = {key: value for key, value in data.items() if key not in ('id', 'object_type')}
+        asset = asset_class(**fields).update(asset_id)
+        if asset is None:
+            return jsonify({'error': 'Asset not found'}), 404
+
+        row = asset.to_row()
+        asset_index.put(row)
         return jsonify({
-            'data': asset.__dict__,
+            'data': row,
             'message': f'{asset_class.object_name} updated successfully'
         }), 200
     except Exception as e:
@@ -110,8 +178,12 @@ def delete_asset(asset_class, asset_id):
         asset = asset_class().get(asset_id)
         if asset:
             asset.delete()
+            asset_index.remove(asset_class.object_type, asset_id)
+            # The derived parent-level OEE still counts the deleted asset's readings
+            hierarchy_rollup.invalidate()
+            rolling_oee.invalidate()
             return jsonify({
-                'data': asset.__dict__,
+                'data': asset.to_row(),
                 'message': f'{asset_class.object_name} deleted successfully'
             }), 200
         else:
@@ -121,9 +193,62 @@ def delete_asset(asset_class, asset_id):
         return jsonify({'error': 'An error occurred while deleting the asset.'}), 500
 
 
+def get_shift_calendar(site_id):
+    try:
+        if asset_index.get(SiteModel.object_type, site_id) is None:
+            return jsonify({'error': 'Asset not found'}), 404
+
+        calendar = shift_calendars.get(site_id)
+        if calendar is None:
+            return jsonify({'error': 'The site has no shift calendar.'}), 404
+        return jsonify({
+            'data': calendar,
+            'message': 'Shift calendar retrieved successfully'
+        }), 200
+    except Exception as e:
+        logger.error(f"Error occurred while fetching the shift calendar: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while fetching the shift calendar.'}), 500
+
+
+def save_shift_calendar(site_id, data):
+    # Saving a calendar rebuilds the shift rollup of every asset of the site
+    try:
+        calendar = parse_calendar(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        if asset_index.get(SiteModel.object_type, site_id) is None:
+            return jsonify({'error': 'Asset not found'}), 404
+
+        shift_count = shift_calendars.save(site_id, calendar)
+        return jsonify({
+            'data': calendar,
+            'message': f'Shift calendar saved, {shift_count} asset shifts rebuilt'
+        }), 200
+    except Exception as e:
+        logger.error(f"Error occurred while saving the shift calendar: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while saving the shift calendar.'}), 500
+
+
+def delete_shift_calendar(site_id):
+    # The shift rollup of the site's assets is dropped with the calendar
+    try:
+        if asset_index.get(SiteModel.object_type, site_id) is None:
+            return jsonify({'error': 'Asset not found'}), 404
+        if shift_calendars.get(site_id) is None:
+            return jsonify({'error': 'The site has no shift calendar.'}), 404
+
+        shift_calendars.save(site_id, None)
+        return jsonify({'message': 'Shift calendar deleted successfully'}), 200
+    except Exception as e:
+        logger.error(f"Error occurred while deleting the shift calendar: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An error occurred while deleting the shift calendar.'}), 500
+
+
 def get_tree():
     try:
-        assets = AssetTreeModel.get_tree()
+        assets = AssetTreeModel.get_tree(asset_index.nodes())
         return jsonify({
             'data': assets,
             'message': 'All assets retrieved successfully'
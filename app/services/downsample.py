@@ -0,0 +1,85 @@
+import numpy as np
+from datetime import datetime
+
+# Methods accepted by downsample_rows
+downsample_methods = ('lttb', 'minmax')
+
+
+def _as_arrays(rows, metric):
+    # Times as epoch seconds and metric values as floats, NaN where missing
+    x = np.array([row.timestamp.timestamp() if isinstance(row.timestamp, datetime) else row.timestamp
+                  for row in rows], dtype=float)
+    y = np.array([getattr(row, metric) for row in rows], dtype=float)
+    return x, y
+
+
+def downsample_indices(x, y, max_points, method='lttb'):
+    # Indices of the points kept out of times x and values y, NaN for missing values. Missing
+    # values are filled with the mean so they take part in the geometry without being picked
+    # over real values.
+    missing = np.isnan(y)
+    if missing.any():
+        y = np.where(missing, np.nanmean(y) if not missing.all() else 0.0, y)
+    if method == 'minmax':
+        return minmax_indices(x, y, max_points)
+    return lttb_indices(x, y, max_points)
+
+
+def lttb_indices(x, y, max_points):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The rest is split into max_points - 2 buckets of
+    equal size, and each bucket keeps the point forming the largest triangle with the point kept
+    before it and the mean of the next bucket, which preserves peaks and dips.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+
+    # Bucket boundaries over the inner points 1..n-2
+    edges = np.floor(np.linspace(1, n - 1, max_points - 1)).astype(int)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Mean of every bucket, and of the last point as the bucket after the last one
+    counts = ends - starts
+    mean_x = np.append(np.add.reduceat(x[:-1], starts) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:-1], starts) / counts, y[-1])
+
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for bucket, (start, end) in enumerate(zip(starts, ends)):
+        # Twice the area of the triangle (a, candidate, next bucket mean), for every candidate
+        next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[bucket + 1] = a
+    return indices
+
+
+def minmax_indices(x, y, max_points):
+    """Indices of the lowest and highest point of each of max_points // 2 buckets of equal length
+    in time, in time order. Keeps every extreme, at the cost of a less even spacing than LTTB."""
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+
+    buckets = max(max_points // 2, 1)
+    bucket = np.minimum(((x - x[0]) / ((x[-1] - x[0]) or 1.0) * buckets).astype(int), buckets - 1)
+
+    # Sort by bucket, then value: the first and last point of each bucket are its minimum and maximum
+    order = np.lexsort((y, bucket))
+    boundaries = np.flatnonzero(np.diff(bucket[order])) + 1
+    firsts = order[np.concatenate(([0], boundaries))]
+    lasts = order[np.concatenate((boundaries - 1, [n - 1]))]
+    return np.unique(np.concatenate((firsts, lasts)))
+
+
+def downsample_rows(rows, max_points, metric='oee', method='lttb'):
+    # Keep at most max_points of the rows, chosen by the shape of metric over time. The kept rows
+    # are returned whole, so every column stays consistent with its timestamp.
+    if len(rows) <= max_points:
+        return rows
+
+    x, y = _as_arrays(rows, metric)
+    return [rows[index] for index in downsample_indices(x, y, max_points, method)]
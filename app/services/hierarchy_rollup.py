@@ -0,0 +1,224 @@
+import time
+import logging
+import threading
+from psycopg2.extras import execute_values
+from app.database import connection_pool
+from app.metrics import track_query
+from app.models.asset import CellModel
+from app.models.asset_index import asset_index
+from app.models.oee import OeeModel
+
+# Create a logger
+logger = logging.getLogger(__name__)
+
+# Positions of the summed fields in a stored oee_data row (see historian RETURNING clause)
+GOOD_COUNT, TOTAL_COUNT, RUN_TIME, TOTAL_TIME, TARGET_COUNT, TIME = 6, 7, 8, 9, 10, 11
+COUNT_FIELDS = (GOOD_COUNT, TOTAL_COUNT, RUN_TIME, TOTAL_TIME, TARGET_COUNT)
+
+
+class HierarchyRollup:
+    """Incrementally maintained parent-level OEE, derived from cell readings.
+
+    Every line, area, site and enterprise holds the sums of the good, total and target counts
+    and run and total times of the latest reading of each cell under it. When a cell reading
+    is stored, the difference with that cell's previous reading is added to each of its
+    ancestors, so an ingest costs O(depth) instead of a query over the fleet.
+
+    The latest counts of each cell and the sums of each parent are kept in the database and
+    updated in the ingest transaction, so every worker process serves the same parent values
+    and a rolled back ingest leaves them untouched. Cell rows are locked while their difference
+    is applied, so concurrent ingests of one cell add up in order. The hierarchy comes from the
+    asset index; the sums are rebuilt from the latest cell counts every reseed_interval seconds
+    and after the hierarchy changes, which corrects parents a worker with a stale index added to.
+    Derived values never go into oee_data: history reads them from the rollups.
+    """
+
+    # Minimum age, in seconds, of the asset index before an unknown cell triggers a reload
+    reload_interval = 60.0
+
+    def __init__(self):
+        self.enabled = True
+        self.reseed_interval = 300.0
+
+        self._lock = threading.Lock()
+        self._seeded_at = None
+
+    def configure(self, enabled, reseed_interval):
+        with self._lock:
+            self.enabled = enabled
+            self.reseed_interval = reseed_interval
+            self._seeded_at = None
+
+    def invalidate(self):
+        # Rebuild the parent sums before the next ingest
+        with self._lock:
+            self._seeded_at = None
+
+    def _rebuild(self):
+        # Recompute every parent's sums from the latest cell counts. The cell table is locked
+        # against ingests meanwhile, which holds them up for one read of a row per cell.
+        with connection_pool.connection() as conn, track_query('hierarchy.rebuild') as record:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"LOCK TABLE {OeeModel.cell_latest_table} IN SHARE ROW EXCLUSIVE MODE")
+                    cur.execute(
+                        f"""
+                        SELECT object_type, object_id, good_count, total_count, run_time, total_time,
+                               target_count, time
+                        FROM {OeeModel.cell_latest_table}
+                        """
+                    )
+                    totals = {}
+                    for object_type, object_id, *counts, reading_time in cur.fetchall():
+                        for parent in self.ancestors((object_type, object_id)):
+                            current = totals.get(parent)
+                            if current is None:
+                                totals[parent] = [*counts, reading_time]
+                                continue
+                            for index, count in enumerate(counts):
+                                current[index] += count
+                            current[-1] = max(current[-1], reading_time)
+
+                    cur.execute(f"DELETE FROM {OeeModel.parent_totals_table}")
+                    execute_values(
+                        cur,
+                        f"""
+                        INSERT INTO {OeeModel.parent_totals_table} (
+                            object_type, object_id, good_count, total_count, run_time, total_time,
+                            target_count, time)
+                        VALUES %s
+                        """,
+                        [(*parent, *values) for parent, values in totals.items()],
+                        page_size=1000
+                    )
+                    record.rows = len(totals)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def prepare(self, object_keys):
+        # Make sure the parent sums are current and the asset index knows every cell about to be
+        # stored. Called before the ingest transaction opens, so neither competes for its connection.
+        if not self.enabled:
+            return
+
+        unknown = any(
+            key[0] == CellModel.object_type and asset_index.get(*key) is None
+            for key in object_keys
+        )
+        if unknown and (asset_index.age() or 0) > self.reload_interval:
+            asset_index.reload()
+
+        with self._lock:
+            due = self._seeded_at is None or time.monotonic() - self._seeded_at > self.reseed_interval
+            if due:
+                self._seeded_at = time.monotonic()
+        if due:
+            try:
+                self._rebuild()
+            except Exception:
+                self.invalidate()
+                raise
+
+    def ancestors(self, key):
+        return asset_index.ancestors(*key)
+
+    def apply(self, cur, stored):
+        # Fold stored cell rows into their ancestors, in the caller's transaction. Returns the new
+        # readings of the touched parents as (object_type, object_id, *OeeModel.latest_columns).
+        if not self.enabled:
+            return []
+
+        # Only the newest row of each cell in the batch can be its latest reading
+        latest = {}
+        for row in stored:
+            key = (row[0], row[1])
+            if row[0] != CellModel.object_type or asset_index.get(*key) is None:
+                continue
+            if key not in latest or row[TIME] >= latest[key][TIME]:
+                latest[key] = row
+        if not latest:
+            return []
+
+        # Every cell gets a row to lock, taken in key order so concurrent ingests wait on each
+        # other rather than deadlock
+        keys = sorted(latest)
+        execute_values(
+            cur,
+            f"INSERT INTO {OeeModel.cell_latest_table} (object_type, object_id) VALUES %s ON CONFLICT DO NOTHING",
+            keys,
+            page_size=1000
+        )
+        cur.execute(
+            f"""
+            SELECT object_type, object_id, good_count, total_count, run_time, total_time, target_count, time
+            FROM {OeeModel.cell_latest_table}
+            WHERE (object_type, object_id) IN (SELECT * FROM unnest(%s::int[], %s::int[]))
+            ORDER BY object_type, object_id
+            FOR UPDATE
+            """,
+            ([key[0] for key in keys], [key[1] for key in keys])
+        )
+        previous = {(row[0], row[1]): row[2:] for row in cur.fetchall()}
+
+        cells = []
+        deltas = {}
+        for key in keys:
+            row = latest[key]
+            *before, before_time = previous[key]
+            # A reading older than the cell's latest one changes nothing
+            if row[TIME] < before_time:
+                continue
+            counts = tuple(row[field] or 0.0 for field in COUNT_FIELDS)
+            cells.append((*key, *counts, row[TIME]))
+
+            delta = [count - old for count, old in zip(counts, before)]
+            for parent in self.ancestors(key):
+                current = deltas.get(parent)
+                if current is None:
+                    deltas[parent] = [*delta, row[TIME]]
+                    continue
+                for index, change in enumerate(delta):
+                    current[index] += change
+                current[-1] = max(current[-1], row[TIME])
+        if not cells:
+            return []
+
+        execute_values(
+            cur,
+            f"""
+            UPDATE {OeeModel.cell_latest_table} AS c SET
+                good_count = v.good_count, total_count = v.total_count, run_time = v.run_time,
+                total_time = v.total_time, target_count = v.target_count, time = v.time
+            FROM (VALUES %s) AS v(object_type, object_id, good_count, total_count, run_time, total_time,
+                                  target_count, time)
+            WHERE c.object_type = v.object_type AND c.object_id = v.object_id
+            """,
+            cells,
+            page_size=1000
+        )
+
+        # Parents are upserted in key order too; the sums only ever change by addition
+        return execute_values(
+            cur,
+            f"""
+            INSERT INTO {OeeModel.parent_totals_table} AS p (
+                object_type, object_id, good_count, total_count, run_time, total_time, target_count, time)
+            VALUES %s
+            ON CONFLICT (object_type, object_id) DO UPDATE SET
+                good_count = p.good_count + EXCLUDED.good_count,
+                total_count = p.total_count + EXCLUDED.total_count,
+                run_time = p.run_time + EXCLUDED.run_time,
+                total_time = p.total_time + EXCLUDED.total_time,
+                target_count = p.target_count + EXCLUDED.target_count,
+                time = GREATEST(p.time, EXCLUDED.time)
+            RETURNING object_type, object_id, {OeeModel.derived_reading_columns}
+            """,
+            [(*parent, *values) for parent, values in sorted(deltas.items())],
+            page_size=1000,
+            fetch=True
+        )
+
+
+hierarchy_rollup = HierarchyRollup()
@@ -1,131 +1,244 @@
-import os
+import logging
 import psycopg2
+from datetime import timezone
+from psycopg2.extras import execute_values
 from flask import jsonify
 from dotenv import load_dotenv
+from app.database import connection_pool
+from app.metrics import track_query
+from app.models.oee import OeeModel
+from app.models.oee_cache import latest_oee_cache
+from app.models.asset import CellModel
+from app.services.hierarchy_rollup import hierarchy_rollup
+from app.services.rolling_oee import rolling_oee
+from app.services.shift_calendar import shift_calendars
 
 load_dotenv()
+
+# Create a logger
+logger = logging.getLogger(__name__)
 # TODO Move this functionality into the oee model
 
 
-def create_oee_data_table():
+required_fields = [
+    'run_time',
+    'total_time',
+    'total_count',
+    'target_count',
+    'good_count',
+    'availability',
+    'performance',
+    'quality',
+    'oee',
+    'timestamp',
+    'object_type',
+    'object_id'
+]
+
+
+def find_missing_field(oee_data):
+    # Return the first required field missing from oee_data, or None when it is complete
+    for field in required_fields:
+        if field not in oee_data:
+            return field
+    return None
+
+
+def cache_stored_readings(stored):
+    # Write stored rows through to the latest-OEE cache, exactly as the database returned them
+    for row in stored:
+        latest_oee_cache.put((row[0], row[1]), dict(zip(OeeModel.latest_columns, row[2:])))
+
+
+def write_oee_rows(cur, rows):
+    # One multi-row INSERT per page of 1000 rows. Returns the stored rows as
+    # (object_type, object_id, *OeeModel.latest_columns), with the time the database stored
+    return execute_values(
+        cur,
+        """
+        INSERT INTO oee_data (
+        run_time, total_time, total_count, target_count, good_count,
+        availability, performance, quality, oee, time, object_type, object_id)
+        VALUES %s
+        RETURNING object_type, object_id, availability, performance, quality, oee,
+                  good_count, total_count, run_time, total_time, target_count, time
+        """,
+        rows,
+        page_size=1000,
+        fetch=True
+    )
+
+
+def hour_of(time):
+    # Start of the UTC hour holding time; every rollup bucket is a whole number of these hours
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc)
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+parent_row_warned = False
+
+
+def warn_parent_row():
+    # Logged once per process, as a client posting parent rows posts them all the time
+    global parent_row_warned
+    if not parent_row_warned:
+        parent_row_warned = True
+        logger.warning("Readings posted for lines, areas, sites or enterprises are stored but left out of "
+                       "their rollups, which the hierarchy rollup derives from their cells.")
+
+
+def update_rollups(cur, stored):
+    # Add stored rows to the hourly, daily and weekly rollups, in the caller's transaction.
+    # Cell rows are also added to the rollups of every ancestor of the cell. Rows are summed
+    # per asset and hour first, so a batch sends one row per asset and hour touched, and all
+    # three tables are updated by a single statement.
+    sums = {}
+    for row in stored:
+        keys = [(row[0], row[1])]
+        if hierarchy_rollup.enabled:
+            if row[0] != CellModel.object_type:
+                # A parent's rollups are the sums of its cells; a row posted for the parent
+                # itself is stored, but would count twice there
+                warn_parent_row()
+                continue
+            keys.extend(hierarchy_rollup.ancestors(keys[0]))
+
+        hour = hour_of(row[11])
+        values = (row[6] or 0.0, row[7] or 0.0, row[10] or 0.0, row[8] or 0.0, row[9] or 0.0)
+        for key in keys:
+            current = sums.get((key, hour))
+            if current is None:
+                sums[(key, hour)] = [1, *values, row[11], row[11]]
+                continue
+            current[0] += 1
+            for index, value in enumerate(values, 1):
+                current[index] += value
+            current[6] = min(current[6], row[11])
+            current[7] = max(current[7], row[11])
+
+    rows = [(*key, hour, *values) for (key, hour), values in sums.items()]
+    if not rows:
+        return
+
+    upserts = [
+        f"""
+        upsert_{bucket} AS (
+            INSERT INTO {table_name} AS r (
+                object_type, object_id, bucket, sample_count, good_count, total_count,
+                target_count, run_time, total_time, start_time, end_time)
+            SELECT object_type, object_id, time_bucket('{interval}', hour), sum(sample_count),
+                   sum(good_count), sum(total_count), sum(target_count), sum(run_time),
+                   sum(total_time), min(start_time), max(end_time)
+            FROM v
+            GROUP BY 1, 2, 3
+            ON CONFLICT (object_type, object_id, bucket) DO UPDATE SET
+                sample_count = r.sample_count + EXCLUDED.sample_count,
+                good_count = r.good_count + EXCLUDED.good_count,
+                total_count = r.total_count + EXCLUDED.total_count,
+                target_count = r.target_count + EXCLUDED.target_count,
+                run_time = r.run_time + EXCLUDED.run_time,
+                total_time = r.total_time + EXCLUDED.total_time,
+                start_time = LEAST(r.start_time, EXCLUDED.start_time),
+                end_time = GREATEST(r.end_time, EXCLUDED.end_time)
+        )"""
+        for bucket, (table_name, interval) in OeeModel.rollup_tables.items()
+    ]
+
+    execute_values(
+        cur,
+        f"""
+        WITH v (object_type, object_id, hour, sample_count, good_count, total_count,
+                target_count, run_time, total_time, start_time, end_time) AS (VALUES %s),
+        {",".join(upserts)}
+        SELECT 1
+        """,
+        rows,
+        page_size=1000
+    )
+
+
+def publish_write(conn):
+    # Bump the shared write version once the rows are visible, so the latest-OEE caches of other
+    # workers expire the readings they replaced. A failure is only logged: the rows are stored,
+    # and the cache ttl still bounds how long the previous readings are served.
     try:
-        # Establish a connection to the database
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT")
-        )
-
-        # Open a cursor and execute SQL command to create the table
-        cur = conn.cursor()
-
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS oee_data (
-                time TIMESTAMPTZ NOT NULL,
-                run_time DOUBLE PRECISION,
-                total_time DOUBLE PRECISION,
-                total_count DOUBLE PRECISION,
-                target_count DOUBLE PRECISION,
-                good_count DOUBLE PRECISION,
-                availability DOUBLE PRECISION,
-                performance DOUBLE PRECISION,
-                quality DOUBLE PRECISION,
-                oee DOUBLE PRECISION,
-                object_type INTEGER,
-                object_id INTEGER
+        with conn.cursor() as cur, track_query('historian.write_version'):
+            cur.execute(
+                f"""
+                UPDATE {OeeModel.write_version_table} SET version = version + 1, written_at = now()
+                RETURNING version, written_at
+                """
             )
-            """
-        )
+            row = cur.fetchone()
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.warning(f"Failed to bump the shared write version: {e}")
+        return
+    if row is not None:
+        latest_oee_cache.wrote(*row)
+
+
+def store_oee_rows(rows):
+    # Write rows, the parent sums derived from them and their rollups (per shift included)
+    # in one transaction, then update the latest-OEE cache
+    hierarchy_rollup.prepare((row[10], row[11]) for row in rows)
+    rolling_oee.prepare()
+    shift_calendars.prepare()
 
+    with connection_pool.connection() as conn:
         try:
-            # Add time series hypertable to the table
-            cur.execute("SELECT create_hypertable('oee_data', 'time', chunk_time_interval => INTERVAL '1 day')")
-        except psycopg2.DatabaseError as hypertable_error:
-            # Handle hypertable creation error (table is already a hypertable)
-            # You can choose to ignore the error or handle it in a specific way
-            print(f"Hypertable creation error: {str(hypertable_error)}")
-
-        # Commit changes and close the connection
-        conn.commit()
-        cur.close()
-        conn.close()
+            with conn.cursor() as cur:
+                with track_query('historian.insert') as record:
+                    stored = write_oee_rows(cur, rows)
+                    record.rows = len(stored)
+                with track_query('historian.parent_sums') as record:
+                    parents = hierarchy_rollup.apply(cur, stored)
+                    record.rows = len(parents)
+                with track_query('historian.rollups'):
+                    update_rollups(cur, stored)
+                with track_query('historian.shift_rollup'):
+                    shift_calendars.update_rollup(cur, stored)
+                rolling_oee.apply(stored)
+                with track_query('historian.commit'):
+                    conn.commit()
 
-        return {"message": "Successfully created the oee_data table in TimescaleDB"}, 200
+        except Exception:
+            conn.rollback()
+            # The rolling windows may already include the rolled back rows
+            rolling_oee.invalidate()
+            raise
 
-    except psycopg2.DatabaseError as e:
-        # Handle database errors
-        raise e
+        publish_write(conn)
 
-    except Exception as e:
-        # Handle any other errors
-        raise e
+    cache_stored_readings(stored)
+    cache_stored_readings(parents)
+    return stored
 
 
 def insert_oee_data(oee_data):
 
-    required_fields = [
-        'run_time',
-        'total_time',
-        'total_count',
-        'target_count',
-        'good_count',
-        'availability',
-        'performance',
-        'quality',
-        'oee',
-        'timestamp',
-        'object_type',
-        'object_id'
-    ]
-
-    for field in required_fields:
-        if field not in oee_data:
-            return jsonify({'error': f'Missing required field: {field}'}), 400
+    missing_field = find_missing_field(oee_data)
+    if missing_field is not None:
+        return jsonify({'error': f'Missing required field: {missing_field}'}), 400
 
     try:
 
-        # Establish a connection to the database
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT")
-        )
-
-        # Open a cursor and execute SQL commands
-        cur = conn.cursor()
-
-        cur.execute(
-            """
-            INSERT INTO oee_data (
-            run_time, total_time, total_count, target_count, good_count,
-            availability, performance, quality, oee, time, object_type, object_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                oee_data['run_time'],
-                oee_data['total_time'],
-                oee_data['total_count'],
-                oee_data['target_count'],
-                oee_data['good_count'],
-                oee_data['availability'],
-                oee_data['performance'],
-                oee_data['quality'],
-                oee_data['oee'],
-                oee_data['timestamp'],
-                oee_data['object_type'],
-                oee_data['object_id']
-            )
-        )
-
-        # Commit changes and close the connection
-        conn.commit()
-        cur.close()
-        conn.close()
+        store_oee_rows([(
+            oee_data['run_time'],
+            oee_data['total_time'],
+            oee_data['total_count'],
+            oee_data['target_count'],
+            oee_data['good_count'],
+            oee_data['availability'],
+            oee_data['performance'],
+            oee_data['quality'],
+            oee_data['oee'],
+            oee_data['timestamp'],
+            oee_data['object_type'],
+            oee_data['object_id']
+        )])
 
         return {"message": "OEE data inserted successfully"}, 200
 
@@ -140,5 +253,43 @@ def insert_oee_data(oee_data):
         raise e
 
 
-# Call the create_oee_data_table function to create the table
-create_oee_data_table()
+def insert_oee_data_batch(oee_records):
+    # Validate every record, then write the valid ones in a single transaction over a pooled
+    # connection. Returns the number of inserted records and a list of per-record errors.
+    rows = []
+    errors = []
+
+    for index, oee_data in enumerate(oee_records):
+        missing_fields = [field for field in required_fields if oee_data.get(field) is None]
+        if missing_fields:
+            errors.append({'index': index, 'error': f'Missing required field: {missing_fields[0]}'})
+            continue
+
+        try:
+            object_type = int(oee_data['object_type'])
+            object_id = int(oee_data['object_id'])
+        except (TypeError, ValueError):
+            errors.append({'index': index, 'error': 'object_type and object_id must be integers.'})
+            continue
+
+        rows.append((
+            oee_data['run_time'],
+            oee_data['total_time'],
+            oee_data['total_count'],
+            oee_data['target_count'],
+            oee_data['good_count'],
+            oee_data['availability'],
+            oee_data['performance'],
+            oee_data['quality'],
+            oee_data['oee'],
+            oee_data['timestamp'],
+            object_type,
+            object_id
+        ))
+
+    if not rows:
+        return 0, errors
+
+    store_oee_rows(rows)
+
+    return len(rows), errors
@@ -0,0 +1,199 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+import psycopg2
+from psycopg2.pool import PoolError
+from app.metrics import metrics
+from app.services.historian import insert_oee_data_batch
+
+# Create a logger
+logger = logging.getLogger(__name__)
+
+
+class IngestBuffer:
+    """Write-behind buffer for calculated OEE records.
+
+    Records are put on a bounded in-process queue and a background flusher writes them to
+    oee_data in batches, whenever batch_size records are waiting or flush_interval seconds
+    have passed, whichever comes first. The flusher thread starts with the first record, so
+    forked workers each get their own, and the queue is drained on interpreter shutdown.
+
+    A batch that fails on a transient error, such as a pool timeout or a lost connection, is
+    written again after retry_backoff seconds, doubling on each attempt, and only dropped after
+    max_attempts. Other errors drop the batch at once.
+    """
+
+    # Errors worth writing a batch again for; anything else would fail the same way
+    transient_errors = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
+    def __init__(self):
+        self.enabled = False
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.block_timeout = 0.0
+        self.drain_timeout = 30.0
+        self.max_attempts = 5
+        self.retry_backoff = 0.5
+
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        # Counters reported by stats()
+        self._enqueued = 0
+        self._flushed = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._flushes = 0
+        self._retries = 0
+        self._last_error = None
+
+    def configure(self, enabled, max_size, batch_size, flush_interval, block_timeout, drain_timeout,
+                  max_attempts=5, retry_backoff=0.5):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.drain_timeout = drain_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_size)
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='oee-ingest-flusher', daemon=True)
+                self._thread.start()
+
+    def put(self, oee_data):
+        # Queue a record; returns False when the queue stays full (backpressure)
+        self._ensure_started()
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(oee_data, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(oee_data)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def _next_batch(self):
+        # Wait for a first record, then collect more until the batch is full or the interval ends
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        # The batch is written in one transaction, so a failed attempt left nothing behind
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                inserted, errors = insert_oee_data_batch(batch)
+            except self.transient_errors as e:
+                with self._lock:
+                    self._last_error = str(e)
+                if attempt == self.max_attempts:
+                    logger.error(f"Dropped {len(batch)} buffered OEE records after {attempt} attempts: {e}")
+                    break
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                logger.warning(f"Failed to flush {len(batch)} buffered OEE records (attempt {attempt} of "
+                               f"{self.max_attempts}), retrying in {delay:.1f}s: {e}")
+                with self._lock:
+                    self._retries += 1
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} buffered OEE records: {e}", exc_info=True)
+                with self._lock:
+                    self._last_error = str(e)
+                break
+
+            for error in errors:
+                logger.error(f"Dropped buffered OEE record: {error['error']}")
+            with self._lock:
+                self._flushes += 1
+                self._flushed += inserted
+                self._dropped += len(errors)
+            return
+
+        with self._lock:
+            self._dropped += len(batch)
+
+    def stop(self):
+        # Drain whatever is still queued, waiting up to drain_timeout seconds
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._stopping.set()
+        thread.join(self.drain_timeout)
+        if thread.is_alive():
+            logger.error(f"Ingest buffer did not drain within {self.drain_timeout}s; "
+                         f"{self._queue.qsize()} records were not written.")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'queued': self._queue.qsize() if self._queue is not None else 0,
+                'capacity': self._queue.maxsize if self._queue is not None else 0,
+                'enqueued': self._enqueued,
+                'flushed': self._flushed,
+                'dropped': self._dropped,
+                'rejected': self._rejected,
+                'flushes': self._flushes,
+                'retries': self._retries,
+                'last_error': self._last_error,
+            }
+
+
+ingest_buffer = IngestBuffer()
+
+
+def collect_ingest_buffer():
+    # The write-behind counters /status/ingest reports, for /metrics
+    stats = ingest_buffer.stats()
+    counters = {
+        'enqueued': 'Records accepted into the write-behind queue.',
+        'flushed': 'Buffered records written to the database.',
+        'dropped': 'Buffered records dropped after failing to be written.',
+        'rejected': 'Records rejected because the write-behind queue was full.',
+        'retries': 'Write-behind batches written again after a transient error.',
+    }
+    families = [
+        ('gauge', 'oee_ingest_buffer_queued', 'Records currently waiting in the write-behind queue.',
+         [('oee_ingest_buffer_queued', (), (), stats['queued'])]),
+    ]
+    for counter, documentation in counters.items():
+        name = f'oee_ingest_buffer_{counter}_total'
+        families.append(('counter', name, documentation, [(name, (), (), stats[counter])]))
+    return families
+
+
+metrics.add_collector(collect_ingest_buffer)
@@ -0,0 +1,53 @@
+import msgpack
+import numpy as np
+
+# Content types of msgpack request and response bodies
+msgpack_mimetypes = ('application/msgpack', 'application/x-msgpack')
+
+# Element type of columns sent as raw bytes; every other column holds little-endian float64
+column_dtypes = {
+    'object_type': np.dtype('<i8'),
+    'object_id': np.dtype('<i8'),
+}
+default_dtype = np.dtype('<f8')
+
+# Integer columns are stored as INTEGER, so their values must fit in 32 bits
+integer_range = (-2 ** 31, 2 ** 31 - 1)
+
+
+def decode_msgpack(body):
+    # Decode a msgpack map. Values sent as bin are typed columns and become numpy arrays
+    # over the body without copying; lists and scalars are kept as they are.
+    try:
+        data = msgpack.unpackb(body, raw=False)
+    except (ValueError, TypeError):
+        raise ValueError("The request body is not valid msgpack.")
+
+    if not isinstance(data, dict):
+        raise ValueError("A msgpack map is required.")
+    if not all(isinstance(name, str) for name in data):
+        raise ValueError("Every key of the msgpack map must be a string.")
+
+    for name, value in data.items():
+        if isinstance(value, bytes):
+            dtype = column_dtypes.get(name, default_dtype)
+            if len(value) % dtype.itemsize:
+                raise ValueError(f"{name} must hold a whole number of {dtype.itemsize}-byte values.")
+            column = np.frombuffer(value, dtype=dtype)
+            if dtype.kind == 'i' and len(column) and (column.min() < integer_range[0] or column.max() > integer_range[1]):
+                raise ValueError(f"{name} must hold {dtype.itemsize}-byte integers between "
+                                 f"{integer_range[0]} and {integer_range[1]}.")
+            data[name] = column
+
+    return data
+
+
+def _pack_array(value):
+    if isinstance(value, np.ndarray):
+        return np.ascontiguousarray(value, dtype=value.dtype.newbyteorder('<')).tobytes()
+    raise TypeError(f"Cannot encode {type(value).__name__} as msgpack.")
+
+
+def encode_msgpack(data):
+    # numpy arrays are written as bin columns, in the same layout decode_msgpack reads
+    return msgpack.packb(data, default=_pack_array)
@@ -1,6 +1,18 @@
+import io
+import csv
+import json
+import heapq
 import logging
+import numpy as np
 from datetime import datetime
 from app.models.oee import OeeModel
+from app.models.asset_factory import asset_factory
+from app.models.asset_index import asset_index
+from app.services.historian import store_oee_rows
+from app.services.downsample import downsample_indices, downsample_rows
+from app.services.rolling_oee import rolling_oee
+from app.services.ingest_format import integer_range
+from app.metrics import track_serialization
 
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f%z"
 
@@ -38,6 +50,103 @@ def calculate_oee(data):
         raise Exception("Error calculating OEE")
 
 
+def calculate_oee_batch(data, as_arrays=False):
+    try:
+        # Calculate every row at once; invalid rows come back as NaN with an error message
+        results, errors = OeeModel.calculate_oee_batch(data)
+        invalid = np.not_equal(errors, None)
+        timestamp = datetime.now().strftime(DATETIME_FORMAT)
+
+        # Add the new columns to the existing data dictionary, with null for invalid rows,
+        # or as float arrays with NaN for invalid rows for binary responses
+        for name, values in results.items():
+            if as_arrays:
+                data[name] = values
+                continue
+            column = values.astype(object)
+            column[invalid] = None
+            data[name] = column.tolist()
+
+        # Binary input columns go back as lists in JSON responses
+        if not as_arrays:
+            for name, values in data.items():
+                if isinstance(values, np.ndarray):
+                    data[name] = values.tolist()
+
+        data["timestamp"] = timestamp
+        data["errors"] = [{'index': int(index), 'error': errors[index]} for index in np.flatnonzero(invalid)]
+
+        return data
+
+    except ValueError as e:
+        logger.error(f"Error calculating OEE batch: {e}")
+        raise
+    except Exception as e:
+        logger.error(f"Error calculating OEE batch: {e}")
+        raise Exception("Error calculating OEE batch")
+
+
+def key_column(field, values):
+    # An object_type or object_id column as float64, with NaN for missing entries, which are
+    # left to the per-row errors. Booleans, fractions and anything else but integers fail the
+    # whole batch: cast to integers, they would store readings under another asset.
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind not in 'iu':
+            raise ValueError(f"{field} must hold integers.")
+        array = values.astype(np.float64)
+    else:
+        if not all(type(value) is int or value is None for value in values):
+            raise ValueError(f"{field} must hold integers.")
+        array = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    if np.any((array < integer_range[0]) | (array > integer_range[1])):
+        raise ValueError(f"{field} must hold integers between {integer_range[0]} and {integer_range[1]}.")
+    return array
+
+
+def store_oee_batch(data):
+    # Calculate a batch, then store every row that calculated cleanly in one transaction.
+    # Rows are built column by column; no per-record dictionaries are created.
+    good_count = data.get('good_count')
+    row_count = len(good_count) if isinstance(good_count, (list, tuple, np.ndarray)) else 0
+    for field in ['object_type', 'object_id']:
+        if not isinstance(data.get(field), (list, tuple, np.ndarray)) or len(data[field]) != row_count:
+            raise ValueError(f"{field} must be a list with one entry per record.")
+
+    timestamp = datetime.now()
+    results, errors = OeeModel.calculate_oee_batch(data)
+    invalid = np.not_equal(errors, None)
+
+    # Asset keys that are missing
+    keys = {}
+    for field in ['object_type', 'object_id']:
+        array = key_column(field, data[field])
+        rejected = ~np.isfinite(array) & ~invalid
+        errors[rejected] = 'object_type and object_id must be integers.'
+        invalid |= rejected
+        keys[field] = array
+
+    valid = ~invalid
+    columns = [OeeModel._to_float_array(data[field])[valid].tolist()
+               for field in ['run_time', 'total_time', 'total_count', 'target_count', 'good_count']]
+    columns += [results[field][valid].tolist() for field in ['availability', 'performance', 'quality', 'oee']]
+    columns.append([timestamp] * len(columns[0]))
+    columns += [keys[field][valid].astype(np.int64).tolist() for field in ['object_type', 'object_id']]
+    rows = list(zip(*columns))
+
+    if rows:
+        try:
+            store_oee_rows(rows)
+        except Exception as e:
+            logger.error(f"Failed to store OEE batch: {e}")
+            raise Exception("An error occurred while storing the OEE batch.")
+
+    return {
+        'inserted': len(rows),
+        'timestamp': timestamp.strftime(DATETIME_FORMAT),
+        'errors': [{'index': int(index), 'error': errors[index]} for index in np.flatnonzero(invalid)]
+    }
+
+
 def get_latest_oee(object_type, object_id):
     try:
         return OeeModel.get_latest_oee(object_type, object_id)
@@ -46,12 +155,185 @@ def get_latest_oee(object_type, object_id):
         raise Exception("An error occurred while fetching latest OEE data.")
 
 
-def get_oee_by_date_range(object_type, object_id, start_date, end_date):
+def parse_object_keys(assets):
+    # Accept [object_type, object_id] pairs or {"object_type": ..., "object_id": ...} objects of
+    # JSON integers. true, false, 1.0 and "1" are rejected rather than converted, and so is any
+    # other sequence: a string would unpack into its characters.
+    if not isinstance(assets, list):
+        raise ValueError("assets must be a list of [object_type, object_id] pairs.")
+    object_keys = []
+    for asset in assets:
+        if isinstance(asset, dict):
+            key = (asset.get('object_type'), asset.get('object_id'))
+        elif isinstance(asset, (list, tuple)) and len(asset) == 2:
+            key = tuple(asset)
+        else:
+            key = None
+        if key is None or not all(type(value) is int for value in key):
+            raise ValueError("assets must be a list of [object_type, object_id] pairs of integers.")
+        object_keys.append(key)
+    return object_keys
+
+
+def get_latest_oee_batch(object_keys=None, object_type=None):
+    try:
+        if object_type is not None:
+            # Latest reading for every asset of one hierarchy level
+            asset_class = asset_factory.get_asset(object_type)
+            latest = OeeModel.get_latest_oee_for_level(object_type, asset_class.table_name)
+        else:
+            latest = OeeModel.get_latest_oee_many(object_keys)
+
+        return [
+            {'object_type': key[0], 'object_id': key[1], **reading}
+            for key, reading in latest.items()
+        ]
+    except Exception as e:
+        logger.error(f"Failed to fetch latest OEE data in batch: {e}")
+        raise Exception("An error occurred while fetching latest OEE data.")
+
+
+def get_oee_by_date_range(object_type, object_id, start_date, end_date, bucket=None, raw=False,
+                          max_points=None, metric='oee', method='lttb'):
     try:
-        # Call the get_oee_by_date_range method from the OeeModel class
-        oee_data = OeeModel.get_oee_by_date_range(object_type, object_id, start_date, end_date)
+        # Read pre-aggregated buckets when one is requested, the stored rows when raw is set,
+        # and daily aggregates otherwise
+        if bucket is not None:
+            oee_data = OeeModel.get_oee_by_rollup(object_type, object_id, start_date, end_date, bucket)
+        elif raw and max_points is not None:
+            # Stored rows are downsampled as they are read, without building a row per stored reading
+            return OeeModel.get_raw_oee_by_date_range(
+                object_type, object_id, start_date, end_date, metric=metric,
+                select=lambda x, y: downsample_indices(x, y, max_points, method=method)
+            )
+        elif raw:
+            oee_data = OeeModel.get_raw_oee_by_date_range(object_type, object_id, start_date, end_date)
+        else:
+            oee_data = OeeModel.get_oee_by_date_range(object_type, object_id, start_date, end_date)
+
+        # Reduce the range to a chart-sized number of points that keeps its shape
+        if max_points is not None:
+            oee_data = downsample_rows(oee_data, max_points, metric=metric, method=method)
         return oee_data
 
     except Exception as e:
         logger.error(f"Failed to fetch OEE data: {e}")
         raise Exception("An error occurred while fetching OEE data.")
+
+
+def get_rolling_oee_batch(object_keys, window=None):
+    # Rolling-window readings of each asset, served from memory
+    try:
+        readings = rolling_oee.get_many(object_keys, window)
+        return [
+            {'object_type': key[0], 'object_id': key[1], 'windows': readings[key]}
+            for key in object_keys
+        ]
+    except Exception as e:
+        logger.error(f"Failed to fetch rolling OEE data: {e}")
+        raise Exception("An error occurred while fetching rolling OEE data.")
+
+
+def get_child_level_keys(parent_type, parent_id, level):
+    # Keys of every asset of the given level under a parent asset, in hierarchy order
+    if level not in range(5) or level >= parent_type:
+        raise ValueError("level must be an object_type below the parent's.")
+    if asset_index.get(parent_type, parent_id) is None:
+        raise LookupError("Parent asset not found.")
+
+    descendants = asset_index.descendants(parent_type, parent_id, depth=parent_type - level)
+    return [(item.object_type, item.id) for item in descendants if item.object_type == level]
+
+
+def get_oee_ranking(level, metric='oee', n=20, order='worst', window=None, parent=None):
+    # The n assets of a level, under parent when one is given, with the lowest ('worst') or highest
+    # ('best') metric. Readings come from memory: the latest-OEE cache (the misses being read in one
+    # query) or, with a window, the rolling sums. A bounded heap keeps only n of them while ranking.
+    try:
+        if parent is not None:
+            object_keys = get_child_level_keys(parent[0], parent[1], level)
+        else:
+            object_keys = [(level, item.id) for item in asset_index.of_type(level)]
+
+        if window is not None:
+            readings = {key: windows[window] for key, windows in rolling_oee.get_many(object_keys, window).items()}
+        else:
+            readings = OeeModel.get_latest_oee_many(object_keys)
+
+        # Assets without a value are left out; ties are broken by asset, for a stable order
+        candidates = (
+            (reading[metric], key, reading) for key, reading in readings.items()
+            if reading.get(metric) is not None and reading[metric] == reading[metric]
+        )
+        select = heapq.nsmallest if order == 'worst' else heapq.nlargest
+        ranked = select(n, candidates, key=lambda candidate: (candidate[0], candidate[1]))
+
+        result = []
+        for rank, (value, key, reading) in enumerate(ranked, 1):
+            asset = asset_index.get(*key)
+            result.append({
+                'rank': rank, 'object_type': key[0], 'object_id': key[1],
+                'name': asset.name if asset is not None else None, 'value': value, **reading
+            })
+        return result
+
+    except (LookupError, ValueError):
+        raise
+    except Exception as e:
+        logger.error(f"Failed to rank OEE data: {e}")
+        raise Exception("An error occurred while ranking OEE data.")
+
+
+def get_oee_history_batch(object_keys, start_date, end_date, bucket=None, max_points=None, metric='oee',
+                          method='lttb'):
+    # One history series per asset, in the order of object_keys, read with a single query
+    try:
+        history = OeeModel.get_oee_history_many(object_keys, start_date, end_date, bucket)
+
+        series = []
+        for key in object_keys:
+            oee_data = history.get(key, [])
+            if max_points is not None:
+                oee_data = downsample_rows(oee_data, max_points, metric=metric, method=method)
+            series.append({'object_type': key[0], 'object_id': key[1], 'history': oee_data})
+        return series
+
+    except Exception as e:
+        logger.error(f"Failed to fetch OEE data of several assets: {e}")
+        raise Exception("An error occurred while fetching OEE data.")
+
+
+def _export_value(value):
+    # Timestamps are exported as ISO 8601 strings
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def stream_oee_by_date_range(object_type, object_id, start_date, end_date, export_format, bucket=None, raw=False):
+    # Returns a generator of NDJSON or CSV text, one chunk of rows at a time
+    columns, chunks = OeeModel.stream_oee_by_date_range(
+        object_type, object_id, start_date, end_date, bucket=bucket, raw=raw
+    )
+
+    def generate_ndjson():
+        for rows in chunks:
+            with track_serialization('ndjson'):
+                text = "".join(
+                    json.dumps(dict(zip(columns, map(_export_value, row)))) + "\n"
+                    for row in rows
+                )
+            yield text
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in chunks:
+            with track_serialization('csv'):
+                writer.writerows(map(_export_value, row) for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return generate_csv() if export_format == 'csv' else generate_ndjson()
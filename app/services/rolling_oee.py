@@ -0,0 +1,343 @@
+import re
+import time
+import logging
+import threading
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from app.models.asset import CellModel
+from app.models.asset_index import asset_index
+from app.models.oee import OeeModel
+from app.services.hierarchy_rollup import hierarchy_rollup, COUNT_FIELDS, TIME
+
+# Create a logger
+logger = logging.getLogger(__name__)
+
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+HOUR = 3600
+
+# Bin of an empty ring buffer slot; real bins count from the epoch, so they are never negative
+EMPTY = -1
+
+
+def parse_window(window):
+    # Length in seconds of a window written as a number and a unit, e.g. 90s, 15m, 8h or 1d
+    match = re.fullmatch(r'\s*(\d+)\s*([smhd])\s*', window)
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid rolling window: {window!r}. Use a number and s, m, h or d, e.g. 8h.")
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+
+def window_reading(sums):
+    # OEE of summed counts and times, in the shape of a latest reading
+    good_count, total_count, run_time, total_time, target_count = sums
+    quality = good_count / total_count if total_count else None
+    availability = run_time / total_time if total_time else None
+    performance = total_count / target_count if target_count else None
+    oee = quality * availability * performance if None not in (quality, availability, performance) else None
+    return {
+        'availability': availability, 'performance': performance, 'quality': quality, 'oee': oee,
+        'good_count': good_count, 'total_count': total_count, 'run_time': run_time,
+        'total_time': total_time, 'target_count': target_count,
+    }
+
+
+class RingBuffer:
+    """Summed counts and times of every asset over the last size bins of width seconds.
+
+    Row r holds one asset: values[r, slot] are the sums of the bin in bins[r, slot], and bin b
+    always goes to slot b % size, replacing the older bin it finds there. The arrays are sized
+    for capacity assets and doubled when full, so memory depends on the number of assets and
+    bins, not on the number of readings.
+    """
+
+    def __init__(self, width, size, capacity=64):
+        self.width = width
+        self.size = size
+        self.bins = np.full((capacity, size), EMPTY, dtype=np.int64)
+        self.values = np.zeros((capacity, size, len(COUNT_FIELDS)))
+
+    def grow(self, count):
+        # Make room for count rows
+        capacity = len(self.bins)
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
+        bins = np.full((capacity, self.size), EMPTY, dtype=np.int64)
+        bins[:len(self.bins)] = self.bins
+        values = np.zeros((capacity, self.size, len(COUNT_FIELDS)))
+        values[:len(self.values)] = self.values
+        self.bins, self.values = bins, values
+
+    def add(self, rows, times, values, now):
+        # Add values (one row of COUNT_FIELDS per reading) at epoch seconds times to the given
+        # rows. Readings in bins that have already left the buffer are skipped, and readings
+        # stamped later than now count in the current bin rather than replace one in the window.
+        now_bin = now // self.width
+        bins = np.minimum(times // self.width, now_bin)
+        keep = bins > now_bin - self.size
+        rows, bins, values = rows[keep], bins[keep], values[keep]
+        if not len(rows):
+            return
+
+        # A slot taken by an older bin is emptied first. A batch may reach one slot with
+        # several bins; the newest one wins, as if the readings had come in order.
+        slots = rows * self.size + bins % self.size
+        flat_bins = self.bins.reshape(-1)
+        flat_values = self.values.reshape(-1, len(COUNT_FIELDS))
+        unique, inverse = np.unique(slots, return_inverse=True)
+        newest = flat_bins[unique]
+        np.maximum.at(newest, inverse, bins)
+        flat_values[unique[flat_bins[unique] < newest]] = 0.0
+        flat_bins[unique] = newest
+
+        current = bins == newest[inverse]
+        np.add.at(flat_values, slots[current], values[current])
+
+    def sums(self, rows, length, now):
+        # Totals of each row over its last length bins up to now
+        inside = self.bins[rows] > now // self.width - length
+        return (self.values[rows] * inside[:, :, np.newaxis]).sum(axis=1)
+
+
+class RollingSums:
+    """Windowed sums of every asset: a row per asset in one RingBuffer per bin width."""
+
+    def __init__(self, tiers):
+        self.rows = {}
+        self.buffers = {width: RingBuffer(width, size) for width, size in tiers}
+
+    def row(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.rows)
+            for buffer in self.buffers.values():
+                buffer.grow(row + 1)
+        return row
+
+
+class RollingOee:
+    """OEE of every asset over rolling windows, such as the last hour, served from memory.
+
+    The good, total and target counts and run and total times of each asset are summed per bin
+    in fixed-size ring buffers. Windows of whole hours longer than one hour use hourly bins,
+    the others bins of resolution seconds. Stored readings are added as they are written, so
+    reading a window costs no query. A cell reading also counts for each ancestor of the cell,
+    as in the rollups; with the hierarchy rollup enabled, parent levels are derived from their
+    cells only, as in the parent sums.
+
+    The sums are seeded from the database on first use: the hourly bins from the hourly rollup
+    and the current hour's readings, the others from the readings. They are reseeded every
+    reseed_interval seconds, which bounds the drift between worker processes that each see only
+    their own ingests. A reseed reads into new buffers without holding the lock and swaps them
+    in; ingests and reads meanwhile use the previous sums, and the ingests are replayed onto
+    the new ones.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.reseed_interval = 300.0
+
+        self._lock = threading.Lock()
+        self._seed_lock = threading.Lock()
+        self._seeded_at = None
+        self._generation = 0
+        self._state = None
+        self._pending = None
+        self._set_windows('1h,8h,24h', 60)
+
+    def _set_windows(self, windows, resolution):
+        # windows is a comma-separated list such as "1h,8h,24h"; they are kept shortest first.
+        # Hourly bins need the other bins to divide the hour, so the current hour can be seeded
+        # from them.
+        names = [window.strip() for window in windows.split(',') if window.strip()]
+        if not names:
+            raise ValueError("At least one rolling window is required.")
+
+        self.resolution = int(resolution)
+        self.windows = dict(sorted(((name, parse_window(name)) for name in names), key=lambda item: item[1]))
+        hourly = self.resolution < HOUR and HOUR % self.resolution == 0
+
+        # Bin width and length in bins, rounded up, of each window; a buffer per width holds
+        # the bins of its longest window
+        self._bins = {}
+        sizes = {}
+        for name, length in self.windows.items():
+            width = HOUR if hourly and length > HOUR and length % HOUR == 0 else self.resolution
+            self._bins[name] = (width, -(-length // width))
+            sizes[width] = max(sizes.get(width, 0), self._bins[name][1])
+        self._tiers = sorted(sizes.items())
+
+    def configure(self, enabled, windows, resolution, reseed_interval):
+        with self._lock:
+            self.enabled = enabled
+            self.reseed_interval = reseed_interval
+            self._set_windows(windows, resolution)
+            self._state = None
+            self._seeded_at = None
+            self._generation += 1
+
+    def invalidate(self):
+        # Seed again on next use, and discard a seed under way, which may hold the same errors
+        with self._lock:
+            self._seeded_at = None
+            self._generation += 1
+
+    def _counted_keys(self, object_type, object_id):
+        # Assets a stored reading counts for, see the class docstring
+        key = (object_type, object_id)
+        if not hierarchy_rollup.enabled:
+            return [key]
+        if object_type != CellModel.object_type:
+            return []
+        return [key] + asset_index.ancestors(*key)
+
+    def _add(self, state, readings, now, widths=None):
+        # Add readings, (object_type, object_id, epoch seconds, *COUNT_FIELDS), to the buffers
+        # of the given widths (all by default), for every asset they count for
+        rows, times, values = [], [], []
+        for object_type, object_id, seconds, *counts in readings:
+            for key in self._counted_keys(object_type, object_id):
+                rows.append(state.row(key))
+                times.append(seconds)
+                values.append(counts)
+        if not rows:
+            return
+
+        rows = np.array(rows, dtype=np.int64)
+        times = np.array(times, dtype=np.int64)
+        values = np.array(values, dtype=np.float64).reshape(-1, len(COUNT_FIELDS))
+        for width in widths or state.buffers:
+            state.buffers[width].add(rows, times, values, now)
+
+    def _stored_readings(self, stored):
+        # Stored rows, in historian RETURNING order, as readings for _add
+        return [
+            (row[0], row[1], int(row[TIME].timestamp()), *(float(row[field] or 0.0) for field in COUNT_FIELDS))
+            for row in stored
+        ]
+
+    def _seed(self):
+        # Read the sums into new buffers, then swap them in under the lock with the batches
+        # stored meanwhile added. A batch committed in the moment between the start of the seed
+        # and its queries may be counted twice until the next reseed.
+        with self._lock:
+            generation = self._generation
+            tiers = self._tiers
+            self._pending = []
+
+        try:
+            now = int(time.time())
+            state = RollingSums(tiers)
+            object_type = CellModel.object_type if hierarchy_rollup.enabled else None
+            hour = now // HOUR * HOUR
+            since = hour if self.resolution not in state.buffers else min(
+                hour, (now // self.resolution - state.buffers[self.resolution].size) * self.resolution)
+
+            readings = [
+                (row_type, row_id, bin_ * self.resolution, *(float(value or 0.0) for value in values))
+                for row_type, row_id, bin_, *values in OeeModel.get_binned_sums(
+                    datetime.fromtimestamp(since, timezone.utc), self.resolution, object_type)
+            ]
+            if self.resolution in state.buffers:
+                self._add(state, readings, now, [self.resolution])
+            if HOUR in state.buffers:
+                # The hours before the current one from the hourly rollup, which holds whole
+                # hours only; the current hour from the readings
+                start = hour - (state.buffers[HOUR].size - 1) * HOUR
+                rollup = [
+                    (row_type, row_id, seconds, *(float(value or 0.0) for value in values))
+                    for row_type, row_id, seconds, *values in OeeModel.get_rollup_sums(
+                        'hour', datetime.fromtimestamp(start, timezone.utc),
+                        datetime.fromtimestamp(hour, timezone.utc), object_type)
+                ]
+                self._add(state, rollup, now, [HOUR])
+                self._add(state, [reading for reading in readings if reading[2] >= hour], now, [HOUR])
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if generation != self._generation:
+                # Invalidated or reconfigured meanwhile, so the batches stored meanwhile may have
+                # been rolled back. Sums read for the current windows still stand in if there are
+                # none, until the next use seeds again.
+                if self._state is None and self._tiers == tiers:
+                    self._state = state
+                return
+            now = int(time.time())
+            for stored in pending:
+                self._add(state, self._stored_readings(stored), now)
+            self._state = state
+            self._seeded_at = time.monotonic()
+
+    def _ensure_seeded(self):
+        # One thread seeds at a time. The others carry on with the previous sums, and only wait
+        # when there are none yet.
+        with self._lock:
+            due = self._seeded_at is None or time.monotonic() - self._seeded_at > self.reseed_interval
+            wait = self._state is None
+        if not due or not self._seed_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                due = self._seeded_at is None or time.monotonic() - self._seeded_at > self.reseed_interval
+            if due:
+                self._seed()
+        finally:
+            self._seed_lock.release()
+
+    def prepare(self):
+        # Seed before an ingest transaction opens, so seeding never competes for its connection
+        if not self.enabled:
+            return
+        self._ensure_seeded()
+
+    def apply(self, stored):
+        # Add stored rows, in historian RETURNING order, to the windows of the assets they count for
+        if not self.enabled:
+            return
+
+        readings = self._stored_readings(stored)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(stored)
+            if self._state is not None:
+                self._add(self._state, readings, int(time.time()))
+
+    def get_many(self, object_keys, window=None):
+        # Readings of each window (or only the named one) per key. A window covers its length
+        # up to now, rounded up to whole bins.
+        names = list(self.windows) if window is None else [window]
+        self._ensure_seeded()
+        with self._lock:
+            state = self._state
+            if state is None:
+                raise Exception("The rolling windows were reconfigured while they were seeded.")
+            now = int(time.time())
+            rows = [state.rows.get(key) for key in object_keys]
+            present = np.array([row for row in rows if row is not None], dtype=np.int64)
+
+            totals = {}
+            for name in names:
+                width, length = self._bins[name]
+                sums = iter(state.buffers[width].sums(present, length, now).tolist())
+                end = datetime.fromtimestamp((now // width + 1) * width, timezone.utc)
+                totals[name] = (
+                    [next(sums) if row is not None else [0.0] * len(COUNT_FIELDS) for row in rows],
+                    end - timedelta(seconds=length * width),
+                    end,
+                )
+
+        return {
+            key: {
+                name: {**window_reading(sums[index]), 'start_time': start, 'end_time': end}
+                for name, (sums, start, end) in totals.items()
+            }
+            for index, key in enumerate(object_keys)
+        }
+
+
+rolling_oee = RollingOee()
@@ -0,0 +1,447 @@
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from psycopg2.extras import Json, execute_values
+from app.database import connection_pool
+from app.metrics import track_query
+from app.models.asset import CellModel, SiteModel
+from app.models.asset_index import asset_index
+from app.models.oee import OeeModel
+from app.models.shift_calendar import ShiftCalendarModel
+from app.services.hierarchy_rollup import hierarchy_rollup, GOOD_COUNT, TOTAL_COUNT, RUN_TIME, TOTAL_TIME, \
+    TARGET_COUNT, TIME
+
+# Create a logger
+logger = logging.getLogger(__name__)
+
+# Most shifts in one calendar
+max_shifts = 24
+
+DAY_MINUTES = 24 * 60
+
+
+def parse_clock(value):
+    # Minutes after midnight of a wall-clock time written as HH:MM
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', value) if isinstance(value, str) else None
+    if match is None or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError(f"Invalid time of day: {value!r}. Use HH:MM, e.g. 06:00.")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def span(start, end):
+    # Length in minutes from one wall-clock time to the next occurrence of another; a span
+    # from a time to itself is a whole day
+    return (end - start) % DAY_MINUTES or DAY_MINUTES
+
+
+def parse_calendar(data):
+    """Validate a shift calendar and return it normalized.
+
+    A calendar is {"timezone": "Europe/Berlin", "shifts": [{"name": "early", "start": "06:00",
+    "end": "14:00", "breaks": [{"start": "09:00", "end": "09:30"}]}, ...]}. Times are wall-clock
+    times in the timezone; a shift ending at or before its start ends on the next day. Shifts
+    may not overlap, and breaks must lie within their shift.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("A JSON object is required.")
+
+    timezone_name = data.get('timezone')
+    if not isinstance(timezone_name, str):
+        raise ValueError("timezone is required, e.g. Europe/Berlin.")
+    try:
+        ZoneInfo(timezone_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {timezone_name!r}.")
+
+    shifts = data.get('shifts')
+    if not isinstance(shifts, list) or not shifts:
+        raise ValueError("shifts must be a non-empty list.")
+    if len(shifts) > max_shifts:
+        raise ValueError(f"A calendar holds at most {max_shifts} shifts.")
+
+    normalized = []
+    covered = {}
+    for shift in shifts:
+        if not isinstance(shift, dict):
+            raise ValueError("Every shift must be an object with a name, start and end.")
+        name = shift.get('name')
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError("Every shift needs a name.")
+        name = name.strip()
+        if any(other['name'] == name for other in normalized):
+            raise ValueError(f"Duplicate shift name: {name!r}.")
+
+        start, end = parse_clock(shift.get('start')), parse_clock(shift.get('end'))
+        length = span(start, end)
+        for offset in range(length):
+            minute = (start + offset) % DAY_MINUTES
+            if minute in covered:
+                raise ValueError(f"Shifts {covered[minute]!r} and {name!r} overlap.")
+            covered[minute] = name
+
+        breaks = shift.get('breaks') or []
+        if not isinstance(breaks, list):
+            raise ValueError(f"breaks of shift {name!r} must be a list.")
+        normalized_breaks = []
+        for planned_break in breaks:
+            if not isinstance(planned_break, dict):
+                raise ValueError(f"Every break of shift {name!r} must be an object with a start and end.")
+            break_start, break_end = parse_clock(planned_break.get('start')), parse_clock(planned_break.get('end'))
+            offset = (break_start - start) % DAY_MINUTES
+            if break_start == break_end or offset + span(break_start, break_end) > length:
+                raise ValueError(f"Breaks of shift {name!r} must lie within the shift.")
+            normalized_breaks.append({'start': planned_break['start'], 'end': planned_break['end']})
+
+        normalized.append({'name': name, 'start': shift['start'], 'end': shift['end'], 'breaks': normalized_breaks})
+
+    return {'timezone': timezone_name, 'shifts': normalized}
+
+
+class ShiftCalendar:
+    """The shifts of a site, resolving a time to the shift it falls in.
+
+    A shift is worked from its start to its end on the local wall clock, so across a change to
+    or from daylight saving time it lasts an hour less or more. Readings in a planned break
+    belong to no shift: break time is not planned production time.
+    """
+
+    # Shift bounds kept per calendar before the memo is cleared
+    memo_size = 4096
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.zone = ZoneInfo(definition['timezone'])
+        # (name, start and length in seconds, breaks as (start, end) offsets in seconds into the shift)
+        self.shifts = []
+        for shift in definition['shifts']:
+            start = parse_clock(shift['start'])
+            breaks = []
+            for planned_break in shift['breaks']:
+                break_start = parse_clock(planned_break['start'])
+                offset = (break_start - start) % DAY_MINUTES
+                length = span(break_start, parse_clock(planned_break['end']))
+                breaks.append((offset * 60, (offset + length) * 60))
+            self.shifts.append((shift['name'], start * 60, span(start, parse_clock(shift['end'])) * 60, breaks))
+        self._bounds = {}
+
+    def bounds(self, index, day):
+        # Start and end, in UTC, of a shift starting on a local day
+        key = (index, day)
+        bounds = self._bounds.get(key)
+        if bounds is None:
+            _, start, length, _ = self.shifts[index]
+            midnight = datetime(day.year, day.month, day.day)
+            bounds = (
+                (midnight + timedelta(seconds=start)).replace(tzinfo=self.zone).astimezone(timezone.utc),
+                (midnight + timedelta(seconds=start + length)).replace(tzinfo=self.zone).astimezone(timezone.utc),
+            )
+            if len(self._bounds) >= self.memo_size:
+                self._bounds.clear()
+            self._bounds[key] = bounds
+        return bounds
+
+    def _locate(self, time):
+        # (index, offset in seconds into the shift, local day it started) of the shift a time
+        # falls in, breaks included, or None outside shifts
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=timezone.utc)
+        local = time.astimezone(self.zone)
+        seconds = local.hour * 3600 + local.minute * 60 + local.second
+
+        for index, (_, start, length, _) in enumerate(self.shifts):
+            offset = (seconds - start) % 86400
+            if offset >= length:
+                continue
+            day = local.date() if seconds >= start else local.date() - timedelta(days=1)
+            return index, offset, day
+        return None
+
+    def shift_at(self, time):
+        # (name, start, end) of the shift a time falls in, or None outside shifts and in breaks
+        located = self._locate(time)
+        if located is None:
+            return None
+        index, offset, day = located
+        name, _, _, breaks = self.shifts[index]
+        if any(break_start <= offset < break_end for break_start, break_end in breaks):
+            return None
+        return (name, *self.bounds(index, day))
+
+    def shift_start(self, time):
+        # Start, in UTC, of the shift a time falls in, breaks included, or None outside shifts
+        located = self._locate(time)
+        if located is None:
+            return None
+        index, _, day = located
+        return self.bounds(index, day)[0]
+
+
+def write_shift_sums(cur, sums):
+    # Add sums, keyed by ((object_type, object_id), shift_start), to the shift rollup
+    rows = [(*key, shift_start, *values) for (key, shift_start), values in sums.items()]
+    if not rows:
+        return
+    execute_values(
+        cur,
+        f"""
+        INSERT INTO {OeeModel.shift_table} AS r (
+            object_type, object_id, shift_start, shift_end, shift_name, sample_count, good_count,
+            total_count, target_count, run_time, total_time, start_time, end_time)
+        VALUES %s
+        ON CONFLICT (object_type, object_id, shift_start) DO UPDATE SET
+            shift_end = EXCLUDED.shift_end,
+            shift_name = EXCLUDED.shift_name,
+            sample_count = r.sample_count + EXCLUDED.sample_count,
+            good_count = r.good_count + EXCLUDED.good_count,
+            total_count = r.total_count + EXCLUDED.total_count,
+            target_count = r.target_count + EXCLUDED.target_count,
+            run_time = r.run_time + EXCLUDED.run_time,
+            total_time = r.total_time + EXCLUDED.total_time,
+            start_time = LEAST(r.start_time, EXCLUDED.start_time),
+            end_time = GREATEST(r.end_time, EXCLUDED.end_time)
+        """,
+        rows,
+        page_size=1000
+    )
+
+
+def add_shift_sums(sums, rows, calendar_of, cells_only=False):
+    # Sum rows, in historian RETURNING order, per asset and shift into sums. Keys follow the
+    # rollups: a cell row also counts for every ancestor of the cell. calendar_of maps an asset
+    # to its ShiftCalendar or None. With cells_only, other rows are skipped, as they are
+    # derived from cells when the hierarchy rollup is enabled.
+    for row in rows:
+        key = (row[0], row[1])
+        if hierarchy_rollup.enabled and key[0] == CellModel.object_type:
+            keys = [key] + hierarchy_rollup.ancestors(key)
+        elif cells_only:
+            continue
+        else:
+            keys = [key]
+
+        values = (row[GOOD_COUNT] or 0.0, row[TOTAL_COUNT] or 0.0, row[TARGET_COUNT] or 0.0,
+                  row[RUN_TIME] or 0.0, row[TOTAL_TIME] or 0.0)
+        calendar, shift = None, None
+        for asset_key in keys:
+            asset_calendar = calendar_of(asset_key)
+            if asset_calendar is None:
+                continue
+            if asset_calendar is not calendar:
+                # The assets of a site share its calendar, so the shift is resolved once per row
+                calendar, shift = asset_calendar, asset_calendar.shift_at(row[TIME])
+            if shift is None:
+                continue
+
+            name, shift_start, shift_end = shift
+            current = sums.get((asset_key, shift_start))
+            if current is None:
+                sums[(asset_key, shift_start)] = [shift_end, name, 1, *values, row[TIME], row[TIME]]
+                continue
+            current[2] += 1
+            for index, value in enumerate(values, 3):
+                current[index] += value
+            current[8] = min(current[8], row[TIME])
+            current[9] = max(current[9], row[TIME])
+    return sums
+
+
+class ShiftCalendars:
+    """Shift calendars of every site, attached to the asset hierarchy.
+
+    An area, line or cell works the shifts of the site it belongs to; enterprises span sites
+    and have none. The calendars are loaded on first use and reloaded after ttl seconds, so
+    calendars saved through other worker processes are picked up.
+    """
+
+    def __init__(self, ttl=60.0, backfill=7 * 86400.0):
+        self.ttl = ttl
+        self.backfill = backfill
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._calendars = {}
+
+    def configure(self, ttl, backfill):
+        with self._lock:
+            self.ttl = ttl
+            self.backfill = backfill
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def reload(self):
+        rows = ShiftCalendarModel.get_all()
+        calendars = {}
+        for row in rows:
+            try:
+                calendars[row['site_id']] = ShiftCalendar({'timezone': row['timezone'], 'shifts': row['shifts']})
+            except (ZoneInfoNotFoundError, KeyError, ValueError) as e:
+                logger.error(f"Ignoring the shift calendar of site {row['site_id']}: {e}")
+        with self._lock:
+            self._calendars = calendars
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+            self.reload()
+
+    def prepare(self):
+        # Load before an ingest transaction opens, so loading never competes for its connection
+        self._ensure_loaded()
+
+    def get(self, site_id):
+        self._ensure_loaded()
+        with self._lock:
+            calendar = self._calendars.get(site_id)
+            return calendar.definition if calendar is not None else None
+
+    def site_of(self, object_type, object_id):
+        # Id of the site an asset belongs to, or None for enterprises and unknown assets
+        if object_type == SiteModel.object_type:
+            return object_id
+        for ancestor_type, ancestor_id in asset_index.ancestors(object_type, object_id):
+            if ancestor_type == SiteModel.object_type:
+                return ancestor_id
+        return None
+
+    def calendar_of(self, object_key):
+        with self._lock:
+            calendars = self._calendars
+        if not calendars or object_key[0] > SiteModel.object_type:
+            return None
+        return calendars.get(self.site_of(*object_key))
+
+    def update_rollup(self, cur, stored):
+        # Add stored rows to the shift rollup, in the caller's transaction. The sites written to
+        # are locked in shared mode, in id order, so a calendar being saved holds up only the
+        # ingests of its own site.
+        with self._lock:
+            if not self._calendars:
+                return
+        sums = add_shift_sums({}, stored, self.calendar_of, cells_only=hierarchy_rollup.enabled)
+        site_ids = sorted({self.site_of(*key) for key, _ in sums})
+        if site_ids:
+            cur.execute(
+                "SELECT pg_advisory_xact_lock_shared(%s, site_id) FROM unnest(%s::int[]) AS site_id",
+                (ShiftCalendarModel.lock_class, site_ids)
+            )
+        write_shift_sums(cur, sums)
+
+    def _rebuild_start(self, calendar, previous):
+        # Time from which the shift rows of a site are rebuilt for a new calendar, see save.
+        # Shifts do not overlap, so no row of the previous calendar starting earlier holds
+        # readings from then on.
+        now = datetime.now(timezone.utc)
+        if previous is None:
+            since = now - timedelta(seconds=self.backfill)
+            return calendar.shift_start(since) or since
+        try:
+            previous_calendar = ShiftCalendar({'timezone': previous[0], 'shifts': previous[1]})
+        except (ZoneInfoNotFoundError, KeyError, ValueError) as e:
+            # Rows of a calendar that cannot be read are rebuilt over the whole backfill
+            logger.error(f"Ignoring the previous shift calendar: {e}")
+            return now - timedelta(seconds=self.backfill)
+        return previous_calendar.shift_start(now) or now
+
+    def _site_keys(self, site_id):
+        # The site and every asset under it whose shift rows are rebuilt from oee_data: with the
+        # hierarchy rollup, their rows are derived from the cells, which are read instead
+        assets = [(SiteModel.object_type, site_id)] + [
+            (item.object_type, item.id) for item in asset_index.descendants(SiteModel.object_type, site_id)
+        ]
+        if hierarchy_rollup.enabled:
+            return assets, [key for key in assets if key[0] == CellModel.object_type]
+        return assets, assets
+
+    def save(self, site_id, definition, chunk_size=5000):
+        """Save the calendar of a site and rebuild the shift rows of its assets it changes.
+
+        A changed calendar applies from the start of the shift under way in the previous one, or
+        from now outside its shifts: shift rows from then on are rebuilt from oee_data, earlier
+        ones keep the previous calendar. A site's first calendar is applied to the readings of
+        the last backfill seconds. Deleting a calendar deletes every shift row of the site.
+
+        The save holds the site's advisory lock exclusively, and ingests writing shift rows of
+        the site take it shared, so every stored reading is counted exactly once: ingests
+        committed before the lock are read back, later ones wait and are added on top. Other
+        worker processes go on using the previous calendar until their next reload, so
+        calendars are best changed between shifts.
+        """
+        calendar = ShiftCalendar(definition) if definition is not None else None
+        assets, readers = self._site_keys(site_id)
+        asset_set = set(assets)
+
+        with connection_pool.connection() as conn:
+            try:
+                with conn.cursor() as cur, track_query('shift_calendar.save') as record:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (ShiftCalendarModel.lock_class, site_id))
+                    cur.execute(
+                        f"SELECT timezone, shifts FROM {ShiftCalendarModel.table_name} WHERE site_id = %s",
+                        (site_id,)
+                    )
+                    previous = cur.fetchone()
+                    if calendar is None:
+                        cur.execute(f"DELETE FROM {ShiftCalendarModel.table_name} WHERE site_id = %s", (site_id,))
+                    else:
+                        cur.execute(
+                            f"""
+                            INSERT INTO {ShiftCalendarModel.table_name} (site_id, timezone, shifts)
+                            VALUES (%s, %s, %s)
+                            ON CONFLICT (site_id) DO UPDATE SET
+                                timezone = EXCLUDED.timezone, shifts = EXCLUDED.shifts, updated_at = now()
+                            """,
+                            (site_id, definition['timezone'], Json(definition['shifts']))
+                        )
+
+                    asset_filter, asset_params = OeeModel._asset_filter(assets)
+                    since = self._rebuild_start(calendar, previous) if calendar is not None else None
+                    if since is None:
+                        cur.execute(f"DELETE FROM {OeeModel.shift_table} WHERE {asset_filter}", asset_params)
+                    else:
+                        cur.execute(
+                            f"DELETE FROM {OeeModel.shift_table} WHERE {asset_filter} AND shift_start >= %s",
+                            (*asset_params, since)
+                        )
+
+                    sums = {}
+                    if calendar is not None and readers:
+                        reader_filter, reader_params = OeeModel._asset_filter(readers)
+                        with conn.cursor(name='shift_rebuild') as rows_cur:
+                            rows_cur.itersize = chunk_size
+                            rows_cur.execute(
+                                f"""
+                                SELECT object_type, object_id, availability, performance, quality, oee,
+                                       good_count, total_count, run_time, total_time, target_count, time
+                                FROM oee_data
+                                WHERE {reader_filter} AND time >= %s
+                                """,
+                                (*reader_params, since)
+                            )
+                            while True:
+                                rows = rows_cur.fetchmany(chunk_size)
+                                if not rows:
+                                    break
+                                record.rows += len(rows)
+                                add_shift_sums(sums, rows, lambda key: calendar if key in asset_set else None,
+                                               cells_only=hierarchy_rollup.enabled)
+                    write_shift_sums(cur, sums)
+                conn.commit()
+
+            except Exception:
+                conn.rollback()
+                raise
+
+        with self._lock:
+            if calendar is None:
+                self._calendars.pop(site_id, None)
+            else:
+                self._calendars[site_id] = calendar
+        return len(sums)
+
+
+shift_calendars = ShiftCalendars()
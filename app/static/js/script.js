@@ -178,7 +178,8 @@ function generateTreeView(data, collapsed = true) {
 
     if (typeof data[key] === 'object' && data[key] !== null) {
       const span = document.createElement('span');
-      span.textContent = key;
+      // Asset nodes are keyed by id; label them with the asset name when there is one
+      span.textContent = data[key].data && data[key].data.name ? data[key].data.name : key;
       span.classList.add('parent-text');
       li.appendChild(span);
 
@@ -0,0 +1,35 @@
+"""Compare two benchmark result files.
+
+    python -m benchmarks.compare benchmarks/results/abc1234-memory.json benchmarks/results/def5678-memory.json
+"""
+import sys
+import json
+import argparse
+
+from benchmarks.harness import format_seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the p50 latency of two benchmark runs.")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as file:
+        baseline = {result['name']: result for result in json.load(file)['results']}
+    with open(args.candidate) as file:
+        candidate = json.load(file)['results']
+
+    print(f"{'benchmark':<36} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for result in candidate:
+        before = baseline.get(result['name'])
+        if before is None:
+            print(f"{result['name']:<36} {'-':>10} {format_seconds(result['p50']):>10} {'new':>8}")
+            continue
+        change = (result['p50'] - before['p50']) / before['p50'] * 100
+        print(f"{result['name']:<36} {format_seconds(before['p50']):>10} "
+              f"{format_seconds(result['p50']):>10} {change:>+7.1f}%")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
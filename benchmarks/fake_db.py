@@ -0,0 +1,263 @@
+"""In-memory stand-in for the PostgreSQL database used by the benchmarks.
+
+FakeDatabase.connect() returns objects that behave like psycopg2 connections for the queries
+the application runs. Queries are recognised by their shape, not parsed, and answered from
+plain Python structures. Plugged into the shared connection pool, it exercises every layer of
+the application except the database, so the numbers isolate the cost of the Python side.
+"""
+import itertools
+from datetime import datetime, timedelta, timezone
+from psycopg2 import extensions
+
+# Latest-reading columns returned after (object_type, object_id), see OeeModel.latest_columns
+READING_FIELDS = 10
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_assets(count):
+    # A hierarchy of about count assets: one enterprise and, per level, roughly five times
+    # more assets than on the level above, with the remainder as cells
+    levels = [1, max(1, count // 400), max(1, count // 80), max(1, count // 16)]
+    levels.append(max(1, count - sum(levels)))
+
+    assets = []
+    for depth, size in enumerate(levels):
+        object_type = 4 - depth
+        for index in range(size):
+            parent_id = None if depth == 0 else index % levels[depth - 1] + 1
+            assets.append({
+                'id': index + 1,
+                'name': f'asset-{object_type}-{index + 1}',
+                'description': '',
+                'parent_id': parent_id,
+                'object_type': object_type,
+            })
+    return assets
+
+
+def make_reading(object_type, object_id, time):
+    good_count, total_count, target_count = 90.0 + object_id % 10, 100.0, 120.0
+    run_time, total_time = 3000.0 + object_id % 500, 3600.0
+    quality = good_count / total_count
+    availability = run_time / total_time
+    performance = total_count / target_count
+    return (availability, performance, quality, quality * availability * performance,
+            good_count, total_count, run_time, total_time, target_count, time)
+
+
+class FakeDatabase:
+
+    def __init__(self, assets=(), history_rows=720):
+        self.history_rows = history_rows
+        self.load(assets)
+
+    def load(self, assets):
+        # Replace the assets, and give every asset one latest reading
+        self.assets = list(assets)
+        self.latest = {
+            (item['object_type'], item['id']): make_reading(item['object_type'], item['id'], EPOCH)
+            for item in self.assets
+        }
+        # Latest counts of every cell, and the parent sums rebuilt from them
+        self.cell_latest = {key: (*reading[4:9], reading[9]) for key, reading in self.latest.items() if key[0] == 0}
+        self.parent_totals = {}
+
+    def connect(self):
+        return FakeConnection(self)
+
+    # Query handlers. Each returns the column names and the rows of the result.
+
+    def select_assets(self, query, params):
+        columns = ['id', 'name', 'description', 'parent_id', 'object_type']
+        return columns, [tuple(item[column] for column in columns) for item in self.assets]
+
+    def select_latest(self, query, params):
+        if 'unnest' in query:
+            keys = zip(params[0], params[1])
+        else:
+            keys = ((item['object_type'], item['id']) for item in self.assets
+                    if item['object_type'] == params[0])
+
+        rows = []
+        for key in keys:
+            reading = self.latest.get(key)
+            if reading is not None:
+                rows.append((*key, *reading))
+        return None, rows
+
+    def select_latest_one(self, query, params):
+        reading = self.latest.get((params['object_type'], params['object_id']))
+        return None, [reading] if reading is not None else []
+
+    def select_cell_latest(self, query, params):
+        keys = zip(params[0], params[1]) if params else sorted(self.cell_latest)
+        return None, [(*key, *self.cell_latest[key]) for key in keys if key in self.cell_latest]
+
+    def insert_cell_latest(self, query, rows):
+        for key in rows:
+            self.cell_latest.setdefault(tuple(key), (0.0, 0.0, 0.0, 0.0, 0.0, EPOCH - timedelta(days=3650)))
+        return None, []
+
+    def update_cell_latest(self, query, rows):
+        for object_type, object_id, *values in rows:
+            self.cell_latest[(object_type, object_id)] = tuple(values)
+        return None, []
+
+    def upsert_parent_totals(self, query, rows):
+        # Rows of (object_type, object_id, good_count, total_count, run_time, total_time,
+        # target_count, time); returned as readings in the latest_columns order
+        stored = []
+        for object_type, object_id, *counts, time in rows:
+            key = (object_type, object_id)
+            if 'RETURNING' in query and key in self.parent_totals:
+                *before, before_time = self.parent_totals[key]
+                counts, time = [count + old for count, old in zip(counts, before)], max(time, before_time)
+            self.parent_totals[key] = (*counts, time)
+
+            good_count, total_count, run_time, total_time, target_count = counts
+            quality = good_count / total_count if total_count else None
+            availability = run_time / total_time if total_time else None
+            performance = total_count / target_count if target_count else None
+            oee = quality * availability * performance if None not in (quality, availability, performance) else None
+            stored.append((*key, availability, performance, quality, oee, *counts, time))
+        return None, stored
+
+    def select_history(self, query, params):
+        if 'ANY(' not in query:
+            return None, self.history_of(query, params[0], params[1])
+
+        # Several assets: (object_type, object_ids) pairs before the range, and rows starting
+        # with their key, in key order
+        rows = []
+        pairs = params[:-2]
+        for object_type, object_ids in sorted(zip(pairs[0::2], pairs[1::2])):
+            for object_id in sorted(object_ids):
+                rows.extend((object_type, object_id, *row) for row in self.history_of(query, object_type, object_id))
+        return None, rows
+
+    def history_of(self, query, object_type, object_id):
+        reading = make_reading(object_type, object_id, EPOCH)
+
+        if 'time AS timestamp' in query:
+            # Raw rows: timestamp first, then the reading
+            return [(EPOCH + timedelta(minutes=index), *reading[:-1]) for index in range(self.history_rows)]
+
+        # Buckets: ratios, summed counts and times, bucket, start and end
+        rows = []
+        for index in range(self.history_rows):
+            bucket = EPOCH + timedelta(hours=index)
+            rows.append((*reading[:4], *(value * 60 for value in reading[4:9]),
+                         bucket, bucket, bucket + timedelta(minutes=59)))
+        return rows
+
+    def insert_readings(self, query, rows):
+        # Rows in historian.write_oee_rows order; returned in its RETURNING order
+        stored = []
+        for (run_time, total_time, total_count, target_count, good_count, availability, performance,
+             quality, oee, time, object_type, object_id) in rows:
+            if isinstance(time, str):
+                time = datetime.fromisoformat(time)
+            if time.tzinfo is None:
+                time = time.replace(tzinfo=timezone.utc)
+            reading = (availability, performance, quality, oee, good_count, total_count,
+                       run_time, total_time, target_count, time)
+            self.latest[(object_type, object_id)] = reading
+            stored.append((object_type, object_id, *reading))
+        return None, stored
+
+    def dispatch(self, query, params, values):
+        if 'INSERT INTO oee_data (' in query:
+            return self.insert_readings(query, values)
+        if 'INSERT INTO oee_cell_latest' in query:
+            return self.insert_cell_latest(query, values)
+        if 'UPDATE oee_cell_latest' in query:
+            return self.update_cell_latest(query, values)
+        if 'FROM oee_cell_latest' in query:
+            return self.select_cell_latest(query, params)
+        if 'INSERT INTO oee_parent_totals' in query:
+            return self.upsert_parent_totals(query, values)
+        if 'CROSS JOIN LATERAL' in query:
+            return self.select_latest(query, params)
+        if 'UNION ALL' in query and 'deprecated' in query:
+            return self.select_assets(query, params)
+        if 'FROM shift_calendars' in query:
+            # No site has a shift calendar
+            return ['site_id', 'timezone', 'shifts'], []
+        if 'extract(epoch FROM' in query:
+            # Rolling-window seeds: the readings are older than every window
+            return None, []
+        if 'FROM oee_data' in query and 'LIMIT 1' in query:
+            return self.select_latest_one(query, params)
+        if 'FROM oee_data' in query:
+            return self.select_history(query, params)
+        # Rollup upserts, locks and anything else have no result
+        return None, []
+
+
+class FakeCursor:
+
+    def __init__(self, connection, database):
+        self.connection = connection
+        self.database = database
+        self.description = None
+        self.itersize = 2000
+        self._rows = iter(())
+        self._values = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._rows = iter(())
+
+    def mogrify(self, template, args=None):
+        # Used by execute_values to render each row; the rows are kept as values instead
+        self._values.append(args)
+        return b'()'
+
+    def execute(self, query, params=None):
+        if isinstance(query, bytes):
+            query = query.decode()
+        values, self._values = self._values, []
+
+        columns, rows = self.database.dispatch(query, params, values)
+        self.description = [(column,) for column in columns] if columns is not None else None
+        self._rows = iter(rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=None):
+        return list(itertools.islice(self._rows, size or self.itersize))
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class FakeConnectionInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    encoding = 'UTF8'
+
+    def __init__(self, database):
+        self.database = database
+        self.closed = 0
+        self.info = FakeConnectionInfo()
+
+    def cursor(self, name=None):
+        return FakeCursor(self, self.database)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
@@ -0,0 +1,56 @@
+import time
+import numpy as np
+
+
+def measure(name, func, items=1, min_time=1.0, min_iterations=5, max_iterations=100000, warmup=1,
+            setup=None):
+    """Call func repeatedly and summarise its latency.
+
+    func is called at least min_iterations times and until min_time seconds have been spent
+    in it. setup, when given, runs untimed before every call. items is the number of records
+    handled per call, used to report item throughput next to call throughput.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        func()
+
+    latencies = []
+    spent = 0.0
+    while len(latencies) < max_iterations and (len(latencies) < min_iterations or spent < min_time):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        latencies.append(elapsed)
+        spent += elapsed
+
+    samples = np.array(latencies)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        'name': name,
+        'iterations': len(latencies),
+        'items': items,
+        'mean': float(samples.mean()),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'calls_per_second': float(len(latencies) / spent) if spent else None,
+        'items_per_second': float(len(latencies) * items / spent) if spent else None,
+    }
+
+
+def format_seconds(value):
+    for unit, scale in (('s', 1.0), ('ms', 1e-3), ('us', 1e-6)):
+        if value >= scale:
+            return f"{value / scale:.2f}{unit}"
+    return f"{value / 1e-9:.0f}ns"
+
+
+def format_result(result):
+    return (
+        f"{result['name']:<36} {result['iterations']:>7}  "
+        f"p50 {format_seconds(result['p50']):>9}  p95 {format_seconds(result['p95']):>9}  "
+        f"p99 {format_seconds(result['p99']):>9}  {result['items_per_second']:>14,.0f} items/s"
+    )
@@ -0,0 +1,304 @@
+"""Run the benchmark suite and save the results as JSON.
+
+    python -m benchmarks.run                       # in-memory database
+    python -m benchmarks.run --db postgres --reset # the database configured by DB_* variables
+    python -m benchmarks.run --only tree --quick
+
+The postgres backend empties the asset and OEE tables of the configured database before
+loading its data set, so point it at a dedicated database.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fake_db import FakeDatabase, make_assets, make_reading, EPOCH
+from benchmarks.harness import measure, format_result
+
+TREE_SIZES = (100, 1000, 10000)
+HISTORY_ROWS = 720
+BATCH_SIZE = 10000
+STORE_BATCH_SIZE = 1000
+
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self):
+        self.database = FakeDatabase(history_rows=HISTORY_ROWS)
+
+    def setup(self):
+        from app.database import connection_pool
+        connection_pool._connect = self.database.connect
+
+    def load_assets(self, assets):
+        self.database.load(assets)
+
+
+class PostgresBackend:
+    name = 'postgres'
+
+    def setup(self):
+        from app.migrations import migrate
+        migrate()
+
+    def load_assets(self, assets):
+        from psycopg2.extras import execute_values
+        from app.database import connection_pool
+        from app.models.asset_tree import AssetTreeModel
+        from app.models.oee import OeeModel
+        from app.models.shift_calendar import ShiftCalendarModel
+
+        tables = [asset_class.table_name for asset_class in AssetTreeModel.asset_classes]
+        tables += ['oee_data'] + [table_name for table_name, _ in OeeModel.rollup_tables.values()]
+        tables += [OeeModel.shift_table, ShiftCalendarModel.table_name]
+        tables += [OeeModel.cell_latest_table, OeeModel.parent_totals_table]
+
+        with connection_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"TRUNCATE {', '.join(tables)}")
+
+                for asset_class in AssetTreeModel.asset_classes:
+                    execute_values(
+                        cur,
+                        f"INSERT INTO {asset_class.table_name} (id, name, description, parent_id, object_type) "
+                        "VALUES %s",
+                        [(item['id'], item['name'], item['description'], item['parent_id'], item['object_type'])
+                         for item in assets if item['object_type'] == asset_class.object_type]
+                    )
+
+                # One latest reading per asset, and a minute-by-minute history for cell 1
+                rows = [(item['object_type'], item['id'], *make_reading(item['object_type'], item['id'], EPOCH))
+                        for item in assets]
+                rows += [(0, 1, *make_reading(0, 1, EPOCH - timedelta(minutes=index)))
+                         for index in range(1, HISTORY_ROWS + 1)]
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO oee_data (object_type, object_id, availability, performance, quality, oee,
+                                          good_count, total_count, run_time, total_time, target_count, time)
+                    VALUES %s
+                    """,
+                    rows
+                )
+
+                for table_name, interval in OeeModel.rollup_tables.values():
+                    cur.execute(
+                        f"""
+                        INSERT INTO {table_name}
+                        SELECT object_type, object_id, time_bucket(%s::interval, time), count(*),
+                               sum(good_count), sum(total_count), sum(target_count), sum(run_time),
+                               sum(total_time), min(time), max(time)
+                        FROM oee_data
+                        GROUP BY 1, 2, 3
+                        """,
+                        (interval,)
+                    )
+                cur.execute(
+                    f"""
+                    INSERT INTO {OeeModel.cell_latest_table}
+                    SELECT DISTINCT ON (object_id) object_type, object_id, good_count, total_count, run_time,
+                           total_time, target_count, time
+                    FROM oee_data
+                    WHERE object_type = 0
+                    ORDER BY object_id, time DESC
+                    """
+                )
+            conn.commit()
+
+
+def reset_state():
+    # Drop everything the application keeps in memory between requests
+    from app.models.asset_index import asset_index
+    from app.models.oee_cache import latest_oee_cache
+    from app.services.hierarchy_rollup import hierarchy_rollup
+
+    asset_index.invalidate()
+    latest_oee_cache.clear()
+    hierarchy_rollup.invalidate()
+
+
+def calculation_cases(app, quick):
+    from app.services.oee import calculate_oee, calculate_oee_batch
+
+    record = {'good_count': 95, 'total_count': 100, 'run_time': 3200, 'total_time': 3600, 'target_count': 120}
+    columns = {name: [value] * BATCH_SIZE for name, value in record.items()}
+
+    yield measure('calc_scalar', lambda: calculate_oee(dict(record)), min_time=0.2 if quick else 1.0)
+    yield measure(f'calc_batch_{BATCH_SIZE}', lambda: calculate_oee_batch(dict(columns)), items=BATCH_SIZE,
+                  min_time=0.2 if quick else 1.0)
+
+
+def tree_cases(app, backend, quick):
+    from app.models.asset_index import asset_index
+    from app.models.asset_tree import AssetTreeModel
+
+    for size in TREE_SIZES:
+        assets = make_assets(size)
+        backend.load_assets(assets)
+        reset_state()
+
+        def build():
+            return AssetTreeModel.get_tree(asset_index.nodes())
+
+        yield measure(f'tree_cold_{size}', build, items=len(assets), setup=reset_state,
+                      min_time=0.2 if quick else 1.0)
+        yield measure(f'tree_warm_{size}', build, items=len(assets), min_time=0.2 if quick else 1.0)
+
+        tree = build()
+        with app.app_context():
+            yield measure(f'tree_json_{size}', lambda: app.json.dumps(tree), items=len(assets),
+                          min_time=0.2 if quick else 1.0)
+
+
+def latest_cases(app, backend, quick):
+    from app.models.oee import OeeModel
+    from app.models.oee_cache import latest_oee_cache
+
+    assets = make_assets(TREE_SIZES[-1])
+    backend.load_assets(assets)
+    reset_state()
+    keys = [(item['object_type'], item['id']) for item in assets[:1000]]
+
+    yield measure('latest_single_cached', lambda: OeeModel.get_latest_oee(0, 1), min_time=0.2 if quick else 1.0)
+    yield measure('latest_single_uncached', lambda: OeeModel.get_latest_oee(0, 1), setup=latest_oee_cache.clear,
+                  min_time=0.2 if quick else 1.0)
+    yield measure('latest_batch_1000_uncached', lambda: OeeModel.get_latest_oee_many(keys), items=len(keys),
+                  setup=latest_oee_cache.clear, min_time=0.2 if quick else 1.0)
+
+    # Worst 20 cells of the fleet, from the cached latest readings
+    cells = sum(1 for item in assets if item['object_type'] == 0)
+    client = app.test_client()
+    yield measure('rank_cells_worst_20', lambda: client.get('/oee/rank?level=cell&n=20').data, items=cells,
+                  min_time=0.2 if quick else 1.0)
+
+
+def history_cases(app, backend, quick):
+    from app.models.oee import OeeModel, history_row_class
+    from app.services.oee import get_oee_by_date_range
+    from app.services.downsample import downsample_rows, downsample_methods
+
+    backend.load_assets(make_assets(TREE_SIZES[0]))
+    reset_state()
+    start, end = '2023-12-01 00:00:00', '2024-01-01 00:00:00'
+    client = app.test_client()
+    days = max(len(get_oee_by_date_range(0, 1, start, end)), 1)
+    rows = OeeModel.get_oee_by_rollup(0, 1, start, end, 'hour')
+    hours = max(len(rows), 1)
+
+    yield measure('history_daily_aggregate', lambda: get_oee_by_date_range(0, 1, start, end), items=days,
+                  min_time=0.2 if quick else 1.0)
+    yield measure('history_hourly_rollup', lambda: OeeModel.get_oee_by_rollup(0, 1, start, end, 'hour'),
+                  items=hours, min_time=0.2 if quick else 1.0)
+    yield measure('history_hourly_route',
+                  lambda: client.get(f'/oee/history/0/1?start_date={start}&end_date={end}&bucket=hour').data,
+                  items=hours, min_time=0.2 if quick else 1.0)
+
+    # Hourly history of every cell of a line, read with one query
+    batch = {'parent': [1, 1], 'level': 0, 'start_date': start, 'end_date': end, 'bucket': 'hour'}
+    series = client.post('/oee/history/batch', json=batch).get_json()
+    batch_rows = max(sum(len(entry['history']) for entry in series), 1)
+    yield measure(f'history_batch_line_{len(series)}_cells',
+                  lambda: client.post('/oee/history/batch', json=batch).data,
+                  items=batch_rows, min_time=0.2 if quick else 1.0)
+
+    with app.app_context():
+        yield measure('history_json', lambda: app.json.dumps(rows), items=hours,
+                      min_time=0.2 if quick else 1.0)
+
+    # A year of minute readings reduced to a chart width
+    raw_row = history_row_class(OeeModel.raw_columns)
+    year = [raw_row(EPOCH + timedelta(minutes=index), *make_reading(0, index, EPOCH)[:-1]) for index in range(525600)]
+    for method in downsample_methods:
+        yield measure(f'history_downsample_{method}_800', lambda: downsample_rows(year, 800, method=method),
+                      items=len(year), min_time=0.2 if quick else 1.0)
+
+
+def ingest_cases(app, backend, quick):
+    from app.services.oee import calculate_oee, store_oee_batch
+    from app.services.historian import insert_oee_data
+
+    backend.load_assets(make_assets(TREE_SIZES[1]))
+    reset_state()
+    cells = [item['id'] for item in make_assets(TREE_SIZES[1]) if item['object_type'] == 0]
+    record = {'good_count': 95, 'total_count': 100, 'run_time': 3200, 'total_time': 3600, 'target_count': 120,
+              'object_type': 0, 'object_id': cells[0]}
+    columns = {name: [value] * STORE_BATCH_SIZE for name, value in record.items()}
+    columns['object_id'] = [cells[index % len(cells)] for index in range(STORE_BATCH_SIZE)]
+
+    with app.app_context():
+        yield measure('ingest_scalar', lambda: insert_oee_data(calculate_oee(dict(record))),
+                      min_time=0.2 if quick else 1.0)
+    yield measure(f'ingest_batch_{STORE_BATCH_SIZE}', lambda: store_oee_batch(dict(columns)),
+                  items=STORE_BATCH_SIZE, min_time=0.2 if quick else 1.0)
+
+
+GROUPS = {
+    'calc': lambda app, backend, quick: calculation_cases(app, quick),
+    'tree': tree_cases,
+    'latest': latest_cases,
+    'history': history_cases,
+    'ingest': ingest_cases,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the OEE application benchmarks.")
+    parser.add_argument('--db', choices=['memory', 'postgres'], default='memory',
+                        help="database to run against (default: memory)")
+    parser.add_argument('--reset', action='store_true',
+                        help="allow the postgres backend to empty the configured database")
+    parser.add_argument('--only', action='append', choices=sorted(GROUPS),
+                        help="run only these groups; may be repeated")
+    parser.add_argument('--quick', action='store_true', help="shorter runs, for a rough check")
+    parser.add_argument('--output', help="file to write the JSON results to "
+                                         "(default: benchmarks/results/<commit>-<db>.json)")
+    args = parser.parse_args(argv)
+
+    if args.db == 'postgres' and not args.reset:
+        parser.error("--db postgres empties the asset and OEE tables; pass --reset to confirm")
+
+    from app import create_app
+    from app.limiter import limiter
+
+    backend = MemoryBackend() if args.db == 'memory' else PostgresBackend()
+    backend.setup()
+    app = create_app()
+    limiter.enabled = False
+
+    results = []
+    for group in args.only or GROUPS:
+        for result in GROUPS[group](app, backend, args.quick):
+            print(format_result(result), flush=True)
+            results.append(result)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'db': args.db,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results', f"{commit or 'unknown'}-{args.db}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
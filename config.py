@@ -5,6 +5,64 @@ class Config(object):
     DEBUG = False
     TESTING = False
 
+    # Write-behind ingest for /oee/calculate/store
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes")
+    WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", 10000))
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 1.0))
+    WRITE_BEHIND_BLOCK_TIMEOUT = float(os.getenv("WRITE_BEHIND_BLOCK_TIMEOUT", 0))
+    WRITE_BEHIND_DRAIN_TIMEOUT = float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT", 30))
+    WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", 5))
+    WRITE_BEHIND_RETRY_BACKOFF = float(os.getenv("WRITE_BEHIND_RETRY_BACKOFF", 0.5))
+
+    # Cache of the latest OEE reading per asset. The cache is per worker process; it is expired
+    # when the write version shared by the workers shows another worker has stored readings,
+    # checked every LATEST_CACHE_CHECK_INTERVAL seconds. LATEST_CACHE_TTL only bounds the
+    # staleness when that version cannot be read.
+    LATEST_CACHE_SIZE = int(os.getenv("LATEST_CACHE_SIZE", 10000))
+    LATEST_CACHE_TTL = float(os.getenv("LATEST_CACHE_TTL", 300))
+    LATEST_CACHE_CHECK_INTERVAL = float(os.getenv("LATEST_CACHE_CHECK_INTERVAL", 1))
+
+    # In-memory asset hierarchy index
+    ASSET_INDEX_TTL = float(os.getenv("ASSET_INDEX_TTL", 60))
+
+    # Seconds before the shift calendars are reloaded, picking up changes from other workers
+    SHIFT_CALENDAR_TTL = float(os.getenv("SHIFT_CALENDAR_TTL", 60))
+    # Seconds of stored readings a site's first shift calendar is applied to
+    SHIFT_CALENDAR_BACKFILL = float(os.getenv("SHIFT_CALENDAR_BACKFILL", 7 * 86400))
+
+    # Seconds after its end_date before a history range is served as immutable
+    HISTORY_CLOSED_AFTER = float(os.getenv("HISTORY_CLOSED_AFTER", 300))
+
+    # Line, area, site and enterprise OEE derived from cell readings on ingest
+    HIERARCHY_ROLLUP_ENABLED = os.getenv("HIERARCHY_ROLLUP_ENABLED", "true").lower() in ("1", "true", "yes")
+    HIERARCHY_ROLLUP_RESEED_INTERVAL = float(os.getenv("HIERARCHY_ROLLUP_RESEED_INTERVAL", 300))
+
+    # Rolling-window OEE per asset, kept in memory in bins of ROLLING_OEE_RESOLUTION seconds
+    ROLLING_OEE_ENABLED = os.getenv("ROLLING_OEE_ENABLED", "true").lower() in ("1", "true", "yes")
+    ROLLING_OEE_WINDOWS = os.getenv("ROLLING_OEE_WINDOWS", "1h,8h,24h")
+    ROLLING_OEE_RESOLUTION = int(os.getenv("ROLLING_OEE_RESOLUTION", 60))
+    ROLLING_OEE_RESEED_INTERVAL = float(os.getenv("ROLLING_OEE_RESEED_INTERVAL", 300))
+
+    # Per-client rate limits. Ingest covers the calculate and store routes, write the routes that
+    # change assets and shift calendars, read every other route; batch routes are charged one
+    # unit per record. The default memory:// storage keeps one set of counters per worker
+    # process; production deployments share them through RATELIMIT_STORAGE_URI, e.g. redis://localhost:6379
+    RATELIMIT_INGEST = os.getenv("RATELIMIT_INGEST", "100000/minute;20000/second")
+    RATELIMIT_WRITE = os.getenv("RATELIMIT_WRITE", "120/minute;10/second")
+    RATELIMIT_READ = os.getenv("RATELIMIT_READ", "600/minute;60/second")
+    RATELIMIT_KEY_HEADER = os.getenv("RATELIMIT_KEY_HEADER", "X-API-Key")
+    RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
+    RATELIMIT_STRATEGY = os.getenv("RATELIMIT_STRATEGY", "sliding-window-counter")
+    RATELIMIT_HEADERS_ENABLED = True
+    RATELIMIT_IN_MEMORY_FALLBACK_ENABLED = True
+
+    # JSON responses write datetimes in ISO 8601; enable to write HTTP dates, as earlier releases did
+    JSON_HTTP_DATES = os.getenv("JSON_HTTP_DATES", "false").lower() in ("1", "true", "yes")
+
+    # Request, query and pool metrics served on /metrics
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
 
 class ProductionConfig(Config):
     DEBUG = False
@@ -0,0 +1,29 @@
+# Gunicorn settings. Start the application with:
+#   gunicorn -c gunicorn.conf.py run:app
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+
+# "gevent" serves every request on a greenlet and makes database waits cooperative, so a worker
+# can hold hundreds of slow requests at once; "sync" or "gthread" keep one thread per request
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        from app.green import make_psycopg2_green
+        make_psycopg2_green()
+
+
+def on_starting(server):
+    # memory:// keeps the rate limit counters in each worker, so every worker grants a client
+    # the full budget
+    storage_uri = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
+    if workers > 1 and storage_uri.startswith("memory://"):
+        server.log.warning(
+            "RATELIMIT_STORAGE_URI is memory:// with %d workers: each worker keeps its own rate limit "
+            "counters, so clients get %d times their budget. Set it to a shared Redis or Memcached "
+            "instance in production.", workers, workers
+        )